@@ -10,53 +10,311 @@ be executed.
 If errors occur in the code generation phase, will normally be output to the
 console only.
 
-Author: Greg Phillips
+By default files are compiled serially, straight from the templates; the options
+select worker processes, incremental builds, the IR backend, optimizations and
+per-phase timing (see `--help`). Results are always reported and written in sorted
+file name order.
+
+Usage: python batch_compile.py [--jobs N] [--incremental] [--backend {templates,ir}]
+    [--peephole] [--phase-report PATH [--trace-memory]] [other options]
 
-Version: 2023-03-15
+Author: Greg Phillips
 """
 
+import argparse
 import os
 import sys
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import partial
 
-from antlr4 import ParseTreeWalker
+from build_cache import BuildCache, compiler_version, file_digest
+from constant_folding import FoldConstants
+from dfa_cache import DEFAULT_DFA_CACHE, load_dfa_cache
 from generic_parser import parse, SyntaxErrors
+import ir
 from nimble import NimbleParser, NimbleLexer
-from nimble2MIPS import MIPSGenerator
+from nimble2MIPS import MIPSGenerator, StreamingMIPSGenerator
+import peephole
+from phase_timing import PhaseTimes, format_summary, summarize, untimed, write_report
 from semantics import do_semantic_analysis, NimbleSemanticErrors
 
 
-def compile_nimble_source_files():
+@dataclass(frozen=True)
+class CompileOptions:
+    """Settings that select how each file is compiled."""
+    two_stage_parse: bool = False
+    stream_output: bool = False
+    peephole: bool = False
+    backend: str = 'templates'  # or 'ir'
+    length_prefixed_strings: bool = False
+    inline_concat_in_loops: bool = False
+    annotate_lines: bool = False
+
+
+def compile_nimble_file(nimble_filename, name, mips_filename=None, options=CompileOptions(), phases=None):
+    """
+    Lexes, parses, analyses and generates MIPS for a single Nimble source file.
+
+    :param nimble_filename: Path to the Nimble source file
+    :param name: The file name, used in error reports
+    :param mips_filename: Path of the .asm file to stream the MIPS to, if the options
+        ask for streaming
+    :param options: The `CompileOptions` to compile with
+    :param phases: Optional; the `phase_timing.PhaseTimes` to time the compile in. Streamed
+        MIPS is written during code generation, so has no separate write phase.
+    :return: An `(output, error_found)` tuple, where `output` is either the generated
+        MIPS or the report of the errors found; it is None if the MIPS was streamed
+    """
+    if not (options.stream_output and mips_filename):
+        return compile_nimble(nimble_filename, name, from_file=True, options=options, phases=phases)
+
+    partial_filename = f'{mips_filename}.partial'
+    with open(partial_filename, 'w') as out:
+        output, error_found = compile_nimble(nimble_filename, name, from_file=True,
+                                             options=options, out=out, phases=phases)
+    if error_found:
+        os.remove(partial_filename)
+        return output, error_found
+    os.replace(partial_filename, mips_filename)
+    return None, False
+
+
+def compile_nimble(source_or_path, name, from_file=False, options=CompileOptions(), out=None,
+                   phases=None):
+    """
+    As `compile_nimble_file`, but `source_or_path` may also be the Nimble source itself.
+    If `out` is given, the MIPS is streamed to that file object, and the output
+    returned is empty unless errors were found.
+    """
+    error_found = False
+    output = ''
+    phase = phases.phase if phases is not None else untimed
+    try:
+        tree = parse(source_or_path, 'script', NimbleLexer, NimbleParser, from_file=from_file,
+                     two_stage=options.two_stage_parse, phases=phases)
+        mips = {}
+        constants = {}
+        program = ir.Program()
+
+        if out is not None and options.peephole:
+            out = peephole.OptimizingWriter(out)
+
+        def code_generation(global_scope, node_types):
+            if options.backend == 'ir':
+                return [FoldConstants(node_types, constants),
+                        ir.BuildIR(global_scope, node_types, constants, program)]
+            if out is None:
+                generator = MIPSGenerator(global_scope, node_types, mips, constants,
+                                          options.length_prefixed_strings, options.inline_concat_in_loops,
+                                          options.annotate_lines)
+            else:
+                generator = StreamingMIPSGenerator(global_scope, node_types, mips, out, constants,
+                                                   options.length_prefixed_strings,
+                                                   options.inline_concat_in_loops, options.annotate_lines)
+            return [FoldConstants(node_types, constants), generator]
+
+        # code is generated in the same walk as type inference, see do_semantic_analysis
+        do_semantic_analysis(tree, code_generation, phases)
+        with phase('codegen'):
+            if options.backend == 'ir':
+                output = ir.generate_mips(ir.optimize(program), options.length_prefixed_strings,
+                                          options.inline_concat_in_loops)
+                if out is not None:
+                    out.write(output)
+                    output = ''
+            else:
+                output = mips[tree]
+            if isinstance(out, peephole.OptimizingWriter):
+                out.finish()
+            elif options.peephole:
+                output = peephole.optimize(output)
+    except FileNotFoundError as fnf:
+        output = str(fnf)
+        error_found = True
+    except SyntaxErrors as se:
+        output = f'\nSyntax error(s) in {name}\n{se}'
+        error_found = True
+    except NimbleSemanticErrors as nse:
+        output = f'\nSemantic error(s) in {name}\n{nse}'
+        error_found = True
+    return output, error_found
+
+
+def timed_compile_nimble_file(nimble_filename, name, mips_filename=None, options=CompileOptions(),
+                              trace_memory=False):
+    """
+    As `compile_nimble_file`, but times each phase of the compile, tracing the memory
+    allocated too if `trace_memory`, and returns an `(output, error_found, phases)`
+    tuple, with the `PhaseTimes`. In a worker process, tracing is started by the first
+    file, and left on for the rest the worker is handed.
+    """
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    phases = PhaseTimes(name)
+    output, error_found = compile_nimble_file(nimble_filename, name, mips_filename, options, phases)
+    return output, error_found, phases
+
+
+def preload_dfa_cache(dfa_cache_path):
+    if dfa_cache_path:
+        load_dfa_cache(dfa_cache_path, NimbleLexer, NimbleParser)
+
+
+def compile_nimble_source_files(jobs=1, incremental=False, dfa_cache_path=DEFAULT_DFA_CACHE,
+                                options=CompileOptions(), phase_report=None, trace_memory=False):
+    """
+    Compiles every file in nimble_source into generated_mips.
+
+    :param jobs: Number of worker processes; 1 (the default) compiles serially in
+        this process
+    :param incremental: If True, skip files whose cached result is still current
+    :param dfa_cache_path: Trained DFA cache to preload, if it exists; None to skip
+    :param options: The `CompileOptions` to compile each file with
+    :param phase_report: Optional; path of a JSON or CSV file to write the time spent
+        in each phase of compiling each file to, also summarized on the console. Files
+        skipped as unchanged aren't included.
+    :param trace_memory: If True, the phase report includes the peak memory allocated
+        in each phase
+    :return: The `PhaseTimes` of each file compiled, if a phase report was asked for
+    """
     source_dir = os.path.join(os.getcwd(), 'nimble_source')
     output_dir = os.path.join(os.getcwd(), 'generated_mips')
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
-    source_files = os.listdir(source_dir)
+    source_files = sorted(os.listdir(source_dir))
+
+    cache = BuildCache(output_dir, compiler_version(), repr(options)) if incremental else None
+    source_digests = {}
+    stale_files = []
     for name in source_files:
-        error_found = False
-        output = ''
-        try:
-            nimble_filename = os.path.join(source_dir, name)
-            tree = parse(nimble_filename, 'script', NimbleLexer, NimbleParser, from_file=True)
-            global_scope, node_types = do_semantic_analysis(tree)
-            mips = {}
-            ParseTreeWalker().walk(MIPSGenerator(global_scope, node_types, mips), tree)
-            output = mips[tree]
-        except FileNotFoundError as fnf:
-            output = fnf
-            error_found = True
-        except SyntaxErrors as se:
-            output = f'\nSyntax error(s) in {name}\n{se}'
-            error_found = True
-        except NimbleSemanticErrors as nse:
-            output = f'\nSemantic error(s) in {name}\n{nse}'
-            error_found = True
-        finally:
-            if error_found:
-                print(output, file=sys.stderr)
-            mips_filename = os.path.join(output_dir, f'{name.split(".")[0]}.asm')
-            with open(mips_filename, 'w') as mf:
-                mf.write(output)
+        if cache:
+            source_digests[name] = file_digest(os.path.join(source_dir, name))
+            cached = cache.lookup(name, source_digests[name], mips_filename_for(output_dir, name))
+            if cached is not None:
+                error_report, error_found = cached
+                if error_found:
+                    print(error_report, file=sys.stderr)
+                continue
+        stale_files.append(name)
+    nimble_filenames = [os.path.join(source_dir, name) for name in stale_files]
+    mips_filenames = [mips_filename_for(output_dir, name) for name in stale_files]
+    if phase_report:
+        compile_file = partial(timed_compile_nimble_file, options=options, trace_memory=trace_memory)
+    else:
+        compile_file = partial(compile_nimble_file, options=options)
+    timed = bool(phase_report)
+
+    # traced here too, for the writes, even if the compiles are in worker processes
+    tracing = timed and trace_memory and not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+    try:
+        if jobs > 1 and len(stale_files) > 1:
+            with ProcessPoolExecutor(max_workers=jobs, initializer=preload_dfa_cache,
+                                     initargs=(dfa_cache_path,)) as executor:
+                # map yields results in submission order, so reporting stays deterministic
+                chunk_size = max(1, len(stale_files) // (jobs * 4))
+                results = executor.map(compile_file, nimble_filenames, stale_files, mips_filenames,
+                                       chunksize=chunk_size)
+                phase_times = write_results(output_dir, stale_files, results, cache, source_digests, timed)
+        else:
+            preload_dfa_cache(dfa_cache_path)
+            results = map(compile_file, nimble_filenames, stale_files, mips_filenames)
+            phase_times = write_results(output_dir, stale_files, results, cache, source_digests, timed)
+    finally:
+        if tracing:
+            tracemalloc.stop()
+
+    if cache:
+        cache.save(source_files)
+    if phase_report:
+        write_report(phase_report, phase_times)
+        if phase_times:
+            print(format_summary(summarize(phase_times)))
+        return phase_times
+
+
+def mips_filename_for(output_dir, name):
+    return os.path.join(output_dir, f'{name.split(".")[0]}.asm')
+
+
+def write_results(output_dir, source_files, results, cache=None, source_digests=None, timed=False):
+    """
+    Reports any errors to the console and writes each output to its .asm file, in the
+    order of `source_files`, unless it was streamed there already. If a `cache` is
+    given, records each result in it. If the results are `timed`, each includes the
+    `PhaseTimes` of its compile (see `timed_compile_nimble_file`); the writes are timed
+    in them too, and the list of them is returned.
+    """
+    phase_times = []
+    for name, result in zip(source_files, results):
+        if timed:
+            output, error_found, phases = result
+            phase_times.append(phases)
+        else:
+            (output, error_found), phases = result, None
+        if error_found:
+            print(output, file=sys.stderr)
+        mips_filename = mips_filename_for(output_dir, name)
+        if output is not None:
+            with phases.phase('write') if phases is not None else untimed('write'):
+                with open(mips_filename, 'w') as mf:
+                    mf.write(output)
+        if cache:
+            cache.store(name, source_digests[name], mips_filename, output if error_found else None)
+    return phase_times
+
+
+def parse_arguments(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Compile nimble_source/* into generated_mips/')
+    arg_parser.add_argument('-j', '--jobs', type=int, default=1,
+                            help='number of worker processes, each keeping its lexer and parser DFA caches '
+                                 'warm across the files it is handed (default: 1, compile serially)')
+    arg_parser.add_argument('--incremental', action='store_true',
+                            help='skip files whose source and compiler are unchanged since the last '
+                                 'incremental build, reusing their .asm or re-reporting their errors')
+    arg_parser.add_argument('--dfa-cache', metavar='PATH', default=DEFAULT_DFA_CACHE,
+                            help='trained lexer/parser DFA cache to preload if present, in this process '
+                                 'or every worker (default: %(default)s)')
+    arg_parser.add_argument('--two-stage', action='store_true',
+                            help='parse with fast SLL prediction first, falling back to full LL only for '
+                                 'files with syntax errors')
+    arg_parser.add_argument('--stream', action='store_true',
+                            help='write each .asm file while generating it, with the data section last')
+    arg_parser.add_argument('--peephole', action='store_true',
+                            help='peephole optimize the generated MIPS')
+    arg_parser.add_argument('--backend', choices=('templates', 'ir'), default='templates',
+                            help='generate code straight from the templates, or through the '
+                                 'optimizing intermediate representation (default: %(default)s)')
+    arg_parser.add_argument('--length-prefixed-strings', action='store_true',
+                            help='store each string with its length, making stringlength a single load')
+    arg_parser.add_argument('--inline-concat-in-loops', action='store_true',
+                            help='inline string concatenations in while loops, rather than calling '
+                                 'the concatenation routine')
+    arg_parser.add_argument('--annotate-lines', action='store_true',
+                            help='annotate the generated MIPS with the Nimble source lines it comes from, '
+                                 'for profiling')
+    arg_parser.add_argument('--phase-report', metavar='PATH',
+                            help='time each phase of compiling each file, writing the times to PATH '
+                                 'as JSON, or as CSV if PATH ends with .csv, and summarizing them; code '
+                                 'generation is then walked separately from type inference')
+    arg_parser.add_argument('--trace-memory', action='store_true',
+                            help='with --phase-report, also record the peak memory allocated in each phase')
+    return arg_parser.parse_args(argv)
 
 
 if __name__ == '__main__':
-    compile_nimble_source_files()
+    arguments = parse_arguments()
+    compile_nimble_source_files(jobs=arguments.jobs, incremental=arguments.incremental,
+                                dfa_cache_path=arguments.dfa_cache,
+                                phase_report=arguments.phase_report,
+                                trace_memory=arguments.trace_memory,
+                                options=CompileOptions(two_stage_parse=arguments.two_stage,
+                                                       stream_output=arguments.stream,
+                                                       peephole=arguments.peephole,
+                                                       backend=arguments.backend,
+                                                       length_prefixed_strings=arguments.length_prefixed_strings,
+                                                       inline_concat_in_loops=arguments.inline_concat_in_loops,
+                                                       annotate_lines=arguments.annotate_lines))
@@ -0,0 +1,111 @@
+"""
+An on-disk cache that lets `batch_compile` skip Nimble files that haven't changed
+since they were last compiled.
+
+Each entry is keyed by the file name and records a hash of the source bytes, the
+compiler version it was built with, and the size and modification time of the
+`.asm` it produced. A file is only skipped if all of these still match, so editing
+the source, editing the compiler, or touching the generated file all force a
+rebuild. Error reports are cached too, so files that failed to compile are reported
+again without being re-analysed.
+
+The compiler version is a hash over the grammar and every Python module of the
+compiler itself: the top-level modules, plus those of every package and subpackage
+found alongside them (e.g. `nimble`, `semantics`, `ir` and the bundled `antlr4`), so
+that new packages are covered without having to be listed.
+"""
+
+import hashlib
+import json
+import os
+
+CACHE_FILENAME = '.nimble_build_cache.json'
+
+COMPILER_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def file_digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def package_directories(root):
+    """The directories of the packages under `root`, subpackages included."""
+    directories = []
+    for directory, subdirectories, _ in os.walk(root):
+        # only packages, and the packages in them, are descended into
+        subdirectories[:] = sorted(name for name in subdirectories
+                                   if os.path.isfile(os.path.join(directory, name, '__init__.py')))
+        if directory != root:
+            directories.append(directory)
+    return directories
+
+
+def compiler_version(root=COMPILER_ROOT):
+    """
+    Returns a hash identifying the current compiler: the grammar plus every `.py`
+    file at the top level of `root` and in the packages under it.
+    """
+    paths = [os.path.join(root, 'Nimble.g4')]
+    for directory in (root, *package_directories(root)):
+        paths.extend(os.path.join(directory, name) for name in os.listdir(directory)
+                     if name.endswith('.py'))
+    version = hashlib.sha256()
+    for path in sorted(paths):
+        version.update(os.path.relpath(path, root).encode())
+        version.update(file_digest(path).encode())
+    return version.hexdigest()
+
+
+class BuildCache:
+    """
+    Maps source file names to the result of their last compilation. Use `lookup` to
+    find out whether a file can be skipped, `store` after compiling it, and `save` to
+    persist the cache once the batch is done.
+    """
+
+    def __init__(self, output_dir, version, options=''):
+        self.path = os.path.join(output_dir, CACHE_FILENAME)
+        self.key = f'{version}:{options}'
+        self.entries = {}
+        try:
+            with open(self.path) as f:
+                contents = json.load(f)
+            if contents.get('key') == self.key:
+                self.entries = contents['entries']
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass  # missing or unreadable cache; everything gets rebuilt
+
+    @staticmethod
+    def _stat(asm_path):
+        stat = os.stat(asm_path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def lookup(self, name, source_digest, asm_path):
+        """
+        Returns the cached `(output, error_found)` for `name` if its source and
+        generated file are unchanged, or `None` if it has to be recompiled. For
+        successful compiles `output` is `None`; the `.asm` on disk is already current.
+        """
+        entry = self.entries.get(name)
+        if entry is None or entry['source'] != source_digest:
+            return None
+        try:
+            if self._stat(asm_path) != entry['asm']:
+                return None
+        except OSError:
+            return None
+        return entry['error_report'], entry['error_report'] is not None
+
+    def store(self, name, source_digest, asm_path, error_report=None):
+        self.entries[name] = {'source': source_digest,
+                              'asm': self._stat(asm_path),
+                              'error_report': error_report}
+
+    def save(self, names):
+        """Writes the cache, dropping entries for any file not in `names`."""
+        entries = {name: self.entries[name] for name in names if name in self.entries}
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'w') as f:
+            json.dump({'key': self.key, 'entries': entries}, f)
+        os.replace(temporary_path, self.path)
@@ -0,0 +1,208 @@
+"""
+Benchmarks the compiler on synthetic Nimble programs (see `synthetic_nimble`), timing
+each phase of compiling them (see `phase_timing`), and compares the results with a
+saved baseline to catch regressions.
+
+The suite is one program of the default `Scale`, plus one scaled up along each axis
+in turn, and one scaled up along all of them. `--sweep` instead benchmarks programs
+scaled to each of a list of values along one axis, e.g. `--sweep statements=10,20,40`.
+
+Each program is compiled `--repeat` times, after an untimed compile to warm up the
+lexer's and parser's DFA caches, and garbage is collected before each compile. The
+best time of each phase is kept, as the least disturbed by anything else running.
+The .asm is written to a temporary file, to time the write too. With
+`--trace-memory`, the peak allocation of each phase is recorded as well, but tracing
+slows everything down, so the times are then only comparable with others taken
+while tracing.
+
+`--save PATH` stores the results as a JSON baseline; `--compare PATH` reports each
+phase's time relative to the baseline's, flagging those slower by more than
+`--threshold`, and exits with status 1 if any are. Differences under 5 ms are too
+noisy to flag. Changes to the number of lines of MIPS generated are reported
+too, since they mean the code generated has changed.
+
+Usage: python compile_benchmark.py [--repeat N] [--backend {templates,ir}]
+    [--sweep AXIS=V1,V2,...] [--trace-memory] [--save PATH] [--compare PATH]
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+from dataclasses import asdict, fields, replace
+
+from batch_compile import CompileOptions, compile_nimble, preload_dfa_cache
+from dfa_cache import DEFAULT_DFA_CACHE
+from phase_timing import PhaseTimes, ordered_phase_names
+from synthetic_nimble import Scale, generate_program
+
+SUITE = {
+    'base': Scale(),
+    'functions': Scale(functions=64),
+    'statements': Scale(statements=160),
+    'expression-depth': Scale(expression_depth=24),
+    'string-literals': Scale(string_literals=512),
+    'call-depth': Scale(functions=16, call_depth=16),
+    'large': Scale(functions=32, statements=80, expression_depth=6, string_literals=128, call_depth=4),
+}
+
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD = 1.25
+NOISE_SECONDS = 0.005
+
+
+def sweep(axis, values):
+    """Benchmarks of the default `Scale` with `axis` set to each of `values`."""
+    return {f'{axis}={value}': replace(Scale(), **{axis: value}) for value in values}
+
+
+def benchmark(name, scale, options=CompileOptions(), repeat=DEFAULT_REPEAT):
+    """
+    Compiles the program of the given `Scale` `repeat` times, returning the best time,
+    and highest peak allocation if traced, of each phase, with the sizes of the source
+    and the MIPS generated.
+    """
+    source = generate_program(scale)
+    output, error_found = compile_nimble(source, name, options=options)
+    if error_found:
+        raise ValueError(f'synthetic program {name} failed to compile: {output}')
+    runs = []
+    with tempfile.TemporaryDirectory() as directory:
+        mips_filename = os.path.join(directory, f'{name}.asm')
+        for _ in range(repeat):
+            gc.collect()
+            phases = PhaseTimes(name)
+            output, _ = compile_nimble(source, name, options=options, phases=phases)
+            with phases.phase('write'):
+                with open(mips_filename, 'w') as mf:
+                    mf.write(output)
+            runs.append(phases)
+
+    result = {'scale': asdict(scale), 'source_lines': source.count('\n'),
+              'mips_lines': output.count('\n'), 'phases': {}}
+    for phase_name in ordered_phase_names(runs):
+        records = [run.phases[phase_name] for run in runs if phase_name in run.phases]
+        peaks = [record.peak_bytes for record in records if record.peak_bytes is not None]
+        result['phases'][phase_name] = {'seconds': min(record.seconds for record in records),
+                                        'peak_bytes': max(peaks) if peaks else None}
+    result['total_seconds'] = sum(phase['seconds'] for phase in result['phases'].values())
+    return result
+
+
+def run_benchmarks(benchmarks, options=CompileOptions(), repeat=DEFAULT_REPEAT, trace_memory=False):
+    """Runs each of the named `Scale`s of `benchmarks`, returning the results as a baseline."""
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        results = {name: benchmark(name, scale, options, repeat) for name, scale in benchmarks.items()}
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    return {'options': repr(options), 'repeat': repeat, 'trace_memory': trace_memory,
+            'python': sys.version.split()[0], 'benchmarks': results}
+
+
+def format_results(results):
+    """A table of the time of each phase of each benchmark, in milliseconds."""
+    benchmarks = results['benchmarks']
+    phase_names = list(dict.fromkeys(phase_name for result in benchmarks.values()
+                                     for phase_name in result['phases']))
+    width = max(len(name) for name in [*benchmarks, 'benchmark'])
+    lines = [f'{"benchmark":<{width}} {"lines":>7} {"mips":>8}'
+             + ''.join(f' {phase_name:>9}' for phase_name in phase_names) + f' {"total ms":>9}']
+    for name, result in benchmarks.items():
+        row = f'{name:<{width}} {result["source_lines"]:>7} {result["mips_lines"]:>8}'
+        for phase_name in phase_names:
+            phase = result['phases'].get(phase_name)
+            row += f' {1000 * phase["seconds"]:>9.2f}' if phase else f' {"-":>9}'
+        lines.append(row + f' {1000 * result["total_seconds"]:>9.2f}')
+        peaks = [result['phases'][phase_name]['peak_bytes'] for phase_name in phase_names
+                 if phase_name in result['phases']]
+        if any(peak is not None for peak in peaks):
+            lines.append(f'{"  peak KiB":<{width}} {"":>7} {"":>8}'
+                         + ''.join(f' {peak / 1024:>9.1f}' if peak is not None else f' {"-":>9}'
+                                   for peak in peaks))
+    return '\n'.join(lines)
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Compares `results` with a `baseline` of the same benchmarks, returning a report of
+    the ratio of the current to the baseline time of each phase, and whether any phase
+    regressed: took longer than `threshold` times its baseline time.
+    """
+    lines = []
+    if results['options'] != baseline['options']:
+        lines.append(f'warning: baseline compiled with {baseline["options"]}')
+    if results['trace_memory'] != baseline.get('trace_memory', False):
+        lines.append('warning: memory was traced in only one of the runs, so times are not comparable')
+    regressed = False
+    for name, result in results['benchmarks'].items():
+        before = baseline['benchmarks'].get(name)
+        if before is None:
+            lines.append(f'{name}: not in baseline')
+            continue
+        if before['scale'] != result['scale']:
+            lines.append(f'{name}: scaled differently in baseline, skipped')
+            continue
+        ratios = []
+        for phase_name, phase in result['phases'].items():
+            previous = before['phases'].get(phase_name)
+            if previous is None or not previous['seconds']:
+                continue
+            ratio = phase['seconds'] / previous['seconds']
+            slower = ratio > threshold and phase['seconds'] - previous['seconds'] > NOISE_SECONDS
+            regressed = regressed or slower
+            ratios.append(f'{phase_name} {ratio:.2f}' + (' REGRESSED' if slower else ''))
+        total_ratio = result['total_seconds'] / before['total_seconds']
+        lines.append(f'{name}: total {total_ratio:.2f}; ' + ', '.join(ratios))
+        if result['mips_lines'] != before['mips_lines']:
+            lines.append(f'{name}: {before["mips_lines"]} -> {result["mips_lines"]} lines of MIPS')
+    return '\n'.join(lines), regressed
+
+
+def parse_sweep(text):
+    axis, _, values = text.partition('=')
+    axis = axis.replace('-', '_')
+    if axis not in {f.name for f in fields(Scale)} or not values:
+        raise argparse.ArgumentTypeError(f'expected AXIS=V1,V2,... with AXIS one of '
+                                         f'{", ".join(f.name for f in fields(Scale))}')
+    return sweep(axis, [int(value) for value in values.split(',')])
+
+
+def parse_arguments(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Time the compiler phases on synthetic Nimble programs.')
+    arg_parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                            help='times to compile each program, keeping the best (default: %(default)s)')
+    arg_parser.add_argument('--backend', choices=('templates', 'ir'), default='templates',
+                            help='code generator to benchmark (default: %(default)s)')
+    arg_parser.add_argument('--sweep', type=parse_sweep, metavar='AXIS=V1,V2,...',
+                            help='benchmark programs scaled to each value along one axis, instead of the suite')
+    arg_parser.add_argument('--trace-memory', action='store_true',
+                            help='also record the peak memory allocated in each phase')
+    arg_parser.add_argument('--save', metavar='PATH', help='save the results as a JSON baseline')
+    arg_parser.add_argument('--compare', metavar='PATH', help='compare the results with a saved baseline')
+    arg_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                            help='ratio to the baseline time above which a phase has regressed '
+                                 '(default: %(default)s)')
+    return arg_parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    arguments = parse_arguments()
+    preload_dfa_cache(DEFAULT_DFA_CACHE)
+    benchmark_results = run_benchmarks(arguments.sweep or SUITE, CompileOptions(backend=arguments.backend),
+                                       arguments.repeat, arguments.trace_memory)
+    print(format_results(benchmark_results))
+    if arguments.save:
+        with open(arguments.save, 'w') as f:
+            json.dump(benchmark_results, f, indent=2)
+    if arguments.compare:
+        with open(arguments.compare) as f:
+            report, any_regressed = compare(benchmark_results, json.load(f), arguments.threshold)
+        print(report)
+        if any_regressed:
+            sys.exit(1)
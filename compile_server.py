@@ -0,0 +1,148 @@
+"""
+A long-lived Nimble compile server. Importing the ANTLR runtime and deserializing the
+lexer and parser ATNs is paid once at startup, and the parser's DFA caches stay warm
+across requests, so editors and build tools get assembly back without per-invocation
+startup cost.
+
+The protocol is one JSON object per line. A request gives either the Nimble source
+or the path of a source file, plus an optional name used in error reports and an
+optional id which is echoed back:
+
+    {"id": 1, "source": "print 1", "name": "scratch.nimble"}
+    {"id": 2, "path": "nimble_source/while.nimble"}
+
+Each request gets exactly one response line:
+
+    {"id": 1, "ok": true, "asm": "..."}
+    {"id": 2, "ok": false, "errors": "..."}
+
+`ok` is false when the program has syntax or semantic errors, formatted as by
+`batch_compile`, and when the request itself is bad or the compiler fails; either
+way the reason is given in `errors`. A request of `{"command": "shutdown"}` stops the
+server, once it has been acknowledged with a response of `{"id": ..., "ok": true}`.
+
+By default requests are read from stdin and responses written to stdout. With
+`--socket PATH` the server listens on a Unix domain socket instead, serving one
+connection at a time with the same line protocol.
+
+At startup the lexer and parser DFAs are preloaded from a trained DFA cache, if one
+exists (see `dfa_cache`; `--dfa-cache PATH` selects another).
+"""
+
+import argparse
+import json
+import os
+import socketserver
+import sys
+
+from batch_compile import compile_nimble, preload_dfa_cache
+from dfa_cache import DEFAULT_DFA_CACHE
+
+
+class Shutdown(Exception):
+    """Raised for a shutdown request, with the response acknowledging it."""
+
+    def __init__(self, response):
+        super().__init__()
+        self.response = response
+
+
+def handle_request(line):
+    """
+    Compiles the request on the given line, returning the response object. Raises
+    `Shutdown`, with the response, if the request asks the server to stop.
+    """
+    try:
+        request = json.loads(line)
+    except ValueError as e:
+        return {'ok': False, 'errors': f'invalid request: {e}'}
+    if not isinstance(request, dict):
+        return {'ok': False, 'errors': 'invalid request: expected a JSON object'}
+
+    response = {'id': request.get('id')}
+    if request.get('command') == 'shutdown':
+        response.update(ok=True)
+        raise Shutdown(response)
+    elif 'source' in request:
+        source_or_path, from_file = request['source'], False
+    elif 'path' in request:
+        source_or_path, from_file = request['path'], True
+    else:
+        response.update(ok=False, errors='request needs a "source" or a "path"')
+        return response
+
+    name = request.get('name') or (os.path.basename(source_or_path) if from_file else '<source>')
+    try:
+        output, error_found = compile_nimble(source_or_path, name, from_file=from_file)
+    except Exception as e:  # a compiler failure shouldn't take the server down
+        response.update(ok=False, errors=f'{type(e).__name__}: {e}')
+        return response
+    if error_found:
+        response.update(ok=False, errors=output)
+    else:
+        response.update(ok=True, asm=output)
+    return response
+
+
+def serve(input_lines, write_response):
+    """
+    Answers each non-blank line from `input_lines` by passing its response object to
+    `write_response`. Returns True if stopped by a shutdown request, False on end of input.
+    """
+    for line in input_lines:
+        if not line.strip():
+            continue
+        try:
+            response = handle_request(line)
+        except Shutdown as shutdown:
+            write_response(shutdown.response)
+            return True
+        write_response(response)
+    return False
+
+
+def serve_stdio():
+    def write_response(response):
+        sys.stdout.write(json.dumps(response) + '\n')
+        sys.stdout.flush()
+
+    serve(sys.stdin, write_response)
+
+
+class CompileRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        def write_response(response):
+            self.wfile.write((json.dumps(response) + '\n').encode())
+            self.wfile.flush()
+
+        lines = (raw.decode() for raw in self.rfile)
+        if serve(lines, write_response):
+            self.server.shutdown_requested = True
+
+
+def serve_socket(path):
+    if os.path.exists(path):
+        os.remove(path)
+    with socketserver.UnixStreamServer(path, CompileRequestHandler) as server:
+        server.shutdown_requested = False
+        try:
+            while not server.shutdown_requested:
+                server.handle_request()
+        finally:
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Serve Nimble compile requests')
+    arg_parser.add_argument('--socket', metavar='PATH',
+                            help='listen on a Unix domain socket instead of stdin/stdout')
+    arg_parser.add_argument('--dfa-cache', metavar='PATH', default=DEFAULT_DFA_CACHE,
+                            help='trained lexer/parser DFA cache to preload if present '
+                                 '(default: %(default)s)')
+    arguments = arg_parser.parse_args()
+    preload_dfa_cache(arguments.dfa_cache)
+    if arguments.socket:
+        serve_socket(arguments.socket)
+    else:
+        serve_stdio()
@@ -0,0 +1,84 @@
+"""
+Compile-time evaluation of constant Int and Bool expressions.
+
+`FoldConstants` listens to a type-checked parse tree and records, for every expression
+whose value doesn't depend on variables or function calls, that value in a
+`constants` map: an int for Int expressions, a bool for Bool ones. Arithmetic follows
+MIPS: results wrap around to 32 bits, and division truncates toward zero. Divisions
+that would trap at run time (by zero, or of the most negative Int by -1) are left
+to run time.
+
+The code generator loads constant expressions with a single `li`, and uses constant
+`if` and `while` conditions to drop the branches and loops that can never run.
+"""
+
+from nimble import NimbleListener, NimbleParser
+from semantics import PrimitiveType
+
+INT_MIN = -2 ** 31
+
+
+def wrap(value):
+    """Wraps an integer around to the 32-bit two's complement range, as MIPS does."""
+    return (value - INT_MIN) % 2 ** 32 + INT_MIN
+
+
+def truncating_division(dividend, divisor):
+    quotient = abs(dividend) // abs(divisor)
+    return quotient if (dividend < 0) == (divisor < 0) else -quotient
+
+
+class FoldConstants(NimbleListener):
+
+    def __init__(self, types, constants):
+        self.types = types
+        self.constants = constants
+
+    def exitIntLiteral(self, ctx: NimbleParser.IntLiteralContext):
+        self.constants[ctx] = wrap(int(ctx.INT().getText()))
+
+    def exitBoolLiteral(self, ctx: NimbleParser.BoolLiteralContext):
+        self.constants[ctx] = ctx.BOOL().getText() == 'true'
+
+    def exitParens(self, ctx: NimbleParser.ParensContext):
+        if ctx.expr() in self.constants:
+            self.constants[ctx] = self.constants[ctx.expr()]
+
+    def exitNeg(self, ctx: NimbleParser.NegContext):
+        if ctx.expr() in self.constants:
+            value = self.constants[ctx.expr()]
+            self.constants[ctx] = wrap(-value) if ctx.op.text == '-' else not value
+
+    def operands(self, ctx):
+        """The values of both operands of `ctx`, or None if either isn't constant."""
+        left, right = ctx.expr(0), ctx.expr(1)
+        if left in self.constants and right in self.constants:
+            return self.constants[left], self.constants[right]
+        return None
+
+    def exitAddSub(self, ctx: NimbleParser.AddSubContext):
+        operands = self.operands(ctx)
+        if operands is not None and self.types[ctx] == PrimitiveType.Int:
+            left, right = operands
+            self.constants[ctx] = wrap(left + right if ctx.op.text == '+' else left - right)
+
+    def exitMulDiv(self, ctx: NimbleParser.MulDivContext):
+        operands = self.operands(ctx)
+        if operands is None:
+            return
+        left, right = operands
+        if ctx.op.text == '*':
+            self.constants[ctx] = wrap(left * right)
+        elif right != 0 and not (left == INT_MIN and right == -1):
+            self.constants[ctx] = truncating_division(left, right)
+
+    def exitCompare(self, ctx: NimbleParser.CompareContext):
+        operands = self.operands(ctx)
+        if operands is not None:
+            left, right = operands
+            if ctx.op.text == '==':
+                self.constants[ctx] = left == right
+            elif ctx.op.text == '<=':
+                self.constants[ctx] = left <= right
+            else:
+                self.constants[ctx] = left < right
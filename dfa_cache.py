@@ -0,0 +1,337 @@
+"""
+Persists the DFA states learned by the Nimble lexer and parser, so that new processes
+start with warm prediction caches instead of paying for full ATN simulation on the
+first files they compile.
+
+ANTLR recognizers build their DFAs lazily in the class-level `decisionsToDFA` lists.
+`save_dfa_cache` walks those DFAs (states, edges, ATN configuration sets, prediction
+contexts, semantic contexts and lexer action executors) and writes them out as plain
+tuples, referring to ATN states by number and to lexer actions by their index in the
+ATN. `load_dfa_cache` rebuilds equivalent objects against the recognizer's own ATN and
+installs them in `decisionsToDFA`. Each recognizer's entry records a hash of its
+serialized ATN, and entries that don't match the current grammar are ignored.
+
+Run as a script to train a cache by parsing a corpus, also warming the cache of the
+lexer's and parser's ATNs (see `nimble.atn_cache`):
+
+    python dfa_cache.py [nimble files...]     # defaults to nimble_source/*
+"""
+
+import hashlib
+import marshal
+import os
+import sys
+
+from antlr4 import DFA, Lexer
+from antlr4.PredictionContext import PredictionContext, SingletonPredictionContext, ArrayPredictionContext
+from antlr4.atn.ATNConfig import ATNConfig, LexerATNConfig
+from antlr4.atn.ATNConfigSet import ATNConfigSet, OrderedATNConfigSet
+from antlr4.atn.ATNSimulator import ATNSimulator
+from antlr4.atn.LexerATNSimulator import LexerATNSimulator
+from antlr4.atn.LexerAction import LexerIndexedCustomAction
+from antlr4.atn.LexerActionExecutor import LexerActionExecutor
+from antlr4.atn.SemanticContext import SemanticContext, Predicate, PrecedencePredicate, AND, OR
+from antlr4.dfa.DFAState import DFAState, PredPrediction
+
+DEFAULT_DFA_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'nimble', 'Nimble.dfa')
+
+# bumped whenever the layout of the encoded tuples changes
+FORMAT_VERSION = 1
+
+NO_STATE = -1
+ERROR_STATE = -2
+
+
+def atn_digest(recognizer_class):
+    """A hash of the serialized ATN the recognizer class was generated with."""
+    serialized_atn = sys.modules[recognizer_class.__module__].serializedATN()
+    return hashlib.sha256(repr(serialized_atn).encode()).hexdigest()
+
+
+class DFAEncoder:
+    """
+    Encodes the DFAs of one recognizer as nested tuples. Prediction contexts, semantic
+    contexts and lexer action executors are shared between configurations, so each is
+    encoded once into its own table and referred to by index.
+    """
+
+    def __init__(self, atn):
+        self.atn = atn
+        self.contexts = []
+        self.semantics = []
+        self.executors = []
+        self.indices = {}  # id() of an already encoded object -> index in its table
+        self.keep_alive = []  # ids are only unique while the objects are alive
+
+    def _index_of(self, obj, table, encode):
+        index = self.indices.get(id(obj))
+        if index is None:
+            encoded = encode(obj)  # encodes anything obj refers to first
+            index = len(table)
+            table.append(encoded)
+            self.indices[id(obj)] = index
+            self.keep_alive.append(obj)
+        return index
+
+    def context(self, ctx):
+        if ctx is None:
+            return NO_STATE
+        return self._index_of(ctx, self.contexts, self._encode_context)
+
+    def _encode_context(self, ctx):
+        if ctx is PredictionContext.EMPTY:
+            return ('e',)
+        elif isinstance(ctx, SingletonPredictionContext):
+            return ('s', self.context(ctx.parentCtx), ctx.returnState)
+        elif isinstance(ctx, ArrayPredictionContext):
+            return ('a', tuple(self.context(p) for p in ctx.parents), tuple(ctx.returnStates))
+        raise ValueError(f"can't encode prediction context {ctx!r}")
+
+    def semantic(self, sc):
+        return self._index_of(sc, self.semantics, self._encode_semantic)
+
+    def _encode_semantic(self, sc):
+        if sc is SemanticContext.NONE:
+            return ('n',)
+        elif isinstance(sc, Predicate):
+            return ('p', sc.ruleIndex, sc.predIndex, sc.isCtxDependent)
+        elif isinstance(sc, PrecedencePredicate):
+            return ('q', sc.precedence)
+        elif isinstance(sc, AND):
+            return ('and', tuple(self.semantic(o) for o in sc.opnds))
+        elif isinstance(sc, OR):
+            return ('or', tuple(self.semantic(o) for o in sc.opnds))
+        raise ValueError(f"can't encode semantic context {sc!r}")
+
+    def executor(self, executor):
+        if executor is None:
+            return NO_STATE
+        return self._index_of(executor, self.executors,
+                              lambda e: tuple(self._encode_action(a) for a in e.lexerActions))
+
+    def _encode_action(self, action):
+        if isinstance(action, LexerIndexedCustomAction):
+            return ('i', action.offset, self.atn.lexerActions.index(action.action))
+        return self.atn.lexerActions.index(action)
+
+    def config(self, c):
+        encoded = (c.state.stateNumber, c.alt, self.context(c.context), self.semantic(c.semanticContext),
+                   c.reachesIntoOuterContext, c.precedenceFilterSuppressed)
+        if isinstance(c, LexerATNConfig):
+            encoded += (self.executor(c.lexerActionExecutor), c.passedThroughNonGreedyDecision)
+        return encoded
+
+    def config_set(self, cs):
+        return (isinstance(cs, OrderedATNConfigSet), cs.fullCtx, cs.uniqueAlt,
+                None if cs.conflictingAlts is None else tuple(cs.conflictingAlts),
+                cs.hasSemanticContext, cs.dipsIntoOuterContext, cs.readonly,
+                tuple(self.config(c) for c in cs.configs))
+
+    def dfa(self, dfa):
+        states = sorted(dfa.states, key=lambda s: s.stateNumber)
+        index_of = {id(s): i for i, s in enumerate(states)}
+
+        def edges(s):
+            if s.edges is None:
+                return None
+            return len(s.edges), tuple((i, ERROR_STATE if t.stateNumber == ATNSimulator.ERROR.stateNumber
+                                        else index_of[id(t)])
+                                       for i, t in enumerate(s.edges) if t is not None)
+
+        encoded_states = tuple(
+            (s.stateNumber, self.config_set(s.configs), s.isAcceptState, s.prediction,
+             self.executor(s.lexerActionExecutor), s.requiresFullContext,
+             None if s.predicates is None else tuple((self.semantic(p.pred), p.alt) for p in s.predicates),
+             edges(s))
+            for s in states)
+        if dfa.precedenceDfa:
+            start = ('precedence', edges(dfa.s0))
+        else:
+            start = NO_STATE if dfa.s0 is None else index_of[id(dfa.s0)]
+        return dfa.decision, start, encoded_states
+
+
+class DFADecoder:
+    """Rebuilds DFAs encoded by `DFAEncoder` against the given recognizer class's ATN."""
+
+    def __init__(self, recognizer_class, encoded):
+        self.atn = recognizer_class.atn
+        self.error_state = LexerATNSimulator.ERROR if issubclass(recognizer_class, Lexer) else ATNSimulator.ERROR
+        self.context_cache = getattr(recognizer_class, 'sharedContextCache', None)
+        self.semantics = []
+        for s in encoded['semantics']:
+            self.semantics.append(self._decode_semantic(s))
+        self.contexts = []
+        for c in encoded['contexts']:
+            self.contexts.append(self._decode_context(c))
+        self.executors = [LexerActionExecutor([self._decode_action(a) for a in e]) for e in encoded['executors']]
+
+    def _decode_context(self, encoded):
+        kind = encoded[0]
+        if kind == 'e':
+            return PredictionContext.EMPTY
+        elif kind == 's':
+            ctx = SingletonPredictionContext(self.context(encoded[1]), encoded[2])
+        else:
+            ctx = ArrayPredictionContext([self.context(p) for p in encoded[1]], list(encoded[2]))
+        return self.context_cache.add(ctx) if self.context_cache is not None else ctx
+
+    def context(self, index):
+        return None if index == NO_STATE else self.contexts[index]
+
+    def _decode_semantic(self, encoded):
+        kind = encoded[0]
+        if kind == 'n':
+            return SemanticContext.NONE
+        elif kind == 'p':
+            return Predicate(*encoded[1:])
+        elif kind == 'q':
+            return PrecedencePredicate(encoded[1])
+        # the AND and OR constructors simplify their operands; restore them exactly as saved
+        combined = AND.__new__(AND) if kind == 'and' else OR.__new__(OR)
+        combined.opnds = [self.semantics[o] for o in encoded[1]]
+        return combined
+
+    def _decode_action(self, encoded):
+        if isinstance(encoded, tuple):
+            return LexerIndexedCustomAction(encoded[1], self.atn.lexerActions[encoded[2]])
+        return self.atn.lexerActions[encoded]
+
+    def executor(self, index):
+        return None if index == NO_STATE else self.executors[index]
+
+    def config(self, encoded):
+        state, alt, context, semantic, reaches, suppressed = encoded[:6]
+        if len(encoded) > 6:
+            c = LexerATNConfig(self.atn.states[state], alt, self.context(context), self.semantics[semantic],
+                               self.executor(encoded[6]))
+            c.passedThroughNonGreedyDecision = encoded[7]
+        else:
+            c = ATNConfig(self.atn.states[state], alt, self.context(context), self.semantics[semantic])
+        c.reachesIntoOuterContext = reaches
+        c.precedenceFilterSuppressed = suppressed
+        return c
+
+    def config_set(self, encoded):
+        ordered, full_ctx, unique_alt, conflicting_alts, has_semantic, dips, readonly, configs = encoded
+        cs = OrderedATNConfigSet() if ordered else ATNConfigSet(full_ctx)
+        cs.fullCtx = full_ctx
+        cs.uniqueAlt = unique_alt
+        cs.conflictingAlts = None if conflicting_alts is None else set(conflicting_alts)
+        cs.hasSemanticContext = has_semantic
+        cs.dipsIntoOuterContext = dips
+        for c in configs:
+            config = self.config(c)
+            cs.configs.append(config)
+            cs.getOrAdd(config)
+        if readonly:
+            cs.setReadonly(True)
+        return cs
+
+    def dfa(self, encoded):
+        decision, start, encoded_states = encoded
+        dfa = DFA(self.atn.decisionToState[decision], decision)
+        states = []
+        for number, configs, accept, prediction, executor, full_context, predicates, _ in encoded_states:
+            s = DFAState(number, self.config_set(configs))
+            s.isAcceptState = accept
+            s.prediction = prediction
+            s.lexerActionExecutor = self.executor(executor)
+            s.requiresFullContext = full_context
+            if predicates is not None:
+                s.predicates = [PredPrediction(self.semantics[pred], alt) for pred, alt in predicates]
+            states.append(s)
+
+        def edges(encoded_edges):
+            if encoded_edges is None:
+                return None
+            size, targets = encoded_edges
+            decoded = [None] * size
+            for i, target in targets:
+                decoded[i] = self.error_state if target == ERROR_STATE else states[target]
+            return decoded
+
+        for s, encoded_state in zip(states, encoded_states):
+            s.edges = edges(encoded_state[-1])
+            dfa.states[s] = s
+        if isinstance(start, tuple):
+            dfa.s0.edges = edges(start[1])
+        elif start != NO_STATE:
+            dfa.s0 = states[start]
+        return dfa
+
+
+def save_dfa_cache(path, *recognizer_classes):
+    """Writes the DFAs currently learned by each of the recognizer classes to `path`."""
+    entries = {}
+    for recognizer_class in recognizer_classes:
+        encoder = DFAEncoder(recognizer_class.atn)
+        dfas = tuple(encoder.dfa(dfa) for dfa in recognizer_class.decisionsToDFA)
+        entries[recognizer_class.__name__] = {'atn': atn_digest(recognizer_class),
+                                              'contexts': tuple(encoder.contexts),
+                                              'semantics': tuple(encoder.semantics),
+                                              'executors': tuple(encoder.executors),
+                                              'dfas': dfas}
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'wb') as f:
+        marshal.dump({'version': FORMAT_VERSION, 'python': sys.version_info[:2], 'entries': entries}, f)
+    os.replace(temporary_path, path)
+
+
+def load_dfa_cache(path, *recognizer_classes):
+    """
+    Installs the cached DFAs from `path` into each of the recognizer classes, skipping
+    any whose grammar has changed since the cache was written. Returns the names of the
+    classes that were loaded; a missing or unreadable cache loads nothing.
+    """
+    try:
+        with open(path, 'rb') as f:
+            contents = marshal.load(f)
+        if contents['version'] != FORMAT_VERSION or contents['python'] != sys.version_info[:2]:
+            return []
+        entries = contents['entries']
+    except (OSError, EOFError, ValueError, TypeError, KeyError):
+        return []
+
+    loaded = []
+    for recognizer_class in recognizer_classes:
+        encoded = entries.get(recognizer_class.__name__)
+        if encoded is None or encoded['atn'] != atn_digest(recognizer_class):
+            continue
+        decoder = DFADecoder(recognizer_class, encoded)
+        dfas = [decoder.dfa(dfa) for dfa in encoded['dfas']]
+        # replace in place: recognizer instances share the class-level list
+        recognizer_class.decisionsToDFA[:] = dfas
+        loaded.append(recognizer_class.__name__)
+    return loaded
+
+
+def train(nimble_filenames, path=DEFAULT_DFA_CACHE):
+    """
+    Parses each of the given files, then saves the DFAs the Nimble lexer and parser have
+    learned to `path`. Files with syntax errors still contribute what was learned.
+    """
+    from generic_parser import parse, SyntaxErrors
+    from nimble import NimbleLexer, NimbleParser
+
+    load_dfa_cache(path, NimbleLexer, NimbleParser)
+    for nimble_filename in nimble_filenames:
+        try:
+            parse(nimble_filename, 'script', NimbleLexer, NimbleParser, from_file=True)
+        except SyntaxErrors:
+            pass
+    save_dfa_cache(path, NimbleLexer, NimbleParser)
+
+
+if __name__ == '__main__':
+    from nimble.atn_cache import CACHE_DIR as ATN_CACHE_DIR, warm_atn_cache
+
+    if len(sys.argv) > 1:
+        corpus = sys.argv[1:]
+    else:
+        source_dir = os.path.join(os.getcwd(), 'nimble_source')
+        corpus = [os.path.join(source_dir, name) for name in sorted(os.listdir(source_dir))]
+    train(corpus)
+    print(f'DFA cache trained on {len(corpus)} file(s) and written to {DEFAULT_DFA_CACHE}')
+    if not warm_atn_cache():
+        print(f'ATN cache could not be written to {ATN_CACHE_DIR}')
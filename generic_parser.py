@@ -1,6 +1,7 @@
 """
 Provides a generic `parse` function which either returns a parse tree or
-raises a `SyntaxErrors` exception with a `SyntaxErrorLog`.
+raises a `SyntaxErrors` exception with a `SyntaxErrorLog`. Optionally parses in two
+stages, trying fast SLL prediction before falling back to full LL.
 
 Author: Greg Phillips
 
@@ -10,27 +11,49 @@ Version: 2021-01-24
 from dataclasses import dataclass
 
 from antlr4 import FileStream, InputStream, CommonTokenStream,\
-    Recognizer, RecognitionException, Token
+    Recognizer, RecognitionException, Token, PredictionMode, BailErrorStrategy
+from antlr4.error.Errors import ParseCancellationException
 
+from phase_timing import untimed
 
-def parse(source_or_path, start_rule_name, lexer_class, parser_class, from_file=False):
+
+def parse(source_or_path, start_rule_name, lexer_class, parser_class, from_file=False,
+          two_stage=False, phases=None):
     """
     Creates a parser on the provided source or source file, adds a `SyntaxErrorLog` as
     error listener at both the lex and parse stages, and attempts the parse from the given
     rule name. Raises a `SyntaxErrors` exception if any are logged during the lex or parse.
 
+    With `two_stage`, the source is first parsed using the faster SLL prediction mode and
+    a strategy that bails out at the first syntax error. Only if that fails is it parsed
+    again as above, so the errors reported are exactly those of a normal parse.
+
+    With `phases`, a `phase_timing.PhaseTimes`, the lex and the parse are timed as
+    separate phases: all the tokens are lexed before parsing starts, rather than as the
+    parser asks for them, so any lexer errors are logged ahead of the parser's.
+
     :param source_or_path: Either a string containing the source code, or
         the path to a source file
     :param start_rule_name: The ANTLR grammar rule to be used as parse root
     :param lexer_class: A generated ANTLR lexer class
     :param parser_class: A generated ANTLR parser class
     :param from_file: True if input is a file
+    :param two_stage: True to try a fast SLL parse before the full LL parse
+    :param phases: Optional; the `PhaseTimes` to time the lex and parse in
     :return: The computed ANTLR parse tree
     """
+    phase = phases.phase if phases is not None else untimed
     if from_file:
         character_stream = FileStream(source_or_path)
     else:
         character_stream = InputStream(source_or_path)
+
+    if two_stage:
+        parse_tree = parse_sll(character_stream, start_rule_name, lexer_class, parser_class, phases)
+        if parse_tree is not None:
+            return parse_tree
+        character_stream.reset()
+
     lexer = lexer_class(character_stream)
     token_stream = CommonTokenStream(lexer)
     parser = parser_class(token_stream)
@@ -42,7 +65,11 @@ def parse(source_or_path, start_rule_name, lexer_class, parser_class, from_file=
     parser.addErrorListener(error_log)
 
     parse_function = parser.__getattribute__(start_rule_name)
-    parse_tree = parse_function()
+    if phases is not None:
+        with phases.phase('lex'):
+            token_stream.fill()
+    with phase('parse'):
+        parse_tree = parse_function()
 
     if error_log.has_errors():
         raise SyntaxErrors(error_log, parse_tree)
@@ -50,6 +77,35 @@ def parse(source_or_path, start_rule_name, lexer_class, parser_class, from_file=
         return parse_tree
 
 
+def parse_sll(character_stream, start_rule_name, lexer_class, parser_class, phases=None):
+    """
+    Attempts the fast first stage of a two-stage parse: SLL prediction, bailing out at
+    the first syntax error. Returns the parse tree, or None if there were any lex or
+    parse errors.
+    """
+    phase = phases.phase if phases is not None else untimed
+    lexer = lexer_class(character_stream)
+    token_stream = CommonTokenStream(lexer)
+    parser = parser_class(token_stream)
+
+    lexer.removeErrorListeners()
+    parser.removeErrorListeners()
+    lexer_error_log = SyntaxErrorLog()
+    lexer.addErrorListener(lexer_error_log)
+    parser._interp.predictionMode = PredictionMode.SLL
+    parser._errHandler = BailErrorStrategy()
+
+    if phases is not None:
+        with phases.phase('lex'):
+            token_stream.fill()
+    try:
+        with phase('parse'):
+            parse_tree = parser.__getattribute__(start_rule_name)()
+    except ParseCancellationException:
+        return None
+    return None if lexer_error_log.has_errors() else parse_tree
+
+
 class SyntaxErrors(Exception):
 
     def __init__(self, error_log, parse_tree):
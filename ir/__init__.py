@@ -0,0 +1,4 @@
+from .builder import BuildIR
+from .instructions import Program
+from .mips import generate_mips
+from .optimizations import optimize
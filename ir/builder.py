@@ -0,0 +1,275 @@
+"""
+Builds the IR of a type-checked Nimble script, as an ANTLR listener.
+
+Expressions are flattened into instructions computing each operation into a fresh
+`Temp`, in the current block, as their nodes are exited; `values` maps each
+expression node to the operand holding its value. `if`, `while` and `return` end the
+current block and start new ones, as their parts are entered and exited.
+
+On exiting a `while`, the computations in the loop that depend only on variables not
+assigned anywhere in it are hoisted out of it (see
+`optimizations.hoist_loop_invariants`).
+"""
+
+from nimble import NimbleListener, NimbleParser
+from semantics import PrimitiveType
+from .optimizations import hoist_loop_invariants
+from .instructions import (Temp, Variable, Const, StringConst, Copy, BinaryOp, UnaryOp, Concat, Call,
+                           Print, Jump, Branch, Return, BasicBlock, Function)
+
+COMPARISONS = {'==': 'seq', '<=': 'sle', '<': 'slt'}
+
+
+class BuildIR(NimbleListener):
+
+    def __init__(self, global_scope, types, constants, program):
+        """
+        `constants` gives the values of constant expressions, as computed by
+        `constant_folding.FoldConstants` (which must see each node before this). The
+        IR is added to `program`.
+        """
+        self.current_scope = global_scope
+        self.types = types
+        self.constants = constants
+        self.program = program
+        self.values = {}
+        self.function = None
+        self.block = None
+        self.variables = {}  # id of each symbol of the current function -> its Variable
+        self.if_blocks = {}  # if node -> (then block, else block or None, join block)
+        self.while_blocks = {}  # while node -> (block before the loop, header block, exit block)
+        self.loop_assignments = []  # for each enclosing while, the variables assigned in it
+        self.argument_ends = {}  # call argument node -> number of instructions in its block on exit
+        self.call_starts = {}  # call node -> number of instructions in its block on entry
+        self.return_start = 0  # number of instructions in the block on entering a return
+        self.string_labels = {}  # literal -> label, so each distinct literal is declared once
+        self.temp_count = 0
+        self.label_count = 0
+
+    # --- helpers ---
+
+    def new_temp(self):
+        self.temp_count += 1
+        return Temp(self.temp_count)
+
+    def new_block(self):
+        self.label_count += 1
+        return BasicBlock(f'{self.function.name}.{self.label_count}')
+
+    def start_block(self, block):
+        """Makes `block` current, placing it next in the function's layout."""
+        self.function.blocks.append(block)
+        self.block = block
+
+    def end_block(self, terminator):
+        self.block.terminator = terminator
+
+    def emit(self, instruction):
+        self.block.instructions.append(instruction)
+        return instruction.dest
+
+    def value(self, ctx):
+        """The operand holding the value of expression `ctx`, which is a `Const` if constant."""
+        if ctx in self.constants:
+            return Const(int(self.constants[ctx]))
+        return self.values[ctx]
+
+    def variable(self, name):
+        # Symbols are defined during the same walk, so Variables are made on first use
+        symbol = self.current_scope.resolve(name)
+        if id(symbol) not in self.variables:
+            if symbol.is_param:
+                offset = 4 * (symbol.index + 1) + 4
+            else:
+                offset = -4 * symbol.index
+            self.variables[id(symbol)] = Variable(symbol.name, offset, symbol.is_param)
+            self.function.variables.append(self.variables[id(symbol)])
+        return self.variables[id(symbol)]
+
+    def assign(self, variable, value):
+        # The instruction that just computed a temp can compute into the variable instead
+        last = self.block.instructions[-1] if self.block.instructions else None
+        if isinstance(value, Temp) and last is not None and last.dest is value:
+            last.dest = variable
+        else:
+            self.emit(Copy(variable, value))
+
+    def enter_function(self, name, is_main):
+        self.variables = {}
+        self.function = Function(name, is_main, [])
+        self.program.functions.append(self.function)
+        self.label_count = -1
+        self.start_block(self.new_block())
+
+    def exit_function(self):
+        # falling off the end returns (or, in main, halts)
+        self.end_block(Return())
+        self.function.parameters = [self.variable(symbol.name) for symbol in self.current_scope.parameters()]
+        self.current_scope = self.current_scope.enclosing_scope
+
+    # --- functions and main ---
+
+    def enterFuncDef(self, ctx: NimbleParser.FuncDefContext):
+        self.current_scope = self.current_scope.child_scope_named(ctx.ID().getText())
+        self.enter_function(ctx.ID().getText(), is_main=False)
+
+    def exitFuncDef(self, ctx: NimbleParser.FuncDefContext):
+        self.exit_function()
+
+    def enterMain(self, ctx: NimbleParser.MainContext):
+        self.current_scope = self.current_scope.child_scope_named('$main')
+        self.enter_function('main', is_main=True)
+
+    def exitMain(self, ctx: NimbleParser.MainContext):
+        self.exit_function()
+
+    # --- statements ---
+
+    def exitVarDec(self, ctx: NimbleParser.VarDecContext):
+        # as in the templates, variables start as 0, which for a String is a null pointer
+        value = self.value(ctx.expr()) if ctx.expr() is not None else Const(0)
+        self.assign(self.variable(ctx.ID().getText()), value)
+
+    def exitAssignment(self, ctx: NimbleParser.AssignmentContext):
+        variable = self.variable(ctx.ID().getText())
+        for assigned in self.loop_assignments:
+            assigned.add(variable)
+        self.assign(variable, self.value(ctx.expr()))
+
+    def exitPrint(self, ctx: NimbleParser.PrintContext):
+        kind = self.types[ctx.expr()].name
+        self.emit(Print(kind, self.value(ctx.expr())))
+
+    def enterReturn(self, ctx: NimbleParser.ReturnContext):
+        self.return_start = len(self.block.instructions)
+
+    def exitReturn(self, ctx: NimbleParser.ReturnContext):
+        if self.function.is_main:
+            # main's return just halts, without evaluating any expression given
+            del self.block.instructions[self.return_start:]
+            value = None
+        else:
+            value = self.value(ctx.expr()) if ctx.expr() is not None else None
+        self.end_block(Return(value))
+        # anything after the return is unreachable, and removed by the optimizations
+        self.start_block(self.new_block())
+
+    def enterWhile(self, ctx: NimbleParser.WhileContext):
+        preheader, header = self.block, self.new_block()
+        self.end_block(Jump(header))
+        self.start_block(header)
+        self.while_blocks[ctx] = (preheader, header, None)
+        self.loop_assignments.append(set())
+
+    def enterIf(self, ctx: NimbleParser.IfContext):
+        then_block = self.new_block()
+        else_block = self.new_block() if ctx.block(1) is not None else None
+        self.if_blocks[ctx] = (then_block, else_block, self.new_block())
+
+    def enterBlock(self, ctx: NimbleParser.BlockContext):
+        parent = ctx.parentCtx
+        if isinstance(parent, NimbleParser.WhileContext):
+            # the condition has been evaluated in the header
+            preheader, header, _ = self.while_blocks[parent]
+            body, exit_block = self.new_block(), self.new_block()
+            self.while_blocks[parent] = (preheader, header, exit_block)
+            self.end_block(Branch(self.value(parent.expr()), body, exit_block))
+            self.start_block(body)
+        elif isinstance(parent, NimbleParser.IfContext):
+            then_block, else_block, join = self.if_blocks[parent]
+            if ctx is parent.block(0):
+                self.end_block(Branch(self.value(parent.expr()), then_block, else_block or join))
+                self.start_block(then_block)
+            else:
+                self.end_block(Jump(join))
+                self.start_block(else_block)
+
+    def exitWhile(self, ctx: NimbleParser.WhileContext):
+        preheader, header, exit_block = self.while_blocks.pop(ctx)
+        self.end_block(Jump(header))
+        # the loop's blocks are those placed since its header
+        loop_blocks = self.function.blocks[self.function.blocks.index(header):]
+        hoist_loop_invariants(preheader, loop_blocks, self.loop_assignments.pop())
+        self.start_block(exit_block)
+
+    def exitIf(self, ctx: NimbleParser.IfContext):
+        _, _, join = self.if_blocks.pop(ctx)
+        self.end_block(Jump(join))
+        self.start_block(join)
+
+    # --- calls ---
+
+    def enterFuncCall(self, ctx: NimbleParser.FuncCallContext):
+        self.call_starts[ctx] = len(self.block.instructions)
+
+    def exitEveryRule(self, ctx):
+        if isinstance(ctx.parentCtx, NimbleParser.FuncCallContext):
+            self.argument_ends[ctx] = len(self.block.instructions)
+
+    def exitFuncCall(self, ctx: NimbleParser.FuncCallContext):
+        args = ctx.expr()
+        # The arguments' instructions are reordered so that, as in the template code
+        # generator, the last argument is evaluated first. Each argument's instructions
+        # only compute temps used by the argument itself, so can be moved as a unit.
+        start = self.call_starts.pop(ctx)
+        ends = [self.argument_ends.pop(arg) for arg in args]
+        if len(args) > 1:
+            instructions = self.block.instructions
+            segments = [instructions[begin:end] for begin, end in zip([start] + ends, ends)]
+            instructions[start:] = [i for segment in reversed(segments) for i in segment]
+        self.values[ctx] = self.emit(Call(self.new_temp(), ctx.ID().getText(),
+                                          [self.value(arg) for arg in args]))
+
+    def exitFuncCallExpr(self, ctx: NimbleParser.FuncCallExprContext):
+        self.values[ctx] = self.values.pop(ctx.funcCall())
+
+    def exitFuncCallStmt(self, ctx: NimbleParser.FuncCallStmtContext):
+        self.values.pop(ctx.funcCall())
+
+    # --- expressions ---
+
+    def exitIntLiteral(self, ctx: NimbleParser.IntLiteralContext):
+        pass  # always constant
+
+    def exitBoolLiteral(self, ctx: NimbleParser.BoolLiteralContext):
+        pass  # always constant
+
+    def string_constant(self, literal):
+        # strings are never modified, so all occurrences of a literal can share its label
+        if literal not in self.string_labels:
+            self.string_labels[literal] = f'string_{len(self.program.string_literals)}'
+            self.program.string_literals[self.string_labels[literal]] = literal
+        return StringConst(self.string_labels[literal])
+
+    def exitStringLiteral(self, ctx: NimbleParser.StringLiteralContext):
+        self.values[ctx] = self.string_constant(ctx.getText())
+
+    def exitVariable(self, ctx: NimbleParser.VariableContext):
+        self.values[ctx] = self.variable(ctx.ID().getText())
+
+    def exitParens(self, ctx: NimbleParser.ParensContext):
+        self.values[ctx] = self.value(ctx.expr())
+
+    def exitNeg(self, ctx: NimbleParser.NegContext):
+        if ctx not in self.constants:
+            op = 'neg' if ctx.op.text == '-' else 'not'
+            self.values[ctx] = self.emit(UnaryOp(op, self.new_temp(), self.value(ctx.expr())))
+
+    def binary_operation(self, ctx, op):
+        if ctx not in self.constants:
+            left, right = self.value(ctx.expr(0)), self.value(ctx.expr(1))
+            self.values[ctx] = self.emit(BinaryOp(op, self.new_temp(), left, right))
+
+    def exitAddSub(self, ctx: NimbleParser.AddSubContext):
+        if self.types[ctx.expr(0)] == PrimitiveType.String:
+            left, right = self.value(ctx.expr(0)), self.value(ctx.expr(1))
+            in_loop = bool(self.loop_assignments)
+            self.values[ctx] = self.emit(Concat(self.new_temp(), left, right, in_loop))
+        else:
+            self.binary_operation(ctx, 'add' if ctx.op.text == '+' else 'sub')
+
+    def exitMulDiv(self, ctx: NimbleParser.MulDivContext):
+        self.binary_operation(ctx, 'mul' if ctx.op.text == '*' else 'div')
+
+    def exitCompare(self, ctx: NimbleParser.CompareContext):
+        self.binary_operation(ctx, COMPARISONS[ctx.op.text])
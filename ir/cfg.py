@@ -0,0 +1,65 @@
+"""
+The control-flow graph of a `Function`: its basic blocks, with edges from each block
+to the successors its terminator may transfer control to, and the dataflow analyses
+the optimizations and code generation are built on.
+"""
+
+from .instructions import LOCATIONS
+
+
+def predecessors(function):
+    """Maps each block of `function` to the list of blocks that may transfer control to it."""
+    preds = {block: [] for block in function.blocks}
+    for block in function.blocks:
+        for successor in block.successors:
+            preds[successor].append(block)
+    return preds
+
+
+def reachable_blocks(function):
+    """The set of blocks that control can reach from the function's entry."""
+    reached = {function.entry}
+    pending = [function.entry]
+    while pending:
+        for successor in pending.pop().successors:
+            if successor not in reached:
+                reached.add(successor)
+                pending.append(successor)
+    return reached
+
+
+def locations_used(instruction):
+    return [operand for operand in instruction.uses() if isinstance(operand, LOCATIONS)]
+
+
+def liveness(function):
+    """
+    Returns `(live_in, live_out)`, mapping each block to the set of locations whose
+    current values may be read later, on entering and on leaving the block. Nothing is
+    live on leaving the function: parameters and local variables die with its frame.
+    """
+    live_in = {block: set() for block in function.blocks}
+    live_out = {block: set() for block in function.blocks}
+    changed = True
+    while changed:
+        changed = False
+        # backwards through the layout, so most blocks see their successors' sets first
+        for block in reversed(function.blocks):
+            out = set()
+            for successor in block.successors:
+                out |= live_in[successor]
+            live = live_before(block, out)
+            if out != live_out[block] or live != live_in[block]:
+                live_out[block], live_in[block] = out, live
+                changed = True
+    return live_in, live_out
+
+
+def live_before(block, live_out):
+    """The locations live on entering `block`, given those live on leaving it."""
+    live = set(live_out)
+    for instruction in reversed([*block.instructions, block.terminator]):
+        if instruction.dest is not None:
+            live.discard(instruction.dest)
+        live.update(locations_used(instruction))
+    return live
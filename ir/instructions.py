@@ -0,0 +1,265 @@
+"""
+A three-address intermediate representation for Nimble programs.
+
+A `Program` is a list of `Function`s, main among them, plus its string literals. Each
+function's code is a list of `BasicBlock`s, in layout order: straight-line
+`Instruction`s ended by a single terminator (`Jump`, `Branch` or `Return`), which
+determines the block's successors in the control-flow graph.
+
+Instructions compute into a destination, and read operands, which are either
+locations (`Temp`s, the compiler's own single-use values, and `Variable`s, the
+Nimble parameters and local variables, which live in frame slots) or constants
+(`Const` ints and bools, `StringConst` string literal labels).
+"""
+
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+
+class Temp:
+    """A value computed by the compiler. Compared by identity."""
+
+    __slots__ = ('number',)
+
+    def __init__(self, number):
+        self.number = number
+
+    def __repr__(self):
+        return f't{self.number}'
+
+
+class Variable:
+    """
+    A Nimble parameter or local variable of a function, at `offset`($fp). Compared by
+    identity: each symbol has one `Variable` per function.
+    """
+
+    __slots__ = ('name', 'offset', 'is_param')
+
+    def __init__(self, name, offset, is_param):
+        self.name = name
+        self.offset = offset
+        self.is_param = is_param
+
+    def __repr__(self):
+        return f'{self.name}@{self.offset}'
+
+
+@dataclass(frozen=True)
+class Const:
+    value: int
+
+    def __repr__(self):
+        return str(self.value)
+
+
+@dataclass(frozen=True)
+class StringConst:
+    label: str
+
+    def __repr__(self):
+        return f'&{self.label}'
+
+
+LOCATIONS = (Temp, Variable)
+
+# the built-in functions, which only compute their results from their arguments
+BUILT_IN_FUNCTIONS = {'stringlength', 'substring'}
+
+
+class Instruction:
+    """
+    Base class of instructions. `operand_fields` names the attributes holding operands
+    read; `dest`, if not None, is the location written.
+    """
+
+    operand_fields = ()
+    has_side_effects = False
+
+    def uses(self):
+        return [getattr(self, name) for name in self.operand_fields]
+
+    def replace_uses(self, replacement):
+        """Replaces each operand `o` by `replacement(o)`."""
+        for name in self.operand_fields:
+            setattr(self, name, replacement(getattr(self, name)))
+
+
+@dataclass(eq=False)
+class Copy(Instruction):
+    dest: object
+    src: object
+    operand_fields = ('src',)
+
+    def __repr__(self):
+        return f'{self.dest} = {self.src}'
+
+
+@dataclass(eq=False)
+class BinaryOp(Instruction):
+    """An arithmetic or comparison operation, named as its MIPS instruction, e.g. `slt`."""
+    op: str
+    dest: object
+    left: object
+    right: object
+    operand_fields = ('left', 'right')
+
+    @property
+    def has_side_effects(self):
+        # division traps when dividing by zero, so must stay unless the divisor is known
+        return self.op == 'div' and not (isinstance(self.right, Const) and self.right.value != 0)
+
+    def __repr__(self):
+        return f'{self.dest} = {self.op} {self.left} {self.right}'
+
+
+@dataclass(eq=False)
+class UnaryOp(Instruction):
+    """`neg` (integer negation) or `not` (boolean negation)."""
+    op: str
+    dest: object
+    operand: object
+    operand_fields = ('operand',)
+
+    def __repr__(self):
+        return f'{self.dest} = {self.op} {self.operand}'
+
+
+@dataclass(eq=False)
+class Concat(Instruction):
+    """String concatenation, into a newly allocated string; `in_loop` if in a `while` loop."""
+    dest: object
+    left: object
+    right: object
+    in_loop: bool = False
+    operand_fields = ('left', 'right')
+
+    def __repr__(self):
+        return f'{self.dest} = concat {self.left} {self.right}'
+
+
+@dataclass(eq=False)
+class Call(Instruction):
+    """A call of a Nimble or built-in function; `dest` receives its result."""
+    dest: object
+    function: str
+    args: List[object]
+
+    @property
+    def has_side_effects(self):
+        return self.function not in BUILT_IN_FUNCTIONS
+
+    def uses(self):
+        return list(self.args)
+
+    def replace_uses(self, replacement):
+        self.args = [replacement(arg) for arg in self.args]
+
+    def __repr__(self):
+        return f'{self.dest} = call {self.function}({", ".join(map(repr, self.args))})'
+
+
+@dataclass(eq=False)
+class Print(Instruction):
+    """Prints an Int, Bool or String value, according to `kind`."""
+    kind: str
+    value: object
+    dest = None
+    operand_fields = ('value',)
+    has_side_effects = True
+
+    def __repr__(self):
+        return f'print {self.kind} {self.value}'
+
+
+# --- terminators ---
+
+@dataclass(eq=False)
+class Jump(Instruction):
+    target: 'BasicBlock'
+    dest = None
+
+    def successors(self):
+        return [self.target]
+
+    def __repr__(self):
+        return f'jump {self.target.label}'
+
+
+@dataclass(eq=False)
+class Branch(Instruction):
+    condition: object
+    if_true: 'BasicBlock'
+    if_false: 'BasicBlock'
+    dest = None
+    operand_fields = ('condition',)
+
+    def successors(self):
+        return [self.if_true, self.if_false]
+
+    def __repr__(self):
+        return f'branch {self.condition} {self.if_true.label} {self.if_false.label}'
+
+
+@dataclass(eq=False)
+class Return(Instruction):
+    """Returns `value` (if not None) from a function; in main, ends the program."""
+    value: object = None
+    dest = None
+
+    @property
+    def operand_fields(self):
+        return ('value',) if self.value is not None else ()
+
+    def successors(self):
+        return []
+
+    def __repr__(self):
+        return f'return {self.value}' if self.value is not None else 'return'
+
+
+@dataclass(eq=False)
+class BasicBlock:
+    label: str
+    instructions: List[Instruction] = field(default_factory=list)
+    terminator: Optional[Instruction] = None
+
+    @property
+    def successors(self):
+        return self.terminator.successors() if self.terminator is not None else []
+
+    def __repr__(self):
+        body = ''.join(f'    {i}\n' for i in self.instructions + [self.terminator] if i is not None)
+        return f'{self.label}:\n{body}'
+
+
+@dataclass(eq=False)
+class Function:
+    name: str
+    is_main: bool
+    variables: List[Variable]
+    blocks: List[BasicBlock] = field(default_factory=list)
+    parameters: List[Variable] = field(default_factory=list)  # in order
+
+    @property
+    def entry(self):
+        return self.blocks[0]
+
+    def __repr__(self):
+        return f'function {self.name}\n' + ''.join(map(repr, self.blocks))
+
+
+@dataclass(eq=False)
+class Program:
+    functions: List[Function] = field(default_factory=list)
+    string_literals: dict = field(default_factory=dict)  # label -> literal, quotes included
+
+    @property
+    def main(self):
+        return next(f for f in self.functions if f.is_main)
+
+    def instruction_count(self):
+        return sum(len(b.instructions) + 1 for f in self.functions for b in f.blocks)
+
+    def __repr__(self):
+        return '\n'.join(map(repr, self.functions))
@@ -0,0 +1,395 @@
+"""
+Generates MIPS from the IR, with the same frame layout and calling convention as the
+template code generator (see `nimble2MIPS`), so the two can be mixed and matched.
+
+Each function's frame holds its local variables, at -4*index($fp) as usual, followed
+by slots for the temps that can't be kept in registers. Temps are allocated $t1-$t8
+by a linear scan over each block; a temp that is still needed after a call (other
+than of a built-in function), or after the registers run out, or in another block
+(e.g. one computed ahead of a loop, see `optimizations.hoist_loop_invariants`), is
+kept in a frame slot instead. $t0 and $t9 are scratch registers, for loading
+operands and for results stored to the frame.
+
+Leaf functions, which call no Nimble functions, with nothing in their frames, are
+generated without a frame, as by the template code generator.
+"""
+
+from itertools import count
+
+import rope
+import templates
+from nimble2MIPS import built_in_functions, string_literal_declarations
+from .cfg import liveness
+from .instructions import (BUILT_IN_FUNCTIONS, Temp, Variable, Const, StringConst, Copy, BinaryOp, UnaryOp,
+                           Concat, Call, Print, Jump, Branch, Return)
+
+ALLOCATABLE_REGISTERS = tuple(f'$t{i}' for i in range(1, 9))
+
+# compare-and-branch instructions, for branching on the result of a comparison
+BRANCH_IF_TRUE = {'seq': 'beq', 'sle': 'ble', 'slt': 'blt'}
+BRANCH_IF_FALSE = {'seq': 'bne', 'sle': 'bgt', 'slt': 'bge'}
+COMMUTATIVE = {'add', 'mul', 'seq'}
+
+# in the SPIM print syscall, 1 is the service code for Int, 4 for String
+PRINT_SERVICE_CODES = {'Int': 1, 'Bool': 4, 'String': 4}
+
+
+def fits_immediate(value):
+    return -2 ** 15 <= value < 2 ** 15
+
+
+def instruction(op, *args):
+    return f'{op:<6} {" ".join(str(arg) for arg in args)}'
+
+
+class FunctionGenerator:
+    """Generates the code of one IR `Function`: the body of its definition or of main."""
+
+    def __init__(self, function, label_numbers, length_prefixed_strings=False, inline_concat_in_loops=False):
+        self.function = function
+        self.label_numbers = label_numbers
+        self.length_prefixed_strings = length_prefixed_strings
+        self.inline_concat_in_loops = inline_concat_in_loops
+        self.locations = {}  # temp -> register, frame offset, or None if its value is never read
+        self.lines = []
+        self.referenced_labels = set()
+        self.local_count = max((1 - v.offset // 4 for v in function.variables if not v.is_param), default=0)
+        self.slot_count = 0
+        self.frameless = False  # set once the temps are allocated
+
+    def unique_label(self, base):
+        return f'{base}.{next(self.label_numbers)}'
+
+    def emit(self, line):
+        if line is not None:
+            self.lines.append(line)
+
+    # --- register allocation ---
+
+    def slot_offset(self, slot):
+        return -4 * (self.local_count + slot)
+
+    def allocate(self):
+        live_in, _ = liveness(self.function)
+        # Temps live across blocks get slots of their own
+        for live in live_in.values():
+            for location in live:
+                if isinstance(location, Temp) and location not in self.locations:
+                    self.locations[location] = self.slot_offset(self.slot_count)
+                    self.slot_count += 1
+        shared_slots = self.slot_count
+        for block in self.function.blocks:
+            slots_used = self.allocate_block(block, shared_slots)
+            self.slot_count = max(self.slot_count, shared_slots + slots_used)
+
+    def allocate_block(self, block, first_slot):
+        """Allocates the temps computed in `block`, returning the number of slots used."""
+        instructions = [*block.instructions, block.terminator]
+        last_use = {}
+        for i, ins in enumerate(instructions):
+            for operand in ins.uses():
+                if isinstance(operand, Temp):
+                    last_use[operand] = i
+        # the built-in functions leave $t1-$t8 alone, but other functions may not
+        calls = [i for i, ins in enumerate(instructions)
+                 if isinstance(ins, Call) and ins.function not in BUILT_IN_FUNCTIONS]
+        free_registers = list(ALLOCATABLE_REGISTERS)
+        free_slots = []
+        slots_used = 0
+        local = set()
+        for i, ins in enumerate(instructions):
+            for operand in ins.uses():
+                if operand in local and last_use[operand] == i:
+                    local.discard(operand)
+                    location = self.locations[operand]
+                    if isinstance(location, str):
+                        free_registers.append(location)
+                    else:
+                        free_slots.append(location)
+            dest = ins.dest
+            if not isinstance(dest, Temp) or dest in self.locations:
+                continue
+            end = last_use.get(dest)
+            if end is None:
+                self.locations[dest] = None
+                continue
+            local.add(dest)
+            if free_registers and not any(i < call < end for call in calls):
+                self.locations[dest] = free_registers.pop(0)
+            elif free_slots:
+                self.locations[dest] = free_slots.pop()
+            else:
+                self.locations[dest] = self.slot_offset(first_slot + slots_used)
+                slots_used += 1
+        return slots_used
+
+    # --- operands ---
+
+    def load(self, operand, register):
+        """The instruction loading `operand` into `register`, or None if it is there already."""
+        if isinstance(operand, Const):
+            return instruction('li', register, operand.value)
+        if isinstance(operand, StringConst):
+            return instruction('la', register, operand.label)
+        if isinstance(operand, Variable):
+            return instruction('lw', register, f'{operand.offset}($fp)')
+        location = self.locations[operand]
+        if isinstance(location, str):
+            return instruction('move', register, location) if location != register else None
+        return instruction('lw', register, f'{location}($fp)')
+
+    def register_for(self, operand, scratch):
+        """A register holding `operand`, loading it into `scratch` if necessary."""
+        if isinstance(operand, Const) and operand.value == 0:
+            return '$zero'
+        if isinstance(operand, Temp) and isinstance(self.locations[operand], str):
+            return self.locations[operand]
+        self.emit(self.load(operand, scratch))
+        return scratch
+
+    def operand_for(self, operand, scratch):
+        """As `register_for`, but gives small constants as immediates."""
+        if isinstance(operand, Const) and operand.value != 0 and fits_immediate(operand.value):
+            return operand.value
+        return self.register_for(operand, scratch)
+
+    def dest_register(self, dest):
+        location = self.locations.get(dest)
+        return location if isinstance(location, str) else '$t0'
+
+    def store(self, dest, register):
+        """Puts the value in `register` in its destination, if it isn't there already."""
+        if isinstance(dest, Variable):
+            self.emit(instruction('sw', register, f'{dest.offset}($fp)'))
+        elif dest is not None:
+            location = self.locations[dest]
+            if isinstance(location, str):
+                if location != register:
+                    self.emit(instruction('move', location, register))
+            elif location is not None:
+                self.emit(instruction('sw', register, f'{location}($fp)'))
+
+    # --- instructions ---
+
+    def generate(self, ins):
+        if isinstance(ins, Copy):
+            self.copy(ins)
+        elif isinstance(ins, BinaryOp):
+            self.binary_op(ins)
+        elif isinstance(ins, UnaryOp):
+            source = self.register_for(ins.operand, '$t0')
+            result = self.dest_register(ins.dest)
+            if ins.op == 'neg':
+                self.emit(instruction('neg', result, source))
+            else:
+                self.emit(instruction('xori', result, source, 1))
+            self.store(ins.dest, result)
+        elif isinstance(ins, Concat):
+            self.concat(ins)
+        elif isinstance(ins, Call):
+            self.call(ins)
+        elif isinstance(ins, Print):
+            self.print(ins)
+
+    def copy(self, ins):
+        location = self.locations.get(ins.dest)
+        if isinstance(location, str):
+            self.emit(self.load(ins.src, location))
+        else:
+            self.store(ins.dest, self.register_for(ins.src, '$t0'))
+
+    def binary_op(self, ins):
+        op, left, right = ins.op, ins.left, ins.right
+        if op in COMMUTATIVE and isinstance(left, Const) and not isinstance(right, Const):
+            left, right = right, left
+        source = self.register_for(left, '$t0')
+        result = self.dest_register(ins.dest)
+        # subtracting a constant is adding its negation, which must fit the immediate too
+        addend = (right.value if op == 'add' else -right.value) if isinstance(right, Const) else None
+        if op in ('add', 'sub') and addend is not None and fits_immediate(addend):
+            self.emit(instruction('addiu', result, source, addend))
+        elif op == 'slt' and isinstance(right, Const) and fits_immediate(right.value):
+            self.emit(instruction('slti', result, source, right.value))
+        else:
+            self.emit(instruction(op, result, source, self.register_for(right, '$t9')))
+        self.store(ins.dest, result)
+
+    def concat(self, ins):
+        if not (self.inline_concat_in_loops and ins.in_loop):
+            # stringconcat takes the left operand deepest on the stack, so second
+            self.call_sequence('.stringconcat', [ins.right, ins.left])
+            self.store(ins.dest, '$t0')
+            return
+        self.emit(rope.flatten(rope.fill(
+            templates.string_cat_length_prefixed if self.length_prefixed_strings else templates.string_cat,
+            expr0=self.load(ins.left, '$t0') or '',
+            expr1=self.load(ins.right, '$t0') or '',
+            iter_char1=self.unique_label('iter_char1'),
+            iter_char2=self.unique_label('iter_char2'),
+            next_1=self.unique_label('next_1'),
+            fin_count=self.unique_label('fin_count')
+        )))
+        self.store(ins.dest, '$t0')
+
+    def call(self, ins):
+        if self.length_prefixed_strings and ins.function == 'stringlength':
+            # The length is stored just before the string
+            result = self.dest_register(ins.dest)
+            self.emit(instruction('lw', result, f'-4({self.register_for(ins.args[0], "$t0")})'))
+            self.store(ins.dest, result)
+            return
+        self.call_sequence(ins.function, ins.args)
+        self.store(ins.dest, '$t0')
+
+    def call_sequence(self, function_name, args):
+        """Calls `function_name` with the given arguments, leaving its result in $t0."""
+        # The arguments go on the stack, the first nearest the top, above the return
+        # address, which main has no need to keep
+        saves_return_address = not self.function.is_main
+        frame_size = 4 * (len(args) + saves_return_address)
+        if frame_size:
+            self.emit(instruction('addiu', '$sp', '$sp', -frame_size))
+        if saves_return_address:
+            self.emit(instruction('sw', '$ra', f'{frame_size}($sp)'))
+        for i, arg in enumerate(args):
+            self.emit(instruction('sw', self.register_for(arg, '$t0'), f'{4 * (i + 1)}($sp)'))
+        self.emit(instruction('jal', function_name))
+        if saves_return_address:
+            self.emit(instruction('lw', '$ra', f'{frame_size}($sp)'))
+        if frame_size:
+            self.emit(instruction('addiu', '$sp', '$sp', frame_size))
+
+    def print(self, ins):
+        if ins.kind != 'Bool':
+            self.emit(self.load(ins.value, '$a0'))
+        elif isinstance(ins.value, Const):
+            self.emit(instruction('la', '$a0', 'true_string' if ins.value.value else 'false_string'))
+        else:
+            # the value is 1 or 0, but printed as true or false
+            value = self.register_for(ins.value, '$t0')
+            chosen = self.unique_label('chosen_string')
+            self.emit(instruction('la', '$a0', 'true_string'))
+            self.emit(instruction('bnez', value, chosen))
+            self.emit(instruction('la', '$a0', 'false_string'))
+            self.emit(f'{chosen}:')
+        self.emit(instruction('li', '$v0', PRINT_SERVICE_CODES[ins.kind]))
+        self.emit('syscall')
+
+    # --- terminators ---
+
+    def jump(self, target, next_block):
+        if target is not next_block:
+            self.referenced_labels.add(target.label)
+            self.emit(instruction('b', target.label))
+
+    def fused_comparison(self, block):
+        """
+        The comparison computing the condition of the block's branch, if it is the
+        block's last instruction and computes the condition for the branch alone, so it
+        can be fused into a compare-and-branch instruction; otherwise None.
+        """
+        terminator = block.terminator
+        comparison = block.instructions[-1] if block.instructions else None
+        if (isinstance(terminator, Branch) and isinstance(comparison, BinaryOp)
+                and comparison.op in BRANCH_IF_TRUE and comparison.dest is terminator.condition
+                and isinstance(comparison.dest, Temp) and self.use_count(block, comparison.dest) == 1):
+            return comparison
+        return None
+
+    def branch(self, terminator, comparison, next_block):
+        if comparison is not None:
+            left, right = comparison.left, comparison.right
+            if comparison.op in COMMUTATIVE and isinstance(left, Const):
+                left, right = right, left
+            operands = (self.register_for(left, '$t0'), self.operand_for(right, '$t9'))
+            if_true = instruction(BRANCH_IF_TRUE[comparison.op], *operands, terminator.if_true.label)
+            if_false = instruction(BRANCH_IF_FALSE[comparison.op], *operands, terminator.if_false.label)
+        else:
+            value = self.register_for(terminator.condition, '$t0')
+            if_true = instruction('bnez', value, terminator.if_true.label)
+            if_false = instruction('beqz', value, terminator.if_false.label)
+        if terminator.if_false is next_block:
+            self.referenced_labels.add(terminator.if_true.label)
+            self.emit(if_true)
+        else:
+            self.referenced_labels.add(terminator.if_false.label)
+            self.emit(if_false)
+            self.jump(terminator.if_true, next_block)
+
+    @staticmethod
+    def use_count(block, temp):
+        return sum(ins.uses().count(temp) for ins in [*block.instructions, block.terminator])
+
+    def return_(self, terminator, is_last):
+        if self.function.is_main:
+            # main's return halts, as does falling off its end into the halt code
+            if not is_last:
+                self.emit(instruction('li', '$v0', 10))
+                self.emit('syscall')
+            return
+        if terminator.value is not None:
+            self.emit(self.load(terminator.value, '$t0'))
+        if not is_last:
+            # otherwise, the end of the function definition returns
+            template = templates.frameless_return if self.frameless else templates.return_statment
+            self.emit(rope.flatten(rope.fill(template, expr='')))
+
+    # --- blocks ---
+
+    def code(self):
+        """Returns the function's code, as a rope."""
+        self.allocate()
+        self.frameless = (not self.function.is_main and self.local_count + self.slot_count == 0
+                          and not any(isinstance(ins, Call) and ins.function not in BUILT_IN_FUNCTIONS
+                                      for block in self.function.blocks for ins in block.instructions))
+        blocks = self.function.blocks
+        block_lines = []
+        for i, block in enumerate(blocks):
+            self.lines = []
+            next_block = blocks[i + 1] if i + 1 < len(blocks) else None
+            comparison = self.fused_comparison(block)
+            for ins in block.instructions:
+                if ins is not comparison:
+                    self.generate(ins)
+            terminator = block.terminator
+            if isinstance(terminator, Jump):
+                self.jump(terminator.target, next_block)
+            elif isinstance(terminator, Branch):
+                self.branch(terminator, comparison, next_block)
+            elif isinstance(terminator, Return):
+                self.return_(terminator, next_block is None)
+            block_lines.append(self.lines)
+
+        frame_size = 4 * (self.local_count + self.slot_count)
+        code = [instruction('addiu', '$sp', '$sp', -frame_size)] if frame_size else []
+        for block, lines in zip(blocks, block_lines):
+            if block.label in self.referenced_labels:
+                code.append(f'{block.label}:')
+            code.extend(lines)
+        return rope.join('\n', code)
+
+    def definition(self):
+        """Returns the function's definition, as a rope."""
+        body = self.code()
+        template = templates.enter_frameless_func_def if self.frameless else templates.enter_func_def
+        return rope.fill(template, func_name=self.function.name, func_body=body)
+
+
+def generate_mips(program, length_prefixed_strings=False, inline_concat_in_loops=False):
+    """
+    Returns the MIPS code of the whole `program`, as a string, optionally with
+    length-prefixed strings, and with string concatenations in loops inlined (see
+    `nimble2MIPS.MIPSGenerator`).
+    """
+    label_numbers = count()
+    options = (length_prefixed_strings, inline_concat_in_loops)
+    func_defs = [FunctionGenerator(function, label_numbers, *options).definition()
+                 for function in program.functions if not function.is_main]
+    script_code = rope.fill(
+        templates.script,
+        string_literals=string_literal_declarations(program.string_literals, length_prefixed_strings),
+        main=FunctionGenerator(program.main, label_numbers, *options).code(),
+        func_defs=func_defs,
+        **built_in_functions(length_prefixed_strings)
+    )
+    return rope.flatten(script_code)
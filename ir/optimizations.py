@@ -0,0 +1,300 @@
+"""
+Optimizations of the IR, each a function transforming a `Function` in place and
+returning True if it changed anything. `optimize` applies them all, to every
+function of a program, until none changes anything:
+
+- constant folding evaluates operations on constants, and turns branches on
+  constants into jumps;
+- copy propagation replaces reads of a variable copied from a constant or another
+  variable, along every path reaching the read, by reads of what it was copied from;
+- dead-code elimination drops instructions computing values that are never read
+  and have no side effects;
+- tail call elimination turns calls of a function from itself, whose results it
+  just returns, into assignments to its parameters and a jump back to its entry;
+- jump threading skips empty blocks that just jump elsewhere;
+- unreachable block removal drops blocks control never reaches, e.g. after returns
+  or behind constant-false conditions.
+
+Loop-invariant code motion, `hoist_loop_invariants`, is instead applied by the IR
+builder to each `while` loop as it is built, while it is still known which variables
+the loop assigns.
+"""
+
+from constant_folding import INT_MIN, wrap, truncating_division
+from .cfg import predecessors, reachable_blocks, liveness, locations_used
+from .instructions import (Temp, Variable, Const, Copy, BinaryOp, UnaryOp, Concat, Call, Jump, Branch, Return)
+
+
+def evaluate(op, left, right):
+    """The value of `op` on constant ints, or None if it would trap at run time."""
+    if op == 'add':
+        return wrap(left + right)
+    if op == 'sub':
+        return wrap(left - right)
+    if op == 'mul':
+        return wrap(left * right)
+    if op == 'div':
+        if right == 0 or (left == INT_MIN and right == -1):
+            return None
+        return truncating_division(left, right)
+    if op == 'seq':
+        return int(left == right)
+    if op == 'sle':
+        return int(left <= right)
+    return int(left < right)
+
+
+def fold_constants(function):
+    changed = False
+    for block in function.blocks:
+        for i, instruction in enumerate(block.instructions):
+            value = None
+            if isinstance(instruction, BinaryOp):
+                if isinstance(instruction.left, Const) and isinstance(instruction.right, Const):
+                    value = evaluate(instruction.op, instruction.left.value, instruction.right.value)
+            elif isinstance(instruction, UnaryOp) and isinstance(instruction.operand, Const):
+                operand = instruction.operand.value
+                value = wrap(-operand) if instruction.op == 'neg' else 1 - operand
+            if value is not None:
+                block.instructions[i] = Copy(instruction.dest, Const(value))
+                changed = True
+        terminator = block.terminator
+        if isinstance(terminator, Branch) and isinstance(terminator.condition, Const):
+            block.terminator = Jump(terminator.if_true if terminator.condition.value else terminator.if_false)
+            changed = True
+    return changed
+
+
+def propagatable(instruction):
+    """True for copies whose source can stand in for their destination until either changes."""
+    return isinstance(instruction, Copy) and not isinstance(instruction.src, Temp)
+
+
+def record_copies(available, instruction):
+    """Updates the map of available copies, destination -> source, past `instruction`."""
+    dest = instruction.dest
+    if dest is not None:
+        for copied, source in list(available.items()):
+            if copied is dest or source is dest:
+                del available[copied]
+        if propagatable(instruction) and instruction.src is not dest:
+            available[dest] = instruction.src
+
+
+def available_after(block, available):
+    available = dict(available)
+    for instruction in block.instructions:
+        record_copies(available, instruction)
+    return available
+
+
+def propagate_copies(function):
+    # Forward dataflow: a copy is available on entering a block if it is available on
+    # leaving every predecessor. None stands for "not computed yet", i.e. everything.
+    preds = predecessors(function)
+    available_in = {block: None for block in function.blocks}
+    available_out = {block: None for block in function.blocks}
+    changed = True
+    while changed:
+        changed = False
+        for block in function.blocks:
+            if block is function.entry:
+                incoming = {}
+            else:
+                incoming = None
+                for pred in preds[block]:
+                    if available_out[pred] is None:
+                        continue
+                    if incoming is None:
+                        incoming = dict(available_out[pred])
+                    else:
+                        incoming = {dest: src for dest, src in incoming.items()
+                                    if available_out[pred].get(dest) == src}
+                if incoming is None:
+                    continue
+            if incoming != available_in[block] or available_out[block] is None:
+                available_in[block] = incoming
+                available_out[block] = available_after(block, incoming)
+                changed = True
+
+    replaced = False
+    for block in function.blocks:
+        available = dict(available_in[block] or {})
+
+        def replacement(operand):
+            nonlocal replaced
+            if operand in available:
+                replaced = True
+                return available[operand]
+            return operand
+
+        for instruction in [*block.instructions, block.terminator]:
+            instruction.replace_uses(replacement)
+            record_copies(available, instruction)
+    return replaced
+
+
+def eliminate_dead_code(function):
+    changed = False
+    _, live_out = liveness(function)
+    for block in function.blocks:
+        live = set(live_out[block])
+        live.update(locations_used(block.terminator))
+        kept = []
+        for instruction in reversed(block.instructions):
+            dest = instruction.dest
+            if dest is not None and dest not in live:
+                if not instruction.has_side_effects:
+                    changed = True
+                    continue
+                if isinstance(instruction, Call):
+                    instruction.dest = None
+                    changed = True
+            if dest is not None:
+                live.discard(dest)
+            live.update(locations_used(instruction))
+            kept.append(instruction)
+        kept.reverse()
+        block.instructions = kept
+    return changed
+
+
+def eliminate_tail_calls(function):
+    """
+    Replaces self tail calls, calls of the function from itself whose results it then
+    just returns, by assigning the arguments to the parameters and jumping back to the
+    entry, so that they reuse the current frame rather than growing the stack.
+    """
+    if function.is_main:
+        return False
+    changed = False
+    temp_number = None
+    for block in function.blocks:
+        call = block.instructions[-1] if block.instructions else None
+        terminator = block.terminator
+        if not (isinstance(call, Call) and call.function == function.name and isinstance(terminator, Return)
+                and (terminator.value is None or terminator.value is call.dest)):
+            continue
+        del block.instructions[-1]
+        assignments = []
+        for parameter, arg in zip(function.parameters, call.args):
+            if isinstance(arg, Variable) and arg.is_param and arg is not parameter:
+                # the parameter may be assigned before it's read, so is read first
+                if temp_number is None:
+                    temp_number = max((location.number for b in function.blocks
+                                       for instruction in [*b.instructions, b.terminator]
+                                       for location in [instruction.dest, *instruction.uses()]
+                                       if isinstance(location, Temp)), default=0)
+                temp_number += 1
+                block.instructions.append(Copy(Temp(temp_number), arg))
+                arg = block.instructions[-1].dest
+            if arg is not parameter:
+                assignments.append(Copy(parameter, arg))
+        block.instructions.extend(assignments)
+        block.terminator = Jump(function.entry)
+        changed = True
+    return changed
+
+
+def thread_jumps(function):
+    """Retargets jumps and branches to empty blocks that just jump on, to where they jump."""
+
+    def destination(block):
+        seen = set()
+        while (block is not function.entry and not block.instructions and isinstance(block.terminator, Jump)
+               and block not in seen):
+            seen.add(block)
+            block = block.terminator.target
+        return block
+
+    changed = False
+    for block in function.blocks:
+        terminator = block.terminator
+        if isinstance(terminator, Jump):
+            target = destination(terminator.target)
+            if target is not terminator.target:
+                terminator.target = target
+                changed = True
+        elif isinstance(terminator, Branch):
+            if_true, if_false = destination(terminator.if_true), destination(terminator.if_false)
+            if if_true is not terminator.if_true or if_false is not terminator.if_false:
+                terminator.if_true, terminator.if_false = if_true, if_false
+                changed = True
+            if if_true is if_false:
+                block.terminator = Jump(if_true)
+                changed = True
+    return changed
+
+
+def remove_unreachable_blocks(function):
+    reachable = reachable_blocks(function)
+    if len(reachable) == len(function.blocks):
+        return False
+    function.blocks = [block for block in function.blocks if block in reachable]
+    return True
+
+
+def hoistable(instruction, in_header=False):
+    """
+    True for instructions computing a temp that can be moved ahead of the loop they're
+    in if their operands don't change in it: those with no side effects, which can't
+    trap either, since they may end up running when the loop body doesn't.
+
+    Concatenations and built-in calls can trap, e.g. a `substring` reaching outside its
+    string, so are only hoisted `in_header`, from the loop's header: it runs whenever
+    the preheader does, unlike the body, which may not run at all, or only some of it.
+    """
+    if not isinstance(instruction.dest, Temp) or instruction.has_side_effects:
+        return False
+    if isinstance(instruction, BinaryOp) and instruction.op == 'div':
+        return isinstance(instruction.right, Const) and instruction.right.value != 0
+    if isinstance(instruction, (Concat, Call)):
+        return in_header
+    return isinstance(instruction, (Copy, BinaryOp, UnaryOp))
+
+
+def hoist_loop_invariants(preheader, loop_blocks, assigned):
+    """
+    Moves the loop-invariant computations of a loop, made up of `loop_blocks`, header
+    first, to the end of `preheader`, which is run just once before the loop. A
+    computation is invariant if it is `hoistable` and its operands are constants,
+    variables not in `assigned` (the variables assigned anywhere in the loop), or the
+    results of other invariant computations. Each hoisted temp is computed once, but
+    may then be read on each iteration.
+    """
+    invariant = set()
+
+    def is_invariant(operand):
+        if isinstance(operand, Variable):
+            return operand not in assigned
+        if isinstance(operand, Temp):
+            return operand in invariant
+        return True
+
+    header = loop_blocks[0]
+    for block in loop_blocks:
+        kept = []
+        for instruction in block.instructions:
+            if (hoistable(instruction, block is header)
+                    and all(is_invariant(operand) for operand in instruction.uses())):
+                preheader.instructions.append(instruction)
+                invariant.add(instruction.dest)
+            else:
+                kept.append(instruction)
+        block.instructions = kept
+
+
+PASSES = [fold_constants, propagate_copies, eliminate_dead_code, eliminate_tail_calls, thread_jumps,
+          remove_unreachable_blocks]
+
+
+def optimize(program):
+    """Optimizes each function of `program` in place, returning the program."""
+    for function in program.functions:
+        changed = True
+        while changed:
+            changed = False
+            for optimization in PASSES:
+                if optimization(function):
+                    changed = True
+    return program
@@ -0,0 +1,564 @@
+"""
+A MIPS simulator for running generated code locally, as a stand-in for SPIM.
+
+It handles the subset of MIPS the code generators, templates and peephole optimizer
+emit: integer arithmetic, logic and comparisons (including SPIM's pseudo-instructions
+such as `li`, `la`, `move`, `seq`, `sle` and three-operand `mul` and `div`), word and
+byte loads and stores, branches, jumps, `jal` and `jr`, and the syscalls for printing
+ints (1) and strings (4), allocating memory (9) and exiting (10), plus printing a char
+(11). The data section may hold `.asciiz`, `.ascii`, `.word`, `.space` and `.align`.
+
+`assemble` turns the source into an `Executable`; a `Machine` then decodes each
+instruction into a closure, once, and `run` dispatches on them in a tight loop, each
+returning the index of the instruction to run next. Execution starts at `main` and
+stops at exit, on running off the end of the code, or after `max_steps` instructions.
+Words of memory are held in native byte order, so that they can be accessed through
+`memoryview`s of ints.
+
+Comments of the form `# @line N` (see `templates.line_annotation`) attribute the
+instructions following them to line N of the Nimble source, for `profiler`.
+
+Unlike SPIM, arithmetic wraps around instead of trapping on overflow, as
+`constant_folding` assumes. Division by zero, bad or unaligned addresses, and
+unsupported instructions raise `MIPSError`.
+
+Usage: python mips_simulator.py [--max-steps N] [--stats] file.asm
+"""
+
+import argparse
+import re
+import sys
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from constant_folding import wrap, truncating_division
+
+TEXT_BASE = 0x00400000
+DATA_BASE = 0x10010000
+STACK_TOP = 0x7FFFEFFC  # the initial $sp, as in SPIM
+GLOBAL_POINTER = 0x10008000
+
+DEFAULT_STACK_SIZE = 1 << 22
+DEFAULT_HEAP_SIZE = 1 << 24
+DEFAULT_MAX_STEPS = 100_000_000
+
+REGISTER_NAMES = ('zero', 'at', 'v0', 'v1', 'a0', 'a1', 'a2', 'a3',
+                  't0', 't1', 't2', 't3', 't4', 't5', 't6', 't7',
+                  's0', 's1', 's2', 's3', 's4', 's5', 's6', 's7',
+                  't8', 't9', 'k0', 'k1', 'gp', 'sp', 'fp', 'ra')
+REGISTERS = {f'${name}': number for number, name in enumerate(REGISTER_NAMES)}
+REGISTERS.update({f'${number}': number for number in range(32)})
+REGISTERS['$s8'] = REGISTERS['$fp']
+ZERO, V0, A0, GP, SP, RA = 0, 2, 4, 28, 29, 31
+# Writes to $zero go to this extra register instead, so $zero needn't be reset after each instruction
+DISCARDED = 32
+
+ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'a': '\a', 'b': '\b', 'f': '\f', 'v': '\v',
+           '0': '\0', '\\': '\\', '"': '"', "'": "'", '?': '?'}
+
+_label = re.compile(r'([A-Za-z_.$][\w.$]*)\s*:')
+_token = re.compile(r'"(?:[^"\\]|\\.)*"|[^\s,]+')
+_address = re.compile(r'(-?\w*)\((\$\w+)\)$')
+_escape = re.compile(r'\\(.)')
+_line_annotation = re.compile(r'#\s*@line\s+(\d+)')
+
+
+class MIPSError(Exception):
+    """A program that can't be assembled, or that fails while running."""
+
+
+class Halt(Exception):
+    """Raised on exiting, by syscall 10 or running off the end of the code."""
+
+
+@dataclass
+class Executable:
+    """
+    An assembled program: its text, as `(line number, op, operands)`, labels and data,
+    and the Nimble source line each instruction is annotated with, if any.
+    """
+    text: List[Tuple[int, str, List[str]]] = field(default_factory=list)
+    labels: Dict[str, int] = field(default_factory=dict)
+    data: bytearray = field(default_factory=bytearray)
+    source_lines: List[Optional[int]] = field(default_factory=list)
+
+
+def strip_comment(line):
+    """`line` without any comment, i.e. from a `#` that isn't in a string literal."""
+    if '#' not in line:
+        return line
+    in_string = escaped = False
+    for i, char in enumerate(line):
+        if escaped:
+            escaped = False
+        elif char == '\\':
+            escaped = in_string
+        elif char == '"':
+            in_string = not in_string
+        elif char == '#' and not in_string:
+            return line[:i]
+    return line
+
+
+def string_bytes(literal):
+    """The bytes a string literal, quotes included, stands for."""
+    return _escape.sub(lambda match: ESCAPES.get(match.group(1), match.group(1)),
+                       literal[1:-1]).encode('latin-1')
+
+
+def assemble(source):
+    """Assembles MIPS source into an `Executable`."""
+    executable = Executable()
+    text, labels, data = executable.text, executable.labels, executable.data
+    in_data = False
+    source_line = None
+    for line_number, line in enumerate(source.splitlines(), 1):
+        if line.lstrip().startswith('#'):
+            annotation = _line_annotation.match(line.lstrip())
+            if annotation is not None:
+                source_line = int(annotation.group(1))
+            continue
+        line = strip_comment(line).strip()
+        while (match := _label.match(line)) is not None:
+            label = match.group(1)
+            if label in labels:
+                raise MIPSError(f'line {line_number}: label {label} defined twice')
+            labels[label] = DATA_BASE + len(data) if in_data else TEXT_BASE + 4 * len(text)
+            line = line[match.end():].lstrip()
+        if not line:
+            continue
+        op, *operands = _token.findall(line)
+        if op == '.data':
+            in_data = True
+        elif op == '.text':
+            in_data = False
+        elif op in ('.asciiz', '.ascii'):
+            data += string_bytes(operands[0]) + (b'\0' if op == '.asciiz' else b'')
+        elif op == '.word':
+            data += bytes(-len(data) % 4)
+            for operand in operands:
+                data += (int(operand, 0) & 0xFFFFFFFF).to_bytes(4, sys.byteorder)
+        elif op == '.align':
+            data += bytes(-len(data) % (1 << int(operands[0])))
+        elif op == '.space':
+            data += bytes(int(operands[0], 0))
+        elif op.startswith('.'):
+            pass  # e.g. .globl
+        else:
+            text.append((line_number, op, operands))
+            executable.source_lines.append(source_line)
+    return executable
+
+
+# The operations of three-operand arithmetic, logic and comparison instructions
+OPERATIONS = {
+    'add': lambda a, b: wrap(a + b), 'addu': lambda a, b: wrap(a + b),
+    'addi': lambda a, b: wrap(a + b), 'addiu': lambda a, b: wrap(a + b),
+    'sub': lambda a, b: wrap(a - b), 'subu': lambda a, b: wrap(a - b),
+    'mul': lambda a, b: wrap(a * b),
+    'and': lambda a, b: a & b, 'andi': lambda a, b: a & b,
+    'or': lambda a, b: a | b, 'ori': lambda a, b: a | b,
+    'xor': lambda a, b: a ^ b, 'xori': lambda a, b: a ^ b,
+    'nor': lambda a, b: ~(a | b),
+    'sll': lambda a, b: wrap(a << (b & 31)), 'srl': lambda a, b: wrap((a & 0xFFFFFFFF) >> (b & 31)),
+    'sra': lambda a, b: a >> (b & 31),
+    'seq': lambda a, b: int(a == b), 'sne': lambda a, b: int(a != b),
+    'slt': lambda a, b: int(a < b), 'slti': lambda a, b: int(a < b),
+    'sltu': lambda a, b: int(a & 0xFFFFFFFF < b & 0xFFFFFFFF),
+    'sle': lambda a, b: int(a <= b), 'sgt': lambda a, b: int(a > b), 'sge': lambda a, b: int(a >= b),
+}
+
+BRANCHES_ON_ZERO = {'beqz': lambda a: a == 0, 'bnez': lambda a: a != 0, 'bltz': lambda a: a < 0,
+                    'bgez': lambda a: a >= 0, 'bgtz': lambda a: a > 0, 'blez': lambda a: a <= 0}
+BRANCHES = {'beq': lambda a, b: a == b, 'bne': lambda a, b: a != b, 'blt': lambda a, b: a < b,
+            'ble': lambda a, b: a <= b, 'bgt': lambda a, b: a > b, 'bge': lambda a, b: a >= b}
+
+# The instructions whose first operand is the register they write
+WRITES_FIRST_OPERAND = {*OPERATIONS, 'div', 'rem', 'li', 'la', 'move', 'neg', 'negu', 'not', 'lw', 'lb', 'lbu'}
+
+
+class Machine:
+    """
+    The registers and memory running an `Executable`, with its code decoded. Memory is
+    the data section, followed by the heap, which `sbrk` (syscall 9) extends, and the
+    stack below `STACK_TOP`. `output` collects what the program prints, and `steps`
+    counts the instructions run. `stack_low` is the lowest `$sp` has been, and the
+    high-water marks of the stack and heap are `stack_used` and `heap_used`.
+    """
+
+    def __init__(self, executable, stack_size=DEFAULT_STACK_SIZE, heap_size=DEFAULT_HEAP_SIZE):
+        self.registers = [0] * 33
+        self.registers[SP] = self.stack_low = STACK_TOP
+        self.registers[GP] = GLOBAL_POINTER
+        stack_size -= stack_size % 4
+        self.stack = bytearray(stack_size)
+        self.stack_words = memoryview(self.stack).cast('i')
+        self.stack_base = STACK_TOP + 4 - stack_size
+        # the data section and heap, which grows as needed, up to heap_size
+        self.data = executable.data + bytes(-len(executable.data) % 4)
+        self.data_words = memoryview(self.data).cast('i')
+        self.heap_start = self.heap_end = DATA_BASE + len(executable.data)
+        self.heap_limit = self.heap_end + heap_size
+        self.output = []
+        self.steps = 0
+        self.labels = executable.labels
+        self.instruction_count = len(executable.text)
+        self.code = [self.decode(i, op, operands, line_number)
+                     for i, (line_number, op, operands) in enumerate(executable.text)]
+        self.code.append(self.halt)  # running off the end exits
+
+    @property
+    def stack_used(self):
+        """The most bytes of stack in use at once, as measured by `$sp`."""
+        return STACK_TOP - self.stack_low
+
+    @property
+    def heap_used(self):
+        """The bytes of heap allocated, none of which is ever freed."""
+        return self.heap_end - self.heap_start
+
+    # --- memory ---
+
+    def locate(self, address, size):
+        """The buffer holding `address`, and its index there, checking `size` bytes fit."""
+        if address >= self.stack_base:
+            buffer, index = self.stack, address - self.stack_base
+        else:
+            buffer, index = self.data, address - DATA_BASE
+        if index < 0 or index + size > len(buffer):
+            raise MIPSError(f'bad address {address:#x}')
+        if address % size:
+            raise MIPSError(f'unaligned address {address:#x}')
+        return buffer, index
+
+    def word_index(self, address):
+        """The words holding `address`, and its index there."""
+        buffer, index = self.locate(address, 4)
+        return (self.stack_words if buffer is self.stack else self.data_words), index >> 2
+
+    def load_word(self, address):
+        words, index = self.word_index(address)
+        return words[index]
+
+    def store_word(self, address, value):
+        words, index = self.word_index(address)
+        words[index] = wrap(value)
+
+    def load_byte(self, address):
+        buffer, index = self.locate(address, 1)
+        value = buffer[index]
+        return value - 256 if value > 127 else value
+
+    def store_byte(self, address, value):
+        buffer, index = self.locate(address, 1)
+        buffer[index] = value & 0xFF
+
+    def string_at(self, address):
+        buffer, index = self.locate(address, 1)
+        end = buffer.find(0, index)
+        if end < 0:
+            raise MIPSError(f'unterminated string at {address:#x}')
+        return buffer[index:end].decode('latin-1')
+
+    def sbrk(self, size):
+        """Allocates `size` bytes of heap, word aligned, returning their address."""
+        start = (self.heap_end + 3) & ~3
+        if size < 0 or start + size > self.heap_limit:
+            raise MIPSError(f'out of heap allocating {size} bytes')
+        self.heap_end = start + size
+        needed = self.heap_end - DATA_BASE
+        if needed > len(self.data):
+            # doubling, so that the heap is copied O(log size) times
+            self.data_words.release()
+            size = max(needed, 2 * len(self.data))
+            self.data += bytes(size + -size % 4 - len(self.data))
+            self.data_words = memoryview(self.data).cast('i')
+        return start
+
+    def syscall(self):
+        registers = self.registers
+        service = registers[V0]
+        if service == 1:
+            self.output.append(str(registers[A0]))
+        elif service == 4:
+            self.output.append(self.string_at(registers[A0]))
+        elif service == 11:
+            self.output.append(chr(registers[A0] & 0xFF))
+        elif service == 9:
+            registers[V0] = self.sbrk(registers[A0])
+        elif service == 10:
+            return self.instruction_count  # where the code that exits is
+        else:
+            raise MIPSError(f'unsupported syscall {service}')
+
+    # --- decoding ---
+
+    def target(self, label, line_number):
+        if label not in self.labels:
+            raise MIPSError(f'line {line_number}: undefined label {label}')
+        return self.instruction_index(self.labels[label])
+
+    @staticmethod
+    def instruction_index(address):
+        return (address - TEXT_BASE) >> 2
+
+    def value(self, operand):
+        """The value of an immediate operand, a number or label."""
+        return self.labels[operand] if operand in self.labels else wrap(int(operand, 0))
+
+    @staticmethod
+    def register(operand, written=False):
+        if operand not in REGISTERS:
+            raise MIPSError(f'bad register {operand}')
+        number = REGISTERS[operand]
+        return DISCARDED if written and number == ZERO else number
+
+    def decode(self, index, op, operands, line_number):
+        """
+        Returns a closure running the instruction at `index`, which returns the index of
+        the instruction to run next.
+        """
+        try:
+            run = self.decode_operation(index, op, operands, line_number)
+        except (ValueError, IndexError, KeyError):
+            raise MIPSError(f'line {line_number}: bad operands for {op}: {" ".join(operands)}') from None
+        if op in WRITES_FIRST_OPERAND and operands and REGISTERS.get(operands[0]) == SP \
+                and not self.pops(op, operands):
+            return self.tracking_stack_low(run)
+        return run
+
+    def pops(self, op, operands):
+        """True if the instruction, writing `$sp`, only ever increases it, e.g. `addiu $sp $sp 4`."""
+        return (op in ('addi', 'addiu') and REGISTERS.get(operands[-2]) == SP
+                and operands[-1] not in REGISTERS and self.value(operands[-1]) >= 0)
+
+    def tracking_stack_low(self, run):
+        """Wraps the closure of an instruction writing `$sp` to keep `stack_low` up to date."""
+        r = self.registers
+
+        def run_and_track():
+            following = run()
+            if r[SP] < self.stack_low:
+                self.stack_low = r[SP]
+            return following
+        return run_and_track
+
+    def halt(self):
+        raise Halt
+
+    def decode_operation(self, index, op, operands, line_number):
+        r = self.registers
+        following = index + 1
+
+        if op in OPERATIONS or op in ('div', 'rem'):
+            if len(operands) == 2:
+                operands = [operands[0], *operands]  # e.g. addiu $sp 4
+            d, s = self.register(operands[0], written=True), self.register(operands[1])
+            if op in ('div', 'rem'):
+                divide = truncating_division if op == 'div' else lambda a, b: a - truncating_division(a, b) * b
+                operation = lambda a, b: divide_checked(divide, a, b, line_number)
+            else:
+                operation = OPERATIONS[op]
+            if operands[2] in REGISTERS:
+                t = self.register(operands[2])
+
+                def run():
+                    r[d] = operation(r[s], r[t])
+                    return following
+            else:
+                v = self.value(operands[2])
+
+                def run():
+                    r[d] = operation(r[s], v)
+                    return following
+            return run
+
+        if op in ('li', 'la'):
+            d, v = self.register(operands[0], written=True), self.value(operands[1])
+
+            def run():
+                r[d] = v
+                return following
+            return run
+
+        if op in ('move', 'neg', 'negu', 'not'):
+            d, s = self.register(operands[0], written=True), self.register(operands[1])
+            if op == 'move':
+                def run():
+                    r[d] = r[s]
+                    return following
+            elif op == 'not':
+                def run():
+                    r[d] = ~r[s]
+                    return following
+            else:
+                def run():
+                    r[d] = wrap(-r[s])
+                    return following
+            return run
+
+        if op in ('lw', 'sw', 'lb', 'lbu', 'sb'):
+            t = self.register(operands[0], written=op.startswith('l'))
+            match = _address.match(operands[1])
+            if match is not None:
+                offset, base = int(match.group(1) or '0', 0), self.register(match.group(2))
+            else:
+                offset, base = self.labels[operands[1]], ZERO
+            # Words on the stack are accessed directly, others through the checks of load_word etc.
+            stack_words, stack_base, stack_size = self.stack_words, self.stack_base, len(self.stack)
+            if op == 'lw':
+                load_word = self.load_word
+
+                def run():
+                    address = r[base] + offset
+                    index = address - stack_base
+                    if 0 <= index < stack_size and not index & 3:
+                        r[t] = stack_words[index >> 2]
+                    else:
+                        r[t] = load_word(address)
+                    return following
+            elif op == 'sw':
+                store_word = self.store_word
+
+                def run():
+                    address = r[base] + offset
+                    index = address - stack_base
+                    if 0 <= index < stack_size and not index & 3:
+                        stack_words[index >> 2] = r[t]
+                    else:
+                        store_word(address, r[t])
+                    return following
+            elif op == 'sb':
+                store_byte = self.store_byte
+
+                def run():
+                    store_byte(r[base] + offset, r[t])
+                    return following
+            else:
+                load_byte, unsigned = self.load_byte, op == 'lbu'
+
+                def run():
+                    value = load_byte(r[base] + offset)
+                    r[t] = value & 0xFF if unsigned else value
+                    return following
+            return run
+
+        if op in ('b', 'j'):
+            target = self.target(operands[0], line_number)
+            return lambda: target
+
+        if op == 'jal':
+            target, return_address = self.target(operands[0], line_number), TEXT_BASE + 4 * following
+
+            def run():
+                r[RA] = return_address
+                return target
+            return run
+
+        if op == 'jr':
+            s, instruction_count = self.register(operands[0]), self.instruction_count
+
+            def run():
+                address = r[s]
+                if address & 3 or not 0 <= address - TEXT_BASE < 4 * instruction_count:
+                    raise MIPSError(f'line {line_number}: bad jump address {address:#x}')
+                return (address - TEXT_BASE) >> 2
+            return run
+
+        if op in BRANCHES_ON_ZERO:
+            s, target, condition = self.register(operands[0]), self.target(operands[1], line_number), \
+                BRANCHES_ON_ZERO[op]
+            return lambda: target if condition(r[s]) else following
+
+        if op in BRANCHES:
+            s, target, condition = self.register(operands[0]), self.target(operands[2], line_number), BRANCHES[op]
+            if operands[1] in REGISTERS:
+                t = self.register(operands[1])
+                return lambda: target if condition(r[s], r[t]) else following
+            v = self.value(operands[1])
+            return lambda: target if condition(r[s], v) else following
+
+        if op == 'syscall':
+            syscall = self.syscall
+
+            def run():
+                return syscall() or following
+            return run
+
+        if op == 'nop':
+            return lambda: following
+
+        raise MIPSError(f'line {line_number}: unsupported instruction {op}')
+
+    # --- running ---
+
+    def run(self, max_steps=DEFAULT_MAX_STEPS, counts=None):
+        """
+        Runs the program from `main`, returning everything it printed. If given, the
+        list `counts` has the element for each instruction incremented each time it's run.
+        """
+        if 'main' not in self.labels:
+            raise MIPSError('no main label')
+        code = self.code
+        pc = self.instruction_index(self.labels['main'])
+        steps = 0
+        halted = False
+        try:
+            # steps counts the instructions completed before the current one
+            if counts is None:
+                for steps in range(max_steps):
+                    pc = code[pc]()
+            else:
+                for steps in range(max_steps):
+                    counts[pc] += 1
+                    pc = code[pc]()
+            steps = max_steps
+            # the program may have exited with its very last step
+            halted = pc == self.instruction_count
+        except Halt:
+            halted = True
+        finally:
+            self.steps = steps
+        if not halted:
+            raise MIPSError(f'gave up after {max_steps} steps')
+        return ''.join(self.output)
+
+
+def divide_checked(divide, a, b, line_number):
+    if b == 0:
+        raise MIPSError(f'line {line_number}: division by zero')
+    return wrap(divide(a, b))
+
+
+def run(source, max_steps=DEFAULT_MAX_STEPS, **machine_options):
+    """
+    Assembles and runs MIPS source, returning what it printed and the `Machine` that ran
+    it, e.g. to look at its `steps`.
+    """
+    machine = Machine(assemble(source), **machine_options)
+    return machine.run(max_steps), machine
+
+
+def parse_arguments(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Run a MIPS assembly file, printing its output.')
+    arg_parser.add_argument('asm_file', help='the .asm file to run')
+    arg_parser.add_argument('--max-steps', type=int, default=DEFAULT_MAX_STEPS,
+                            help='give up after running this many instructions (default: %(default)s)')
+    arg_parser.add_argument('--stats', action='store_true',
+                            help='report the number of instructions run on stderr')
+    return arg_parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    arguments = parse_arguments()
+    with open(arguments.asm_file) as asm_file:
+        machine = Machine(assemble(asm_file.read()))
+    try:
+        output = machine.run(arguments.max_steps)
+    except MIPSError as error:
+        sys.stdout.write(''.join(machine.output))
+        sys.exit(f'\nError after {machine.steps} steps: {error}')
+    sys.stdout.write(output)
+    if arguments.stats:
+        print(f'\n{machine.steps} instructions run, {machine.stack_used} bytes of stack and '
+              f'{machine.heap_used} of heap used', file=sys.stderr)
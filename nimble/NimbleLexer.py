@@ -1,5 +1,6 @@
 # Generated from /Users/phillips/Sync/EEE340 2022/code/lab 5 start/Nimble.g4 by ANTLR 4.11.1
 from antlr4 import *
+from .atn_cache import cached_atn
 from io import StringIO
 import sys
 if sys.version_info[1] > 5:
@@ -88,7 +89,7 @@ def serializedATN():
 
 class NimbleLexer(Lexer):
 
-    atn = ATNDeserializer().deserialize(serializedATN())
+    atn = cached_atn(serializedATN(), 'NimbleLexer')
 
     decisionsToDFA = [ DFA(ds, i) for i, ds in enumerate(atn.decisionToState) ]
 
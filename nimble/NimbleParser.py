@@ -1,6 +1,7 @@
 # Generated from /Users/phillips/Sync/EEE340 2022/code/lab 5 start/Nimble.g4 by ANTLR 4.11.1
 # encoding: utf-8
 from antlr4 import *
+from .atn_cache import cached_atn
 from io import StringIO
 import sys
 if sys.version_info[1] > 5:
@@ -69,7 +70,7 @@ class NimbleParser ( Parser ):
 
     grammarFileName = "Nimble.g4"
 
-    atn = ATNDeserializer().deserialize(serializedATN())
+    atn = cached_atn(serializedATN(), 'NimbleParser')
 
     decisionsToDFA = [ DFA(ds, i) for i, ds in enumerate(atn.decisionToState) ]
 
@@ -0,0 +1,74 @@
+"""
+Startup cache for the ATNs of the generated Nimble lexer and parser.
+
+The generated recognizers rebuild their ATN from `serializedATN()` with
+`ATNDeserializer` every time they are imported. `cached_atn` instead loads the
+already-built ATN object graph (states, transitions, interval sets, lexer actions)
+from a pickle stored next to the generated module. Each pickle is named for a hash of
+the serialized ATN it was built from, so only one made from the same serialized ATN
+is ever unpickled; if there is none, or it is unreadable, the ATN is deserialized as
+usual.
+
+Importing the recognizers never writes the pickles, so that read-only installs work.
+They are written only when the cache is warmed explicitly, by `warm_atn_cache`
+(which training the DFA cache does too, see `dfa_cache`); stale ones are removed then.
+
+The generated modules call `cached_atn` in place of `ATNDeserializer().deserialize`;
+that one line has to be reapplied if the recognizers are regenerated from Nimble.g4.
+"""
+
+import glob
+import hashlib
+import os
+import pickle
+
+from antlr4.atn.ATNDeserializer import ATNDeserializer
+
+CACHE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def atn_pickle_path(serialized_atn, recognizer_name):
+    """The path of the pickle of the ATN built from `serialized_atn`."""
+    digest = hashlib.sha256(repr(serialized_atn).encode()).hexdigest()
+    return os.path.join(CACHE_DIR, f'{recognizer_name}.{digest}.atn.pickle')
+
+
+def cached_atn(serialized_atn, recognizer_name):
+    """
+    Returns the ATN for `serialized_atn`, loading it from its pickle if the cache has
+    been warmed for the same serialized ATN.
+    """
+    try:
+        with open(atn_pickle_path(serialized_atn, recognizer_name), 'rb') as f:
+            return pickle.load(f)
+    except (OSError, EOFError, ValueError, TypeError, pickle.UnpicklingError, AttributeError, ImportError):
+        return ATNDeserializer().deserialize(serialized_atn)
+
+
+def save_atn(serialized_atn, recognizer_name):
+    """
+    Pickles the ATN for `serialized_atn`, removing the recognizer's other pickles.
+    Returns False if it couldn't be written, e.g. to a read-only directory.
+    """
+    path = atn_pickle_path(serialized_atn, recognizer_name)
+    atn = ATNDeserializer().deserialize(serialized_atn)
+    try:
+        temporary_path = f'{path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'wb') as f:
+            pickle.dump(atn, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, path)
+        for stale_path in glob.glob(os.path.join(CACHE_DIR, f'{recognizer_name}.*.atn.pickle')):
+            if stale_path != path:
+                os.remove(stale_path)
+    except (OSError, pickle.PicklingError, RecursionError):
+        return False
+    return True
+
+
+def warm_atn_cache():
+    """Pickles the ATNs of the Nimble lexer and parser, returning True if both were written."""
+    from .NimbleLexer import serializedATN as lexer_atn
+    from .NimbleParser import serializedATN as parser_atn
+
+    lexer_saved = save_atn(lexer_atn(), 'NimbleLexer')
+    return save_atn(parser_atn(), 'NimbleParser') and lexer_saved
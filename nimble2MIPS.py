@@ -10,19 +10,198 @@ Date: 01-04-2023                            im doing the cleaning, so odds are y
 Instructor version: 2023-03-15
 """
 
+import re
+
+from antlr4 import ParserRuleContext
+
+import rope
 import templates
+from register_allocator import Expression, Operand, UnaryOperation, BinaryOperation
 from nimble import NimbleListener, NimbleParser
 from semantics import PrimitiveType
 
+_escape_sequence = re.compile(r'\\.')
+
+
+def literal_length(literal):
+    """The number of chars in the string a Nimble string literal (with quotes) stands for."""
+    # each escape sequence, a backslash and another char, stands for a single char
+    return len(_escape_sequence.sub('_', literal[1:-1]))
+
+
+def string_literal_declarations(string_literals, length_prefixed_strings=False):
+    """The data section declarations of the given string literals, mapped from their labels."""
+    if length_prefixed_strings:
+        return '\n'.join(f'.align 2\n.word {literal_length(string)}\n{label}: .asciiz {string}'
+                         for label, string in string_literals.items())
+    return '\n'.join(f'{label}: .asciiz {string}' for label, string in string_literals.items())
+
+
+def built_in_functions(length_prefixed_strings=False):
+    """The fields of `templates.text_section` holding the built-in functions."""
+    # the operands of stringconcat are pushed left first, so the left one is further up;
+    # its labels contain '.', which no Nimble identifier can, so never clash with a function's
+    stringconcat = rope.flatten(rope.fill(
+        templates.enter_func_def,
+        func_name='.stringconcat',
+        func_body=rope.fill(
+            templates.string_cat_length_prefixed if length_prefixed_strings else templates.string_cat,
+            expr0='lw $t0 12($fp)',
+            expr1='lw $t0 8($fp)',
+            iter_char1='.stringconcat.count.1',
+            iter_char2='.stringconcat.count.2',
+            next_1='.stringconcat.counted.1',
+            fin_count='.stringconcat.counted.2'
+        )
+    ))
+    if length_prefixed_strings:
+        return dict(stringlen=templates.stringlen_length_prefixed,
+                    substring_template=templates.substring_length_prefixed,
+                    stringconcat=stringconcat, memcpy=templates.memcpy)
+    return dict(stringlen=templates.stringlen, substring_template=templates.substring_template,
+                stringconcat=stringconcat, memcpy=templates.memcpy)
+
+
+def in_tail_position(statement):
+    """True if `statement`, in a function, is only ever followed by returning from it."""
+    while True:
+        block = statement.parentCtx
+        if statement is not block.children[-1]:
+            return False
+        parent = block.parentCtx
+        if isinstance(parent, NimbleParser.BodyContext):
+            return isinstance(parent.parentCtx, NimbleParser.FuncDefContext)
+        if not isinstance(parent, NimbleParser.IfContext):
+            return False  # the body of a while loop is followed by its condition
+        statement = parent
+
 
 class MIPSGenerator(NimbleListener):
 
-    def __init__(self, global_scope, types, mips):
+    def __init__(self, global_scope, types, mips, constants=None, length_prefixed_strings=False,
+                 inline_concat_in_loops=False, annotate_lines=False):
+        """
+        Generated code is built up as ropes (see `rope`) in `mips`, which maps each
+        node to the code generated for it; the script's code is flattened into a
+        single string when the script node is exited.
+
+        `constants` optionally gives the values of constant expressions, as computed
+        by `constant_folding.FoldConstants` (which must see each node before this).
+
+        With `length_prefixed_strings`, every string, in the data section or on the
+        heap, is preceded by a word holding its length, so that `stringlength` is a
+        single load and concatenation doesn't need to count chars.
+
+        String concatenations call the stringconcat built-in routine, except that with
+        `inline_concat_in_loops`, those in `while` loops have the routine's code
+        inlined instead, trading code size for the cost of the call.
+
+        With `annotate_lines`, the code of each function definition, declaration and
+        statement starts with a `templates.line_annotation` comment giving its source
+        line, for profiling (see `profiler`).
+        """
         self.current_scope = global_scope
         self.types = types
         self.mips = mips
+        self.constants = constants if constants is not None else {}
+        self.length_prefixed_strings = length_prefixed_strings
+        self.inline_concat_in_loops = inline_concat_in_loops
+        self.annotate_lines = annotate_lines
+        self.loop_depth = 0  # the number of while loops the current node is in
         self.label_index = -1
-        self.string_literals = {}
+        self.string_literals = {}  # label -> literal, quotes included
+        self.string_labels = {}  # literal -> label, so each distinct literal is declared once
+        # For the function being generated: the code of each of its returns, filled in on
+        # exiting it, as its frame is only known then; whether it calls Nimble functions,
+        # other than by self tail calls; and the label its self tail calls jump to
+        self.returns = []
+        self.calls_functions = False
+        self.body_label = None
+
+    def consume(self, ctx):
+        """
+        Returns the code generated for `ctx`, as a rope, and drops it from `self.mips`.
+        Each node's code goes into its parent's exactly once, so apart from the script
+        node, `self.mips` only holds the code of nodes whose parent is yet to be exited.
+
+        Side-effect-free expressions are held in `self.mips` as register allocator
+        `Expression`s, so that enclosing operations can combine them; their code is
+        only generated, leaving the value in $t0, once consumed by anything else.
+        """
+        code = self.mips.pop(ctx)
+        if isinstance(code, Expression):
+            return code.code()
+        return code
+
+    def fold_if_constant(self, ctx):
+        """If `ctx` is a constant expression, replaces its code with a load of its value."""
+        if ctx in self.constants:
+            self.mips[ctx] = Operand('li     {{register}} {}'.format(int(self.constants[ctx])))
+
+    def binary_operation(self, ctx, operation):
+        """
+        Returns the `Expression` for `operation` on the two operands of `ctx` if both are
+        `Expression`s, and otherwise code computing it with the operands on the stack.
+        """
+        left, right = ctx.expr(0), ctx.expr(1)
+        if isinstance(self.mips[left], Expression) and isinstance(self.mips[right], Expression):
+            return BinaryOperation(operation, self.mips.pop(left), self.mips.pop(right))
+        return rope.fill(
+            templates.add_sub_mul_div_compare,
+            operation=operation,
+            expr0=self.consume(left),
+            expr1=self.consume(right)
+        )
+
+    def function_call(self, func_name, args):
+        """Returns code calling `func_name`, pushing the code of each argument in the order given."""
+        args_code = []
+        for arg in args:
+            args_code += ["addiu $sp $sp -4\n", arg, "\nsw $t0 4($sp)\n"]
+        return rope.fill(
+            templates.exit_func_call,
+            func_name=func_name,
+            args_body=args_code,
+            pop_args_offset=len(args) * 4    # <-- Field for popping arguments off stack at end
+        )
+
+    def is_self_tail_call(self, ctx):
+        """True if `ctx` is a call of the function it's in, made as the last thing it does."""
+        # main's scope is named $main, so never matches
+        if ctx.ID().getText() != self.current_scope.name:
+            return False
+        parent = ctx.parentCtx
+        if isinstance(parent, NimbleParser.FuncCallStmtContext):
+            return in_tail_position(parent)
+        return isinstance(parent, NimbleParser.FuncCallExprContext) and isinstance(parent.parentCtx,
+                                                                                   NimbleParser.ReturnContext)
+
+    def self_tail_call(self, ctx):
+        """Returns code for the self tail call `ctx`, reusing the current call (see `templates.self_tail_call`)."""
+        # Pushed last first, as for any call, so the first is on top
+        args_code = []
+        for arg in reversed(ctx.expr()):
+            args_code += ["addiu $sp $sp -4\n", self.consume(arg), "\nsw $t0 4($sp)\n"]
+        move_args = [f'lw $t0 {4 * (i + 1)}($sp)\nsw $t0 {8 + 4 * i}($fp)\n' for i in range(len(ctx.expr()))]
+        if self.body_label is None:
+            self.body_label = self.unique_label(f'{self.current_scope.name}_body')
+        return rope.fill(
+            templates.self_tail_call,
+            args_body=args_code,
+            move_args=move_args,
+            pop_offset=4 * (len(ctx.expr()) + len(self.current_scope.local_variables())),
+            body_label=self.body_label
+        )
+
+    def annotated(self, ctx, code):
+        """`code`, generated for `ctx`, preceded by its source line if annotating lines."""
+        if not self.annotate_lines:
+            return code
+        return [rope.fill(templates.line_annotation, line=ctx.start.line), code]
+
+    def exitEveryRule(self, ctx: ParserRuleContext):
+        if self.annotate_lines and isinstance(ctx, (NimbleParser.StatementContext, NimbleParser.VarDecContext)):
+            self.mips[ctx] = self.annotated(ctx, self.consume(ctx))
 
     def unique_label(self, base):
         """
@@ -39,16 +218,33 @@ class MIPSGenerator(NimbleListener):
     def enterFuncDef(self, ctx: NimbleParser.FuncDefContext):
         # Switch scope to the calling function
         self.current_scope = self.current_scope.child_scope_named(ctx.ID().getText())
+        self.returns = []
+        self.calls_functions = False
+        self.body_label = None
 
     def exitFuncDef(self, ctx: NimbleParser.FuncDefContext):
+        """
+        Leaf functions, which call no Nimble functions (but may call built-in ones, or
+        themselves by self tail calls), with no local variables, don't need a stack frame
+        (see `templates.enter_frameless_func_def`). Their returns restore the caller's
+        frame pointer accordingly.
+        """
         # Extract function name
         func_name = ctx.ID().getText()
+        frameless = not self.calls_functions and not self.current_scope.local_variables()
+        for code, expr in self.returns:
+            code.extend(rope.fill(templates.frameless_return if frameless else templates.return_statment,
+                                  expr=expr))
+        func_body = self.consume(ctx.body())
+        if self.body_label is not None:
+            func_body = [f'{self.body_label}:\n', func_body]
 
         # Set the MIPS translation.
-        self.mips[ctx] = templates.enter_func_def.format(
+        self.mips[ctx] = self.annotated(ctx, rope.fill(
+            templates.enter_frameless_func_def if frameless else templates.enter_func_def,
             func_name=func_name,
-            func_body=(self.mips[ctx.body()])
-        )
+            func_body=func_body
+        ))
 
         # Switch scope to enclosing scope
         self.current_scope = self.current_scope.enclosing_scope
@@ -57,34 +253,40 @@ class MIPSGenerator(NimbleListener):
         # First handle if we're calling return in the main scope
         if self.current_scope.enclosing_scope.child_scope_named("$main") == self.current_scope:
             self.mips[ctx] = "li $v0 10\nsyscall"
+        elif isinstance(ctx.expr(), NimbleParser.FuncCallExprContext) and self.is_self_tail_call(ctx.expr().funcCall()):
+            # The self tail call doesn't come back here
+            self.mips[ctx] = self.consume(ctx.expr())
         else:
-            # If not in main, handle return accordingly if paired with expression
-            self.mips[ctx] = templates.return_statment.format(
-                expr=self.mips[ctx.expr()] if ctx.expr() is not None else ""
-            )
+            # If not in main, handle return accordingly if paired with expression. The
+            # code is filled in on exiting the function, once its frame is known
+            self.mips[ctx] = []
+            self.returns.append((self.mips[ctx], self.consume(ctx.expr()) if ctx.expr() is not None else ""))
 
     def exitFuncCall(self, ctx: NimbleParser.FuncCallContext):
         # Extract function argument expressions
         func_args = [this_expr for this_expr in ctx.expr()]
 
-        # Construct script to push extracted arguments onto stack
-        args_str = ""
-        for arg in reversed(func_args):
-            args_str += "addiu $sp $sp -4\n{}\nsw $t0 4($sp)\n".format(self.mips[arg])
+        if self.length_prefixed_strings and ctx.ID().getText() == 'stringlength':
+            # The length is stored just before the string
+            self.mips[ctx] = [self.consume(func_args[0]), '\nlw     $t0 -4($t0)']
+            return
 
-        # Set translation
-        self.mips[ctx] = templates.exit_func_call.format(
-            func_name=ctx.ID().getText(),
-            args_body=args_str,
-            pop_args_offset=len(func_args) * 4    # <-- Field for popping arguments off stack at end
-        )
+        if self.is_self_tail_call(ctx):
+            self.mips[ctx] = self.self_tail_call(ctx)
+            return
+        # Built-in functions have no scopes, and leave $s7 alone
+        if self.current_scope.enclosing_scope.child_scope_named(ctx.ID().getText()) is not None:
+            self.calls_functions = True
+
+        # Push the arguments onto the stack, last first, so that the first is on top
+        self.mips[ctx] = self.function_call(ctx.ID().getText(), [self.consume(arg) for arg in reversed(func_args)])
 
     def exitFuncCallStmt(self, ctx: NimbleParser.FuncCallStmtContext):
-        self.mips[ctx] = self.mips[ctx.funcCall()]
+        self.mips[ctx] = self.consume(ctx.funcCall())
 
     def exitFuncCallExpr(self, ctx: NimbleParser.FuncCallExprContext):
         # If it exists, return statement will put return value in $t0
-        self.mips[ctx] = self.mips[ctx.funcCall()]
+        self.mips[ctx] = self.consume(ctx.funcCall())
 
     # ---------------------------------------------------------------------------------
     # Provided for you
@@ -95,35 +297,43 @@ class MIPSGenerator(NimbleListener):
 
     def exitScript(self, ctx: NimbleParser.ScriptContext):
         # Extracting function definitions
-        func_defs = "".join(self.mips[this_def] for this_def in ctx.funcDef())
+        func_defs = [self.consume(this_def) for this_def in ctx.funcDef()]
 
         # Added stringlen and substring_template built-in function definitions
-        self.mips[ctx] = templates.script.format(
-            string_literals='\n'.join(f'{label}: .asciiz {string}' for label, string in self.string_literals.items()),
-            main=self.mips[ctx.main()],
+        script_code = rope.fill(
+            templates.script,
+            string_literals=self.string_literal_declarations(),
+            main=self.consume(ctx.main()),
             func_defs=func_defs,
-            stringlen=templates.stringlen,
-            substring_template=templates.substring_template
+            **built_in_functions(self.length_prefixed_strings)
         )
+        # The only point at which the code is assembled into one string
+        self.mips[ctx] = rope.flatten(script_code)
+
+    def string_literal_declarations(self):
+        return string_literal_declarations(self.string_literals, self.length_prefixed_strings)
 
     def exitMain(self, ctx: NimbleParser.MainContext):
-        self.mips[ctx] = self.mips[ctx.body()]
+        self.mips[ctx] = self.consume(ctx.body())
         self.current_scope = self.current_scope.enclosing_scope
 
     def exitBlock(self, ctx: NimbleParser.BlockContext):
-        self.mips[ctx] = '\n'.join(self.mips[s] for s in ctx.statement())
+        self.mips[ctx] = rope.join('\n', [self.consume(s) for s in ctx.statement()])
 
     def exitBoolLiteral(self, ctx: NimbleParser.BoolLiteralContext):
         value = 1 if ctx.BOOL().getText() == 'true' else 0
-        self.mips[ctx] = 'li     $t0 {}'.format(value)
+        self.mips[ctx] = Operand('li     {{register}} {}'.format(value))
 
     def exitIntLiteral(self, ctx: NimbleParser.IntLiteralContext):
-        self.mips[ctx] = 'li     $t0 {}'.format(ctx.INT().getText())
+        self.mips[ctx] = Operand('li     {{register}} {}'.format(ctx.INT().getText()))
 
     def exitStringLiteral(self, ctx: NimbleParser.StringLiteralContext):
-        label = self.unique_label('string')
-        self.string_literals[label] = ctx.getText()
-        self.mips[ctx] = 'la     $t0 {}'.format(label)
+        # Strings are never modified, so all occurrences of a literal can share its label
+        literal = ctx.getText()
+        if literal not in self.string_labels:
+            self.string_labels[literal] = self.unique_label('string')
+            self.string_literals[self.string_labels[literal]] = literal
+        self.mips[ctx] = Operand('la     {{register}} {}'.format(self.string_labels[literal]))
 
     def exitPrint(self, ctx: NimbleParser.PrintContext):
         """
@@ -131,11 +341,12 @@ class MIPSGenerator(NimbleListener):
         but the values are encoded as 1 or 0
         """
         if self.types[ctx.expr()] == PrimitiveType.Bool:
-            self.mips[ctx] = templates.print_bool.format(expr=self.mips[ctx.expr()])
+            self.mips[ctx] = rope.fill(templates.print_bool, expr=self.consume(ctx.expr()))
         else:
             # in the SPIM print syscall, 1 is the service code for Int, 4 for String
-            self.mips[ctx] = templates.print_int_or_string.format(
-                expr=self.mips[ctx.expr()],
+            self.mips[ctx] = rope.fill(
+                templates.print_int_or_string,
+                expr=self.consume(ctx.expr()),
                 service_code=1 if self.types[ctx.expr()] == PrimitiveType.Int else 4
             )
 
@@ -144,49 +355,59 @@ class MIPSGenerator(NimbleListener):
     # ---------------------------------------------------------------------------------
 
     def exitBody(self, ctx: NimbleParser.BodyContext):
-        self.mips[ctx] = self.mips[ctx.varBlock()] + "\n" + self.mips[ctx.block()]
+        self.mips[ctx] = [self.consume(ctx.varBlock()), "\n", self.consume(ctx.block())]
 
     def exitAddSub(self, ctx: NimbleParser.AddSubContext):
         """
         String concatenation and integer addition and subtraction are handled separately
         String concatenation is first. It is done by running the assembly code found in
-        templates file. It is broken into two major parts. First the total length of each
-        both strings is counted and stored in register $s1. In between the steps an area of
-        memory is allocated of size $s1 and the pointer to the memory is stored in $s0
-        The second step is to copy each of character from both of the strings into the newly
-        allocated space including a null pointer at the end. The result is then stored in $t0
+        templates file. It is broken into two major parts. First the lengths of both
+        strings are counted into registers $s0 and $s1 (or, with length-prefixed strings,
+        loaded). In between the steps an area of memory is allocated for both plus a null
+        terminator. The second step is to copy the chars of both of the strings into the
+        newly allocated space, using the memcpy routine, and to add the null terminator
+        at the end. The result is then stored in $t0
 
         add sub is much simpler. The nimble operation char is translated to the appropriate
         mips instruction. Each of the expressions is then the appropriate mips operation is
         applied on it with the result stored in $t0
         """
 
-        if self.types[ctx.expr(0)] == PrimitiveType.String:
-            self.mips[ctx] = templates.string_cat.format(
-                expr0=self.mips[ctx.expr(0)],
-                expr1=self.mips[ctx.expr(1)],
+        if self.types[ctx.expr(0)] == PrimitiveType.String and not (self.inline_concat_in_loops and self.loop_depth):
+            self.mips[ctx] = self.function_call('.stringconcat',
+                                                [self.consume(ctx.expr(0)), self.consume(ctx.expr(1))])
+        elif self.types[ctx.expr(0)] == PrimitiveType.String:
+            self.mips[ctx] = rope.fill(
+                templates.string_cat_length_prefixed if self.length_prefixed_strings else templates.string_cat,
+                expr0=self.consume(ctx.expr(0)),
+                expr1=self.consume(ctx.expr(1)),
                 iter_char1=self.unique_label('iter_char1'),
                 iter_char2=self.unique_label('iter_char2'),
                 next_1=self.unique_label('next_1'),
-                fin_count=self.unique_label('fin_count'),
-                cp_chars_1=self.unique_label('cp_chars_1'),
-                next_2=self.unique_label('next_2'),
-                cp_chars_2=self.unique_label('cp_chars_2'),
-                fin_cp=self.unique_label('fin_cp')
+                fin_count=self.unique_label('fin_count')
             )
         else:
-            self.mips[ctx] = templates.add_sub_mul_div_compare.format(
-                operation='add' if ctx.op.text == '+' else 'sub',
-                expr0=self.mips[ctx.expr(0)],
-                expr1=self.mips[ctx.expr(1)]
-            )
+            self.mips[ctx] = self.binary_operation(ctx, 'add' if ctx.op.text == '+' else 'sub')
+            self.fold_if_constant(ctx)
 
     def exitIf(self, ctx: NimbleParser.IfContext):
-        self.mips[ctx] = templates.if_else_.format(
-            condition=self.mips[ctx.expr()],
-            true_block=self.mips[ctx.block(0)],
+        if ctx.expr() in self.constants:
+            # Only the branch that will be taken is kept
+            del self.mips[ctx.expr()]
+            taken, not_taken = ctx.block(0), ctx.block(1)
+            if not self.constants[ctx.expr()]:
+                taken, not_taken = not_taken, taken
+            if not_taken is not None:
+                del self.mips[not_taken]
+            self.mips[ctx] = self.consume(taken) if taken is not None else ""
+            return
+
+        self.mips[ctx] = rope.fill(
+            templates.if_else_,
+            condition=self.consume(ctx.expr()),
+            true_block=self.consume(ctx.block(0)),
             endif_label=self.unique_label('endif'),
-            false_block=self.mips[ctx.block(1)] if ctx.block(1) is not None else "",
+            false_block=self.consume(ctx.block(1)) if ctx.block(1) is not None else "",
             endelse_label=self.unique_label('endelse')  # Adding this is fine even when no else statement.
         )
 
@@ -195,18 +416,19 @@ class MIPSGenerator(NimbleListener):
     # ---------------------------------------------------------------------------------
 
     def exitVarBlock(self, ctx: NimbleParser.VarBlockContext):
-        self.mips[ctx] = '\n'.join(self.mips[s] for s in ctx.varDec())
+        self.mips[ctx] = rope.join('\n', [self.consume(s) for s in ctx.varDec()])
 
     def exitVarDec(self, ctx: NimbleParser.VarDecContext):
         # Reserve a slot in stack for declared local var
         slot_offset = (-4 * self.current_scope.resolve(ctx.ID().getText()).index)  # MODIFIED TO REMOVE EMPTY SPACE
 
         # Handle if there was assignment
-        val_init_code = self.mips[ctx.expr()] if ctx.expr() is not None else (
+        val_init_code = self.consume(ctx.expr()) if ctx.expr() is not None else (
             "li $t0 0" if PrimitiveType[ctx.TYPE().getText()] != PrimitiveType.ERROR else "")
 
         # Set the mips translation.
-        self.mips[ctx] = templates.var_dec.format(
+        self.mips[ctx] = rope.fill(
+            templates.var_dec,
             val_init=val_init_code,
             offset=slot_offset
         )
@@ -221,36 +443,63 @@ class MIPSGenerator(NimbleListener):
             slot_offset = (4 * (this_symbol.index + 1)) + 4
         else:
             slot_offset = -4 * this_symbol.index
-        self.mips[ctx] = templates.assigment.format(
-            expr=self.mips[ctx.expr()],
+        self.mips[ctx] = rope.fill(
+            templates.assigment,
+            expr=self.consume(ctx.expr()),
             offset=slot_offset
         )
 
+    def enterWhile(self, ctx: NimbleParser.WhileContext):
+        self.loop_depth += 1
+
     def exitWhile(self, ctx: NimbleParser.WhileContext):
-        self.mips[ctx] = templates.while_.format(
-            condition=self.mips[ctx.expr()],
-            true_block=self.mips[ctx.block()],
+        self.loop_depth -= 1
+        if ctx.expr() in self.constants:
+            del self.mips[ctx.expr()]
+            if self.constants[ctx.expr()]:
+                self.mips[ctx] = rope.fill(
+                    templates.while_true,
+                    true_block=self.consume(ctx.block()),
+                    startwhile_label=self.unique_label("startwhile")
+                )
+            else:
+                # The loop never runs
+                del self.mips[ctx.block()]
+                self.mips[ctx] = ""
+            return
+
+        self.mips[ctx] = rope.fill(
+            templates.while_,
+            condition=self.consume(ctx.expr()),
+            true_block=self.consume(ctx.block()),
             startwhile_label=self.unique_label("startwhile"),
             endwhile_label=self.unique_label("endwhile")
         )
 
     def exitNeg(self, ctx: NimbleParser.NegContext):
+        operand = self.mips[ctx.expr()]
         # Unary minus code
         if ctx.op.text == '-':
-            self.mips[ctx] = templates.unary_minus.format(expr=self.mips[ctx.expr()])
+            if isinstance(operand, Expression):
+                self.mips[ctx] = UnaryOperation('neg    {register}, {register}', self.mips.pop(ctx.expr()))
+            else:
+                self.mips[ctx] = rope.fill(templates.unary_minus, expr=self.consume(ctx.expr()))
         # Boolean negation code
         elif ctx.op.text == '!':
-            self.mips[ctx] = templates.bool_neg.format(expr=self.mips[ctx.expr()])
+            if isinstance(operand, Expression):
+                self.mips[ctx] = UnaryOperation('xori   {register} {register} 1', self.mips.pop(ctx.expr()))
+            else:
+                self.mips[ctx] = rope.fill(templates.bool_neg, expr=self.consume(ctx.expr()))
+        self.fold_if_constant(ctx)
 
     def exitParens(self, ctx: NimbleParser.ParensContext):
-        self.mips[ctx] = self.mips[ctx.expr()]
+        # Passed on as is, so an Expression stays one
+        self.mips[ctx] = self.mips.pop(ctx.expr())
 
     def exitCompare(self, ctx: NimbleParser.CompareContext):
-        self.mips[ctx] = templates.add_sub_mul_div_compare.format(
-            operation='seq' if ctx.op.text == '==' else ('sle' if ctx.op.text == '<=' else 'slt'),
-            expr0=self.mips[ctx.expr(0)],
-            expr1=self.mips[ctx.expr(1)]
-        )
+        self.mips[ctx] = self.binary_operation(
+            ctx, 'seq' if ctx.op.text == '==' else ('sle' if ctx.op.text == '<=' else 'slt'))
+        self.fold_if_constant(ctx)
 
     def exitVariable(self, ctx: NimbleParser.VariableContext):
         # Get the symbol
@@ -263,11 +512,89 @@ class MIPSGenerator(NimbleListener):
             var_offset = (-4 * this_symbol.index)
 
         # Set the translation
-        self.mips[ctx] = "lw   $t0  {}($fp)".format(var_offset)
+        self.mips[ctx] = Operand("lw   {{register}}  {}($fp)".format(var_offset))
 
     def exitMulDiv(self, ctx: NimbleParser.MulDivContext):
-        self.mips[ctx] = templates.add_sub_mul_div_compare.format(
-            operation='mul' if ctx.op.text == '*' else 'div',
-            expr0=self.mips[ctx.expr(0)],
-            expr1=self.mips[ctx.expr(1)]
+        self.mips[ctx] = self.binary_operation(ctx, 'mul' if ctx.op.text == '*' else 'div')
+        self.fold_if_constant(ctx)
+
+
+class StreamingMIPSGenerator(MIPSGenerator):
+    """
+    Writes the generated program to the file object `out` as it goes, rather than
+    leaving it in `mips`: the start of the text section (including the built-in
+    functions) on entering the script, each function definition as it is finished,
+    then main one top-level declaration or statement at a time, and finally the data
+    section, once all string literals are known. So at most one function definition
+    or top-level statement of main is held in memory at once.
+
+    The output is that of `MIPSGenerator` with the data section moved from the start
+    to the end; the script's entry in `mips` is left empty.
+    """
+
+    def __init__(self, global_scope, types, mips, out, constants=None, length_prefixed_strings=False,
+                 inline_concat_in_loops=False, annotate_lines=False):
+        super().__init__(global_scope, types, mips, constants, length_prefixed_strings, inline_concat_in_loops,
+                         annotate_lines)
+        self.out = out
+        self.text_section = None  # the text section template, split around functions and main
+        self.main_blocks = ()  # the var block and block of main's body
+
+    def write(self, code):
+        rope.write(code, self.out)
+
+    def enterScript(self, ctx: NimbleParser.ScriptContext):
+        self.text_section = rope.fill_around(
+            templates.text_section, 'func_defs', 'main',
+            **built_in_functions(self.length_prefixed_strings)
         )
+        self.write(self.text_section[0])
+
+    def exitFuncDef(self, ctx: NimbleParser.FuncDefContext):
+        super().exitFuncDef(ctx)
+        self.write(self.consume(ctx))
+
+    def enterMain(self, ctx: NimbleParser.MainContext):
+        super().enterMain(ctx)
+        self.main_blocks = (ctx.body().varBlock(), ctx.body().block())
+        self.write(self.text_section[1])
+
+    def exitEveryRule(self, ctx: ParserRuleContext):
+        super().exitEveryRule(ctx)
+        # Top-level declarations and statements of main are written as soon as exited,
+        # separated by newlines as in exitVarBlock and exitBlock
+        parent = ctx.parentCtx
+        if parent in self.main_blocks:
+            if ctx is not parent.children[0]:
+                self.write('\n')
+            self.write(self.consume(ctx))
+
+    def exitVarBlock(self, ctx: NimbleParser.VarBlockContext):
+        if ctx in self.main_blocks:
+            self.write('\n')  # separating the declarations from the statements, as in exitBody
+            self.mips[ctx] = []
+        else:
+            super().exitVarBlock(ctx)
+
+    def exitBlock(self, ctx: NimbleParser.BlockContext):
+        if ctx in self.main_blocks:
+            self.mips[ctx] = []
+        else:
+            super().exitBlock(ctx)
+
+    def exitBody(self, ctx: NimbleParser.BodyContext):
+        if ctx.block() in self.main_blocks:
+            self.consume(ctx.varBlock())
+            self.consume(ctx.block())
+            self.mips[ctx] = []
+        else:
+            super().exitBody(ctx)
+
+    def exitMain(self, ctx: NimbleParser.MainContext):
+        super().exitMain(ctx)
+        self.consume(ctx)
+        self.write(self.text_section[2])
+
+    def exitScript(self, ctx: NimbleParser.ScriptContext):
+        self.write(rope.fill(templates.data_section, string_literals=self.string_literal_declarations()))
+        self.mips[ctx] = ''
@@ -0,0 +1,315 @@
+"""
+Peephole optimization of generated MIPS.
+
+Code generated from the templates is full of short redundant sequences where one
+fragment ends and the next begins. `optimize` slides a window over the instructions
+of the text section, applying each rule in `RULES` at each position, and repeats
+until no rule applies anywhere. The rules are:
+
+- a load from the address just stored to is replaced by a move, or dropped if it
+  loads the register that was stored;
+- consecutive adjustments of the same register by constants (e.g., a pop then a
+  push of the stack pointer) are combined, and dropped if they cancel out;
+- a branch or jump to a label that immediately follows it is dropped;
+- a value loaded into a register only to be moved to another one is loaded directly
+  into the other, if the first register is dead after the move;
+- moves of a register to itself are dropped.
+
+Comments and blank lines don't separate instructions and are kept as they are, as
+is everything outside the text section. Labels do separate instructions, since
+control may arrive between them. Lines no rule applies to are left untouched.
+"""
+
+import re
+
+INSTRUCTION, LABEL, OTHER = 'instruction', 'label', 'other'
+
+# ops that transfer control elsewhere; the label operand comes last
+BRANCHES = {'b', 'j', 'beqz', 'bnez', 'bgez', 'bgtz', 'blez', 'bltz',
+            'beq', 'bne', 'blt', 'ble', 'bgt', 'bge'}
+
+# ops whose first operand is the register written; any others are read
+WRITES_FIRST = {'li', 'la', 'lw', 'lb', 'lbu', 'move', 'neg', 'not',
+                'add', 'addu', 'addi', 'addiu', 'sub', 'subu', 'mul', 'div', 'rem',
+                'and', 'andi', 'or', 'ori', 'xor', 'xori', 'nor', 'sll', 'srl', 'sra',
+                'seq', 'sne', 'slt', 'slti', 'sltu', 'sle', 'sgt', 'sge'}
+STORES = {'sw', 'sb'}
+LOADS_OF_CONSTANTS = {'li', 'la'}
+
+# the registers SPIM's syscalls read and write
+SYSCALL_READS = {'$v0', '$a0', '$a1', '$a2'}
+SYSCALL_WRITES = {'$v0'}
+
+_label = re.compile(r'([A-Za-z_.$][\w.$]*):$')
+_memory_operand = re.compile(r'(-?\w*)\((\$\w+)\)$')
+
+
+class Line:
+    """A line of assembly; instructions are also split into their op and operands."""
+
+    __slots__ = ('text', 'kind', 'op', 'args', 'label', 'deleted')
+
+    def __init__(self, text, kind, op=None, args=(), label=None):
+        self.text = text
+        self.kind = kind
+        self.op = op
+        self.args = args
+        self.label = label
+        self.deleted = False
+
+    def rewrite(self, op, args):
+        self.op, self.args = op, tuple(args)
+        self.text = f'{op:<6} {" ".join(args)}'
+
+
+def parse(assembly):
+    """
+    Splits assembly into `Line`s, returning them along with the instructions, labels
+    and other statements of the text section, in order, which is what rules look at.
+    """
+    lines = []
+    code = []
+    in_text = True
+    for text in assembly.split('\n'):
+        statement = text.split('#', 1)[0].strip() if in_text else text.strip()
+        if statement in ('.text', '.data'):
+            in_text = statement == '.text'
+            lines.append(Line(text, OTHER))
+        elif not in_text or not statement:
+            lines.append(Line(text, OTHER))  # not code, or a comment or blank line
+        else:
+            label = _label.match(statement)
+            if label:
+                line = Line(text, LABEL, label=label.group(1))
+            elif statement.startswith('.') or ':' in statement:
+                line = Line(text, OTHER)  # a directive, or a label with something after it
+            else:
+                tokens = statement.replace(',', ' ').split()
+                line = Line(text, INSTRUCTION, tokens[0], tuple(tokens[1:]))
+            lines.append(line)
+            code.append(line)
+    return lines, code
+
+
+def registers_accessed(line):
+    """
+    The sets of registers read and written by an instruction, or None for anything
+    else, including control transfers, whose effect on registers isn't known here.
+    """
+    op, args = line.op, line.args
+    if line.kind != INSTRUCTION:
+        return None
+    if op == 'syscall':
+        return SYSCALL_READS, SYSCALL_WRITES
+    registers = []
+    for arg in args:
+        memory = _memory_operand.match(arg)
+        if memory:
+            registers.append(memory.group(2))
+        elif arg.startswith('$'):
+            registers.append(arg)
+    if op in STORES:
+        return set(registers), set()
+    if op in WRITES_FIRST and args and args[0].startswith('$'):
+        if len(args) == 2 and op in ('addi', 'addiu', 'andi', 'ori', 'xori'):
+            return {args[0]}, {args[0]}  # the two-operand form, e.g. `addiu $s1 1`
+        return set(registers[1:]), {args[0]}
+    return None
+
+
+def constant_adjustment(line):
+    """For `addiu $r $r n` and `addiu $r n`, returns ($r, n); otherwise None."""
+    if line.op not in ('addiu', 'addi') or not line.args[-1].lstrip('-').isdigit():
+        return None
+    if len(line.args) == 2:
+        return line.args[0], int(line.args[1])
+    if len(line.args) == 3 and line.args[0] == line.args[1]:
+        return line.args[0], int(line.args[2])
+    return None
+
+
+def memory_operand(line):
+    """For a single register load or store, returns (register, offset, base register)."""
+    if line.kind == INSTRUCTION and line.op in ('sw', 'lw') and len(line.args) == 2:
+        memory = _memory_operand.match(line.args[1])
+        if memory and line.args[0].startswith('$'):
+            return line.args[0], int(memory.group(1) or '0', 0), memory.group(2)
+    return None
+
+
+class Window:
+    """
+    The lines of code following a position, skipping deleted ones, as long as they
+    are instructions (or, for `labels_after`, labels).
+    """
+
+    def __init__(self, code, i):
+        self.code = code
+        self.i = i
+
+    def following(self, count):
+        """The positions of up to `count` instructions from the window's start."""
+        positions = []
+        j = self.i
+        while j < len(self.code) and len(positions) < count:
+            line = self.code[j]
+            if not line.deleted:
+                if line.kind != INSTRUCTION:
+                    break
+                positions.append(j)
+            j += 1
+        return positions
+
+    def labels_after(self, i):
+        """The labels immediately after position `i`."""
+        labels = set()
+        for j in range(i + 1, len(self.code)):
+            line = self.code[j]
+            if line.deleted:
+                continue
+            if line.kind != LABEL:
+                break
+            labels.add(line.label)
+        return labels
+
+    def is_dead_after(self, i, register):
+        """
+        True if the value of `register` after the line at position `i` is certainly
+        never used, i.e. it is overwritten before it is read, in straight-line code.
+        """
+        for j in range(i + 1, len(self.code)):
+            line = self.code[j]
+            if line.deleted:
+                continue
+            accessed = registers_accessed(line)
+            if accessed is None:
+                return False
+            read, written = accessed
+            if register in read:
+                return False
+            if register in written:
+                return True
+        return False
+
+
+# --- rules: each is given a window on the code, and returns True if it changed it ---
+
+def load_after_store(window):
+    positions = window.following(2)
+    if len(positions) < 2:
+        return False
+    store, load = (window.code[i] for i in positions)
+    if store.op != 'sw' or load.op != 'lw':
+        return False
+    stored, loaded = memory_operand(store), memory_operand(load)
+    if stored is None or loaded is None or stored[1:] != loaded[1:]:
+        return False
+    if loaded[0] == stored[0]:
+        load.deleted = True
+    else:
+        load.rewrite('move', (loaded[0], stored[0]))
+    return True
+
+
+def adjacent_adjustments(window):
+    positions = window.following(2)
+    if len(positions) < 2:
+        return False
+    first, second = (window.code[i] for i in positions)
+    first_adjustment, second_adjustment = constant_adjustment(first), constant_adjustment(second)
+    if first_adjustment is None or second_adjustment is None or first_adjustment[0] != second_adjustment[0]:
+        return False
+    register = first_adjustment[0]
+    total = first_adjustment[1] + second_adjustment[1]
+    second.deleted = True
+    if total == 0:
+        first.deleted = True
+    else:
+        first.rewrite('addiu', (register, register, str(total)))
+    return True
+
+
+def branch_to_next(window):
+    positions = window.following(1)
+    if not positions:
+        return False
+    branch = window.code[positions[0]]
+    if branch.op not in BRANCHES or branch.args[-1] not in window.labels_after(positions[0]):
+        return False
+    branch.deleted = True
+    return True
+
+
+def load_then_move(window):
+    positions = window.following(2)
+    if len(positions) < 2:
+        return False
+    load, move = (window.code[i] for i in positions)
+    if load.op not in LOADS_OF_CONSTANTS or move.op != 'move' or len(move.args) != 2:
+        return False
+    destination, source = move.args
+    if source != load.args[0] or not window.is_dead_after(positions[1], source):
+        return False
+    load.rewrite(load.op, (destination,) + load.args[1:])
+    move.deleted = True
+    return True
+
+
+def move_to_self(window):
+    positions = window.following(1)
+    if not positions:
+        return False
+    move = window.code[positions[0]]
+    if move.op != 'move' or len(move.args) != 2 or move.args[0] != move.args[1]:
+        return False
+    move.deleted = True
+    return True
+
+
+RULES = [load_after_store, adjacent_adjustments, branch_to_next, load_then_move, move_to_self]
+
+
+def optimize(assembly):
+    """Returns `assembly` with the peephole rules applied until none applies."""
+    lines, code = parse(assembly)
+    changed = True
+    while changed:
+        changed = False
+        for i in range(len(code)):
+            if code[i].deleted:
+                continue
+            window = Window(code, i)
+            for rule in RULES:
+                if rule(window):
+                    changed = True
+                    if code[i].deleted:
+                        break
+        code = [line for line in code if not line.deleted]
+    return '\n'.join(line.text for line in lines if not line.deleted)
+
+
+class OptimizingWriter:
+    """
+    Wraps a file object, peephole optimizing what is written to it, a batch of whole
+    lines at a time, e.g. as written by `nimble2MIPS.StreamingMIPSGenerator`. No rule
+    applies across the end of a batch.
+    """
+
+    def __init__(self, out):
+        self.out = out
+        self.pending = ''  # an incomplete last line, held back until it is complete
+
+    def writelines(self, fragments):
+        text = self.pending + ''.join(fragments)
+        complete, newline, self.pending = text.rpartition('\n')
+        if newline:
+            self.out.write(optimize(complete) + newline)
+
+    def write(self, text):
+        self.writelines([text])
+
+    def finish(self):
+        """Writes out any incomplete last line."""
+        if self.pending:
+            self.out.write(optimize(self.pending))
+            self.pending = ''
@@ -0,0 +1,141 @@
+"""
+Records where the time goes in compiling each Nimble file: the wall time of each
+phase of the compiler, and optionally the peak memory allocated during it, traced
+with `tracemalloc` (which slows everything down, so times taken while tracing are
+only good for comparing with each other).
+
+The phases, in the order they run, are:
+
+- `lex`: tokenizing the source with the `NimbleLexer`;
+- `parse`: building the parse tree from the tokens (see `generic_parser.parse`);
+- `scopes`: the semantic walk defining the function scopes and their symbols;
+- `types`: the semantic walk inferring types and checking constraints;
+- `codegen`: generating the MIPS, including constant folding, and for the IR backend
+  the optimization of the IR, and any peephole optimization;
+- `write`: writing the generated MIPS to its .asm file.
+
+A phase that runs more than once for a file, e.g. a two-stage parse falling back to
+the full parse, is timed in total, with the highest of its peaks. Phases that don't
+run, e.g. code generation after errors, are left out.
+
+A `PhaseTimes` collects the phases of one file; `summarize` aggregates those of a
+batch, and `write_report` saves them all as JSON or CSV.
+"""
+
+import csv
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
+from typing import Optional
+
+PHASES = ('lex', 'parse', 'scopes', 'types', 'codegen', 'write')
+
+
+def untimed(phase_name):
+    """Stands in for `PhaseTimes.phase` when nothing is being timed."""
+    return nullcontext()
+
+
+@dataclass
+class PhaseRecord:
+    seconds: float = 0.0
+    peak_bytes: Optional[int] = None  # None unless memory was traced
+
+
+class PhaseTimes:
+    """The `PhaseRecord` of each phase run in compiling the file `name`."""
+
+    def __init__(self, name):
+        self.name = name
+        self.phases = {}  # phase name -> PhaseRecord
+
+    @contextmanager
+    def phase(self, phase_name):
+        """Times the code run in the context as (part of) the named phase."""
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            baseline = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            record = self.phases.get(phase_name)
+            if record is None:
+                record = self.phases[phase_name] = PhaseRecord()
+            record.seconds += elapsed
+            if tracing:
+                peak = tracemalloc.get_traced_memory()[1] - baseline
+                record.peak_bytes = max(record.peak_bytes or 0, peak)
+
+    def total_seconds(self):
+        return sum(record.seconds for record in self.phases.values())
+
+    def as_dict(self):
+        return {'file': self.name,
+                'phases': {phase_name: {'seconds': record.seconds, 'peak_bytes': record.peak_bytes}
+                           for phase_name, record in self.phases.items()}}
+
+
+def ordered_phase_names(phase_times):
+    """The names of the phases run in any of `phase_times`, in `PHASES` order."""
+    seen = {phase_name for times in phase_times for phase_name in times.phases}
+    return [phase_name for phase_name in PHASES if phase_name in seen] + sorted(seen.difference(PHASES))
+
+
+def summarize(phase_times):
+    """
+    Aggregates the `PhaseTimes` of a batch: for each phase, the number of files it ran
+    for, its total, mean and maximum time, and the highest peak allocation, if traced.
+    """
+    summary = {}
+    for phase_name in ordered_phase_names(phase_times):
+        records = [times.phases[phase_name] for times in phase_times if phase_name in times.phases]
+        seconds = [record.seconds for record in records]
+        peaks = [record.peak_bytes for record in records if record.peak_bytes is not None]
+        summary[phase_name] = {'files': len(records),
+                               'total_seconds': sum(seconds),
+                               'mean_seconds': sum(seconds) / len(seconds),
+                               'max_seconds': max(seconds),
+                               'max_peak_bytes': max(peaks) if peaks else None}
+    return summary
+
+
+def format_summary(summary):
+    """A table of a batch `summary`, for the console."""
+    lines = [f'{"phase":<8} {"files":>6} {"total s":>10} {"mean ms":>10} {"max ms":>10} {"max peak KiB":>13}']
+    grand_total = sum(phase['total_seconds'] for phase in summary.values())
+    for phase_name, phase in summary.items():
+        peak = phase['max_peak_bytes']
+        peak_text = f'{peak / 1024:.1f}' if peak is not None else '-'
+        lines.append(f'{phase_name:<8} {phase["files"]:>6} {phase["total_seconds"]:>10.3f} '
+                     f'{1000 * phase["mean_seconds"]:>10.2f} {1000 * phase["max_seconds"]:>10.2f} '
+                     f'{peak_text:>13}')
+    lines.append(f'{"total":<8} {"":>6} {grand_total:>10.3f}')
+    return '\n'.join(lines)
+
+
+def write_report(path, phase_times):
+    """
+    Writes the phase times of each file of a batch, and their `summarize`d totals, to
+    `path`: as CSV if it ends with `.csv`, with a row per file and phase followed by
+    rows for the whole batch under the file name `*`, and otherwise as JSON.
+    """
+    summary = summarize(phase_times)
+    if path.endswith('.csv'):
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['file', 'phase', 'seconds', 'peak_bytes'])
+            for times in phase_times:
+                for phase_name, record in times.phases.items():
+                    writer.writerow([times.name, phase_name, f'{record.seconds:.6f}',
+                                     '' if record.peak_bytes is None else record.peak_bytes])
+            for phase_name, phase in summary.items():
+                writer.writerow(['*', phase_name, f'{phase["total_seconds"]:.6f}',
+                                 '' if phase['max_peak_bytes'] is None else phase['max_peak_bytes']])
+    else:
+        with open(path, 'w') as f:
+            json.dump({'files': [times.as_dict() for times in phase_times], 'summary': summary}, f, indent=2)
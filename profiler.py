@@ -0,0 +1,151 @@
+"""
+Profiles generated MIPS by running it on `mips_simulator`, to find where compiled
+Nimble programs spend their time.
+
+Each instruction run is counted, with the loads and stores of memory and the calls
+(`jal`s) among them, against the label it comes under (the nearest label before it,
+e.g. a function, a built-in routine or a loop), and against the Nimble source line
+it was generated from, given line annotations (see `batch_compile --annotate-lines`);
+code that isn't annotated, e.g. the built-in functions, is put down to no line. Calls
+are also counted against the labels called. Reports rank labels or lines hottest first.
+
+Usage: python profiler.py [--by {label,line}] [--top N] [--source file.nimble] file.asm
+"""
+
+import argparse
+import sys
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+from mips_simulator import DEFAULT_MAX_STEPS, TEXT_BASE, Machine, MIPSError, assemble
+
+LOADS = {'lw', 'lb', 'lbu'}
+STORES = {'sw', 'sb'}
+CALLS = {'jal'}
+
+
+@dataclass
+class Counts:
+    """Dynamic counts for part of a program."""
+    instructions: int = 0
+    loads: int = 0
+    stores: int = 0
+    calls: int = 0  # made
+
+
+@dataclass
+class Profile:
+    """
+    The results of profiling a run of a program: its output, any error it stopped with,
+    and the counts for each label and source line (None for unannotated code), plus the
+    number of times each label was called.
+    """
+    output: str
+    error: Optional[MIPSError]
+    steps: int
+    by_label: Dict[str, Counts] = field(default_factory=dict)
+    by_line: Dict[Optional[int], Counts] = field(default_factory=dict)
+    calls_to: Counter = field(default_factory=Counter)
+
+    def total(self):
+        counts = Counts()
+        for part in self.by_label.values():
+            counts.instructions += part.instructions
+            counts.loads += part.loads
+            counts.stores += part.stores
+            counts.calls += part.calls
+        return counts
+
+
+def profile(source, max_steps=DEFAULT_MAX_STEPS):
+    """Runs MIPS source, returning its `Profile`. Programs that fail are profiled up to the failure."""
+    executable = assemble(source)
+    machine = Machine(executable)
+    counts = [0] * len(machine.code)
+    error = None
+    try:
+        machine.run(max_steps, counts)
+    except MIPSError as e:
+        error = e
+    result = Profile(''.join(machine.output), error, machine.steps)
+
+    # labels by the index of the instruction they label, the last of several winning
+    labels_at = {}
+    for label, address in executable.labels.items():
+        index = (address - TEXT_BASE) >> 2
+        if TEXT_BASE <= address and index < len(executable.text):
+            labels_at[index] = label
+    label = None
+    for index, (_, op, operands) in enumerate(executable.text):
+        label = labels_at.get(index, label)
+        runs = counts[index]
+        if not runs:
+            continue
+        for key, table in ((label, result.by_label), (executable.source_lines[index], result.by_line)):
+            part = table.get(key)
+            if part is None:
+                part = table[key] = Counts()
+            part.instructions += runs
+            if op in LOADS:
+                part.loads += runs
+            elif op in STORES:
+                part.stores += runs
+            elif op in CALLS:
+                part.calls += runs
+        if op in CALLS:
+            result.calls_to[operands[0]] += runs
+    return result
+
+
+def report(result, by='label', top=20, source_lines=None):
+    """
+    Returns a table of the `top` labels or lines (`by`) of a `Profile`, hottest first,
+    showing the text of each line from the list `source_lines`, if given.
+    """
+    total = result.total()
+    table = result.by_label if by == 'label' else result.by_line
+    ranked = sorted(table.items(), key=lambda item: item[1].instructions, reverse=True)[:top]
+    lines = [f'{result.steps} instructions run, {total.loads} loads, {total.stores} stores, '
+             f'{total.calls} calls' + (f'; stopped by error: {result.error}' if result.error else '')]
+    heading = 'label' if by == 'label' else 'line'
+    lines.append(f'{"instructions":>12} {"%":>6} {"loads":>9} {"stores":>9} {"calls":>8}'
+                 + (f' {"called":>8}' if by == 'label' else '') + f'  {heading}')
+    for key, counts in ranked:
+        share = 100 * counts.instructions / max(total.instructions, 1)
+        row = f'{counts.instructions:>12} {share:>6.2f} {counts.loads:>9} {counts.stores:>9} {counts.calls:>8}'
+        if by == 'label':
+            row += f' {result.calls_to.get(key, 0):>8}  {key if key is not None else "(none)"}'
+        elif key is None:
+            row += '  (not annotated)'
+        else:
+            text = source_lines[key - 1].strip() if source_lines and key <= len(source_lines) else ''
+            row += f'  {key:>5}  {text}'
+        lines.append(row)
+    return '\n'.join(lines)
+
+
+def parse_arguments(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Profile a run of a MIPS assembly file.')
+    arg_parser.add_argument('asm_file', help='the .asm file to profile')
+    arg_parser.add_argument('--by', choices=('label', 'line'), default='label',
+                            help='count by label, or by annotated Nimble source line (default: %(default)s)')
+    arg_parser.add_argument('--top', type=int, default=20,
+                            help='how many of the hottest labels or lines to list (default: %(default)s)')
+    arg_parser.add_argument('--source', help='the Nimble source file, to show its lines')
+    arg_parser.add_argument('--max-steps', type=int, default=DEFAULT_MAX_STEPS,
+                            help='give up after running this many instructions (default: %(default)s)')
+    return arg_parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    arguments = parse_arguments()
+    with open(arguments.asm_file) as asm_file:
+        program_profile = profile(asm_file.read(), arguments.max_steps)
+    source_text = None
+    if arguments.source:
+        with open(arguments.source) as source_file:
+            source_text = source_file.read().splitlines()
+    print(report(program_profile, arguments.by, arguments.top, source_text))
+    if program_profile.error:
+        sys.exit(1)
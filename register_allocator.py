@@ -0,0 +1,120 @@
+"""
+Register allocation for expressions, by Sethi-Ullman numbering.
+
+The templates compute binary operations by evaluating the left operand into $t0,
+pushing it on the stack, evaluating the right operand into $t0 and popping the left
+back into $s1. For expressions whose evaluation has no side effects and calls no
+functions (literals, variables, and arithmetic, comparisons and negations of them),
+the operands can instead be kept in registers $t0-$t9.
+
+Such expressions are built up as `Expression` trees. Each node knows how many
+registers it needs to be evaluated without spilling: one for an operand, and for a
+binary operation the larger of its children's needs, or one more than that if both
+need the same number. Evaluating the needier child first, into the first of the
+available registers, leaves all but one register free for the other child. Only when
+both children need every available register is the first result spilled to the stack.
+"""
+
+from abc import ABC, abstractmethod
+
+TEMPORARY_REGISTERS = tuple(f'$t{i}' for i in range(10))
+
+
+class Expression(ABC):
+    """A side-effect-free expression, computable in registers."""
+
+    need = 1
+
+    def code(self, registers=TEMPORARY_REGISTERS):
+        """
+        Returns the code computing the expression into `registers[0]`, using only the
+        given registers and, if those run out, the stack.
+        """
+        lines = []
+        pending = [(self, registers)]  # expressions to compute, or lines to emit when reached
+        while pending:
+            item = pending.pop()
+            if isinstance(item, str):
+                lines.append(item)
+            else:
+                expression, available = item
+                expression.schedule(available, lines, pending)
+        return '\n'.join(lines)
+
+    @abstractmethod
+    def schedule(self, registers, lines, pending):
+        """
+        Emits the expression's code to `lines`, or pushes on `pending`, in reverse order,
+        the lines and (expression, registers) pairs to emit in its place.
+        """
+
+
+class Operand(Expression):
+    """
+    A literal or variable, loaded by a single instruction given as a template with a
+    `{register}` field for the destination.
+    """
+
+    def __init__(self, template):
+        self.template = template
+
+    def schedule(self, registers, lines, pending):
+        lines.append(self.template.format(register=registers[0]))
+
+
+class UnaryOperation(Expression):
+    """
+    An operation on a single operand, computed in place by an instruction given as a
+    template with a `{register}` field.
+    """
+
+    def __init__(self, template, operand):
+        self.template = template
+        self.operand = operand
+        self.need = operand.need
+
+    def schedule(self, registers, lines, pending):
+        pending.append(self.template.format(register=registers[0]))
+        pending.append((self.operand, registers))
+
+
+class BinaryOperation(Expression):
+    """An operation such as `add` or `slt`, with destination and two source registers."""
+
+    def __init__(self, operation, left, right):
+        self.operation = operation
+        self.left = left
+        self.right = right
+        if left.need == right.need:
+            self.need = left.need + 1
+        else:
+            self.need = max(left.need, right.need)
+
+    def schedule(self, registers, lines, pending):
+        result = registers[0]
+        if min(self.left.need, self.right.need) >= len(registers):
+            # Each operand needs all the registers: spill the left one while computing the right
+            spill = registers[1]
+            pending.extend(reversed([
+                (self.left, registers),
+                'addiu  $sp $sp -4',
+                f'sw     {result} 4($sp)',
+                (self.right, registers),
+                f'lw     {spill} 4($sp)',
+                'addiu  $sp $sp 4',
+                f'{self.operation:<6} {result} {spill} {result}'
+            ]))
+        elif self.right.need > self.left.need:
+            left = registers[1]
+            pending.extend(reversed([
+                (self.right, registers),
+                (self.left, registers[1:]),
+                f'{self.operation:<6} {result} {left} {result}'
+            ]))
+        else:
+            right = registers[1]
+            pending.extend(reversed([
+                (self.left, registers),
+                (self.right, registers[1:]),
+                f'{self.operation:<6} {result} {result} {right}'
+            ]))
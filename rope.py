@@ -0,0 +1,86 @@
+"""
+Ropes of generated code: a rope is either a string or a list of ropes, and stands for
+the concatenation of its parts. Building a parent's code as a list holding its
+children's ropes costs the same however much code the children hold, whereas
+formatting child strings into the parent's template copies all of that code once per
+level of nesting. A rope is flattened into a single string just once, at the end.
+
+Any other object found in a rope stands for `str()` of itself.
+"""
+
+from string import Formatter
+
+_formatter = Formatter()
+_parsed_templates = {}  # template -> [(literal text, field name, format spec, conversion)]
+
+
+def fill(template, **fields):
+    """
+    Like `template.format(**fields)`, but returns a rope in which rope field values
+    are included as they are, rather than copied into a new string.
+    """
+    parsed = _parsed_templates.get(template)
+    if parsed is None:
+        parsed = _parsed_templates[template] = list(_formatter.parse(template))
+    rope = []
+    for literal, field_name, format_spec, conversion in parsed:
+        if literal:
+            rope.append(literal)
+        if field_name is None:
+            continue
+        value = fields[field_name]
+        if conversion:
+            value = _formatter.convert_field(value, conversion)
+        if format_spec:
+            value = format(value, format_spec)
+        rope.append(value)
+    return rope
+
+
+def fill_around(template, *holes, **fields):
+    """
+    Fills `template` like `fill`, except for the fields named in `holes`, returning the
+    ropes for the parts of the template before, between and after those fields.
+    """
+    markers = {name: object() for name in holes}
+    marker_ids = {id(marker) for marker in markers.values()}
+    pieces = [[]]
+    for part in fill(template, **fields, **markers):
+        if id(part) in marker_ids:
+            pieces.append([])
+        else:
+            pieces[-1].append(part)
+    return pieces
+
+
+def join(separator, ropes):
+    """Like `separator.join(ropes)`, but returns a rope."""
+    rope = []
+    for i, part in enumerate(ropes):
+        if i:
+            rope.append(separator)
+        rope.append(part)
+    return rope
+
+
+def fragments(rope):
+    """Generates the strings making up `rope`, in order, without recursion."""
+    stack = [rope]
+    while stack:
+        part = stack.pop()
+        if isinstance(part, str):
+            yield part
+        elif isinstance(part, list):
+            stack.extend(reversed(part))
+        else:
+            yield str(part)
+
+
+def flatten(rope):
+    """Returns the string `rope` stands for."""
+    return ''.join(fragments(rope))
+
+
+def write(rope, out):
+    """Writes the string `rope` stands for to the file object `out`."""
+    out.writelines(fragments(rope))
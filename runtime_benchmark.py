@@ -0,0 +1,147 @@
+"""
+Benchmarks the code the compiler generates, by running a set of Nimble kernels on
+`mips_simulator` and checking their output against what is expected.
+
+Each kernel is a `.nimble` file in `benchmark_kernels`, with its expected output in
+the `.expected` file of the same name. They stress different parts of the generated
+code: calls and returns (`fibonacci`), string concatenation (`string_building`),
+integer arithmetic in loops (`nested_loops`) and the string built-ins (`substrings`).
+`guarded_substrings` checks that built-in calls which would fail, but are guarded by
+conditions or in loops that never run, aren't hoisted out of their loops.
+
+For each kernel, the number of instructions run is reported, with the high-water
+marks of the stack and the heap, and the number of instructions in its code. Being
+counted rather than timed, these are exactly reproducible, so that the effect of
+any change to the code generators can be measured.
+
+`--save PATH` stores the results as a JSON baseline; `--compare PATH` reports the
+changes from a baseline, and exits with status 1 if any kernel runs more
+instructions than it did. The exit status is also 1 if any kernel fails.
+
+Usage: python runtime_benchmark.py [--backend {templates,ir}] [--length-prefixed-strings]
+    [--inline-concat-in-loops] [--peephole] [--save PATH] [--compare PATH] [kernel ...]
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from batch_compile import CompileOptions, compile_nimble
+from mips_simulator import DEFAULT_MAX_STEPS, Machine, MIPSError, assemble
+
+KERNEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_kernels')
+MEASURES = ('steps', 'stack_used', 'heap_used', 'code_size')
+
+
+def kernel_names(kernel_dir=KERNEL_DIR):
+    return sorted(name[:-len('.nimble')] for name in os.listdir(kernel_dir) if name.endswith('.nimble'))
+
+
+def run_kernel(name, options=CompileOptions(), max_steps=DEFAULT_MAX_STEPS, kernel_dir=KERNEL_DIR):
+    """
+    Compiles and runs the named kernel, returning its measures and whether it passed,
+    i.e. printed exactly its expected output; if not, `error` says why.
+    """
+    path = os.path.join(kernel_dir, f'{name}.nimble')
+    result = {'passed': False, 'error': None}
+    output, error_found = compile_nimble(path, name, from_file=True, options=options)
+    if error_found:
+        result['error'] = output.strip()
+        return result
+    executable = assemble(output)
+    machine = Machine(executable)
+    try:
+        printed = machine.run(max_steps)
+    except MIPSError as error:
+        printed, result['error'] = ''.join(machine.output), str(error)
+    result.update(steps=machine.steps, stack_used=machine.stack_used, heap_used=machine.heap_used,
+                  code_size=len(executable.text))
+    with open(os.path.join(kernel_dir, f'{name}.expected')) as expected_file:
+        expected = expected_file.read()
+    if result['error'] is None and printed != expected:
+        result['error'] = 'output differs from expected'
+    result['passed'] = result['error'] is None
+    return result
+
+
+def run_kernels(names, options=CompileOptions(), max_steps=DEFAULT_MAX_STEPS):
+    """Runs each of the named kernels, returning the results as a baseline."""
+    return {'options': repr(options),
+            'kernels': {name: run_kernel(name, options, max_steps) for name in names}}
+
+
+def format_results(results):
+    kernels = results['kernels']
+    width = max(len(name) for name in [*kernels, 'kernel'])
+    lines = [f'{"kernel":<{width}} {"result":>6} {"instructions":>12} {"stack B":>8} {"heap B":>8} {"code":>6}']
+    for name, result in kernels.items():
+        row = f'{name:<{width}} {"ok" if result["passed"] else "FAILED":>6}'
+        if 'steps' in result:
+            row += (f' {result["steps"]:>12} {result["stack_used"]:>8} {result["heap_used"]:>8}'
+                    f' {result["code_size"]:>6}')
+        lines.append(row)
+        if result['error']:
+            lines.append(f'    {result["error"]}')
+    return '\n'.join(lines)
+
+
+def compare(results, baseline):
+    """
+    Compares `results` with a `baseline`, returning a report of the measures that
+    changed, and whether any kernel regressed: ran more instructions.
+    """
+    lines = []
+    if results['options'] != baseline['options']:
+        lines.append(f'warning: baseline compiled with {baseline["options"]}')
+    regressed = False
+    for name, result in results['kernels'].items():
+        before = baseline['kernels'].get(name)
+        if before is None or 'steps' not in before or 'steps' not in result:
+            lines.append(f'{name}: nothing to compare')
+            continue
+        changes = []
+        for measure in MEASURES:
+            if result[measure] != before[measure]:
+                change = 100 * (result[measure] - before[measure]) / max(before[measure], 1)
+                changes.append(f'{measure} {before[measure]} -> {result[measure]} ({change:+.1f}%)')
+        regressed = regressed or result['steps'] > before['steps']
+        lines.append(f'{name}: ' + ('; '.join(changes) if changes else 'unchanged'))
+    return '\n'.join(lines), regressed
+
+
+def parse_arguments(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Run the benchmark kernels on the MIPS simulator.')
+    arg_parser.add_argument('kernels', nargs='*', metavar='kernel',
+                            help='names of the kernels to run (default: all of them)')
+    arg_parser.add_argument('--backend', choices=('templates', 'ir'), default='templates',
+                            help='code generator to benchmark (default: %(default)s)')
+    arg_parser.add_argument('--length-prefixed-strings', action='store_true',
+                            help='store each string with its length')
+    arg_parser.add_argument('--inline-concat-in-loops', action='store_true',
+                            help='inline string concatenations in while loops')
+    arg_parser.add_argument('--peephole', action='store_true', help='peephole optimize the generated MIPS')
+    arg_parser.add_argument('--max-steps', type=int, default=DEFAULT_MAX_STEPS,
+                            help='give up on a kernel after running this many instructions (default: %(default)s)')
+    arg_parser.add_argument('--save', metavar='PATH', help='save the results as a JSON baseline')
+    arg_parser.add_argument('--compare', metavar='PATH', help='compare the results with a saved baseline')
+    return arg_parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    arguments = parse_arguments()
+    compile_options = CompileOptions(peephole=arguments.peephole, backend=arguments.backend,
+                                     length_prefixed_strings=arguments.length_prefixed_strings,
+                                     inline_concat_in_loops=arguments.inline_concat_in_loops)
+    kernel_results = run_kernels(arguments.kernels or kernel_names(), compile_options, arguments.max_steps)
+    print(format_results(kernel_results))
+    if arguments.save:
+        with open(arguments.save, 'w') as f:
+            json.dump(kernel_results, f, indent=2)
+    any_regressed = False
+    if arguments.compare:
+        with open(arguments.compare) as f:
+            report, any_regressed = compare(kernel_results, json.load(f))
+        print(report)
+    if any_regressed or not all(result['passed'] for result in kernel_results['kernels'].values()):
+        sys.exit(1)
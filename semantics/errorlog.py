@@ -92,6 +92,9 @@ class ErrorLog:
     def total_entries(self):
         return sum(len(entry) for entry in self.__entries.values())
 
+    def is_empty(self):
+        return not any(self.__entries.values())
+
     def __str__(self):
         error_list = [str(entry)
                       for line in sorted(self.__entries.keys())
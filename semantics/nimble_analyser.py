@@ -2,11 +2,15 @@
 Performs semantic analysis of a provided parse tree, returning the computed
 global scope object for use in code generation.
 
+Optionally, a further listener (e.g., the code generator) can be driven in the same
+tree traversal as type inference, rather than in a separate walk afterwards.
+
 Author: Greg Phillips
 Version: 2023-03-15
 """
 
-from antlr4 import ParseTreeWalker
+from phase_timing import untimed
+from tree_walker import DispatchTableWalker
 from .errorlog import ErrorLog
 from .nimblesemantics import InferTypesAndCheckConstraints, DefineScopesAndSymbols
 from .symboltable import Scope
@@ -21,16 +25,43 @@ class NimbleSemanticErrors(Exception):
         return repr(self.error_log)
 
 
-def do_semantic_analysis(tree):
+def do_semantic_analysis(tree, fused_listener_factory=None, phases=None):
+    """
+    :param tree: The parse tree of a Nimble script
+    :param fused_listener_factory: Optional; called with the global scope and node types
+        map, it returns a listener, or a list of listeners, to walk together with type
+        inference. At each node, their events follow type inference's, in list order,
+        so the types of the node and its children are known on exit. They stop
+        receiving events as soon as any semantic error has been logged.
+    :param phases: Optional; a `phase_timing.PhaseTimes` to time each walk in, as the
+        `scopes` and `types` phases. The further listeners are then walked separately,
+        after type inference and only if it found no errors, as the `codegen` phase.
+    :return: The global scope and node types map
+    """
     error_log = ErrorLog()
     global_scope = Scope('$global', None, None)
     node_types = {}
 
     scopes_and_symbols = DefineScopesAndSymbols(error_log, global_scope, node_types)
-    walker = ParseTreeWalker()
-    walker.walk(scopes_and_symbols, tree)
+    walker = DispatchTableWalker()
+    phase = phases.phase if phases is not None else untimed
+    # function and main scopes are all defined by direct children of the script
+    with phase('scopes'):
+        walker.walk(scopes_and_symbols, tree, max_depth=1)
     types_and_constraints = InferTypesAndCheckConstraints(error_log, global_scope, node_types)
-    walker.walk(types_and_constraints, tree)
+    if fused_listener_factory is None or phases is not None:
+        with phase('types'):
+            walker.walk(types_and_constraints, tree)
+        if fused_listener_factory is not None and error_log.is_empty():
+            with phase('codegen'):
+                listeners = fused_listener_factory(global_scope, node_types)
+                walker.walk_all(listeners if isinstance(listeners, list) else [listeners], tree)
+    else:
+        fused_listeners = fused_listener_factory(global_scope, node_types)
+        if not isinstance(fused_listeners, list):
+            fused_listeners = [fused_listeners]
+        listeners = [types_and_constraints] + fused_listeners
+        walker.walk_all(listeners, tree, guard=error_log.is_empty)
 
     if error_log.total_entries():
         raise NimbleSemanticErrors(error_log)
@@ -0,0 +1,218 @@
+"""
+Generates synthetic Nimble programs for benchmarking the compiler, scaled along
+independent axes (see `Scale`): the number of functions, the number of statements
+in each function and in main, how deeply expressions nest, how many distinct string
+literals appear, and how long the chains of nested function calls are.
+
+Programs are pseudo-random but reproducible: the same `Scale`, seed included, always
+gives the same program. They are valid Nimble, free of semantic errors, and stick to
+code that runs without trapping: loops count up to a small bound, divisors are
+non-zero literals, and every `String` variable is initialized. They are made to
+exercise the compiler though, not to run quickly: calls in loops multiply along call
+chains, so their run time grows exponentially with the call depth.
+
+The functions are split into chains of `call_depth` functions, each calling the next
+in its chain, and main calls the first function of each chain. Every function takes
+an `Int` and a `String` and returns an `Int`.
+
+Usage: python synthetic_nimble.py [--functions N] [--statements N] [--expression-depth N]
+    [--string-literals N] [--call-depth N] [--seed N]
+"""
+
+import argparse
+import random
+from dataclasses import dataclass
+
+# number of each type of local variable declared in each function and in main
+LOCALS_PER_TYPE = 3
+LOOP_BOUND = 3
+
+
+@dataclass(frozen=True)
+class Scale:
+    """The size of a synthetic program, along each axis."""
+    functions: int = 8
+    statements: int = 20  # in each function body and in main, nested ones included
+    expression_depth: int = 3  # of the nesting of operators and calls in expressions
+    string_literals: int = 8  # distinct ones, over the whole program
+    call_depth: int = 2  # length of the chains of functions calling each other
+    seed: int = 0
+
+
+class ProgramGenerator:
+    """Generates the program for a `Scale`; see `generate_program`."""
+
+    def __init__(self, scale):
+        self.scale = scale
+        self.random = random.Random(scale.seed)
+        self.literals = [f'"lit{i}_{self.random.choice("abcdefgh") * (1 + i % 5)}"'
+                         for i in range(scale.string_literals)]
+        self.unused_literals = list(reversed(self.literals))
+        self.callee = None  # the function the function being generated may call
+        self.loop_counters = 0
+
+    # --------------------------------------------------------
+    # Expressions
+    # --------------------------------------------------------
+
+    def literal(self):
+        """A string literal, handing out each once before repeating any."""
+        if self.unused_literals:
+            return self.unused_literals.pop()
+        return self.random.choice(self.literals) if self.literals else '""'
+
+    def variable(self, prefix):
+        return f'{prefix}{self.random.randrange(LOCALS_PER_TYPE)}'
+
+    def int_expr(self, depth):
+        """
+        An Int expression nesting `depth` deep. Only one operand of each operator nests
+        further, so the size of an expression grows linearly with its depth.
+        """
+        choice = self.random.random()
+        if depth <= 0:
+            if choice < 0.4:
+                return str(self.random.randrange(100))
+            if choice < 0.8:
+                return self.variable('x')
+            return f'stringlength({self.variable("s")})'
+        if choice < 0.1:
+            return f'-({self.int_expr(depth - 1)})'
+        if choice < 0.2:
+            return f'({self.int_expr(depth - 1)})'
+        if choice < 0.35 and self.callee is not None:
+            return f'{self.callee}({self.int_expr(depth - 1)}, {self.string_expr(0)})'
+        if choice < 0.45:
+            return f'({self.int_expr(depth - 1)}) / {self.random.randrange(1, 10)}'
+        operands = [f'({self.int_expr(depth - 1)})', self.int_expr(0)]
+        self.random.shuffle(operands)
+        return f' {self.random.choice("+-*")} '.join(operands)
+
+    def bool_expr(self, depth):
+        choice = self.random.random()
+        if depth <= 0:
+            return self.variable('b') if choice < 0.5 else self.random.choice(('true', 'false'))
+        if choice < 0.2:
+            return f'!({self.bool_expr(depth - 1)})'
+        operands = [f'({self.int_expr(depth - 1)})', self.int_expr(0)]
+        self.random.shuffle(operands)
+        return f' {self.random.choice(("<", "<=", "=="))} '.join(operands)
+
+    def string_expr(self, depth):
+        choice = self.random.random()
+        if depth <= 0:
+            return self.literal() if choice < 0.5 else self.variable('s')
+        if choice < 0.2 and self.literals:
+            return f'substring({self.literal()}, 0, 1)'
+        operands = [f'({self.string_expr(depth - 1)})', self.string_expr(0)]
+        self.random.shuffle(operands)
+        return ' + '.join(operands)
+
+    # --------------------------------------------------------
+    # Statements
+    # --------------------------------------------------------
+
+    def block(self, statements, indent):
+        """`statements` statements, nested ones included, as lines indented by `indent`."""
+        lines = []
+        while statements > 0:
+            statement, used = self.statement(statements, indent)
+            lines.extend(statement)
+            statements -= used
+        return lines
+
+    def statement(self, budget, indent):
+        """A statement, using up to `budget` of the statement count; returns its lines and count."""
+        pad = '    ' * indent
+        depth = self.scale.expression_depth
+        choice = self.random.random()
+        if budget >= 3 and choice < 0.15:
+            inner = self.random.randint(1, min(budget - 2, 4))
+            counter = f'i{self.loop_counters}'
+            self.loop_counters += 1
+            lines = [f'{pad}{counter} = 0', f'{pad}while {counter} < {LOOP_BOUND} {{',
+                     *self.block(inner, indent + 1), f'{pad}    {counter} = {counter} + 1', f'{pad}}}']
+            return lines, inner + 2
+        if budget >= 2 and choice < 0.3:
+            then_count = self.random.randint(1, min(budget - 1, 4))
+            lines = [f'{pad}if {self.bool_expr(depth)} {{', *self.block(then_count, indent + 1)]
+            else_count = min(budget - 1 - then_count, self.random.randint(0, 3))
+            if else_count:
+                lines += [f'{pad}}} else {{', *self.block(else_count, indent + 1)]
+            return lines + [f'{pad}}}'], 1 + then_count + else_count
+        if choice < 0.45:
+            return [f'{pad}print {self.random.choice((self.int_expr, self.string_expr))(depth)}'], 1
+        if choice < 0.5 and self.callee is not None:
+            return [f'{pad}{self.callee}({self.int_expr(depth)}, {self.string_expr(depth)})'], 1
+        prefix, expr = self.random.choice((('x', self.int_expr), ('x', self.int_expr),
+                                           ('b', self.bool_expr), ('s', self.string_expr)))
+        return [f'{pad}{self.variable(prefix)} = {expr(depth)}'], 1
+
+    def body(self, indent, parameters=True):
+        """A function or main body; a function's locals start from its parameters."""
+        self.loop_counters = 0
+        block = self.block(self.scale.statements, indent)
+        pad = '    ' * indent
+        declarations = []
+        for i in range(LOCALS_PER_TYPE):
+            declarations.append(f'{pad}var x{i} : Int = {"n + " if parameters else ""}{i}')
+            declarations.append(f'{pad}var b{i} : Bool = {"true" if i % 2 else "false"}')
+            declarations.append(f'{pad}var s{i} : String = {"t + " if parameters else ""}{self.literal()}')
+        declarations.extend(f'{pad}var i{i} : Int' for i in range(self.loop_counters))
+        return declarations + block
+
+    # --------------------------------------------------------
+    # Program
+    # --------------------------------------------------------
+
+    def function_name(self, i):
+        return f'f{i}'
+
+    def calls_next(self, i):
+        chain_length = max(self.scale.call_depth, 1)
+        return i % chain_length < chain_length - 1 and i + 1 < self.scale.functions
+
+    def generate(self):
+        lines = []
+        for i in range(self.scale.functions):
+            self.callee = self.function_name(i + 1) if self.calls_next(i) else None
+            lines.append(f'func {self.function_name(i)}(n : Int, t : String) -> Int {{')
+            lines.extend(self.body(1))
+            lines.append(f'    return {self.int_expr(self.scale.expression_depth)}')
+            lines.append('}')
+            lines.append('')
+
+        self.callee = None
+        lines.append('// main')
+        lines.extend(self.body(0, parameters=False))
+        chain_length = max(self.scale.call_depth, 1)
+        for i in range(0, self.scale.functions, chain_length):
+            lines.append(f'print {self.function_name(i)}({i}, {self.literal()})')
+        # every literal appears, however few statements there are
+        while self.unused_literals:
+            lines.append(f'print {self.literal()}')
+        return '\n'.join(lines) + '\n'
+
+
+def generate_program(scale=Scale()):
+    """The Nimble source of the synthetic program of the given `Scale`."""
+    return ProgramGenerator(scale).generate()
+
+
+def parse_arguments(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Print a synthetic Nimble program of the given size.')
+    defaults = Scale()
+    for axis, help_text in (('functions', 'number of functions'),
+                            ('statements', 'statements in each function and in main'),
+                            ('expression_depth', 'nesting depth of expressions'),
+                            ('string_literals', 'number of distinct string literals'),
+                            ('call_depth', 'length of the chains of functions calling each other'),
+                            ('seed', 'seed of the pseudo-random choices')):
+        arg_parser.add_argument(f'--{axis.replace("_", "-")}', type=int, default=getattr(defaults, axis),
+                                help=f'{help_text} (default: %(default)s)')
+    return arg_parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    arguments = parse_arguments()
+    print(generate_program(Scale(**vars(arguments))), end='')
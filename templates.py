@@ -6,7 +6,10 @@ Authors: OCdt Brown & OCdt Velasco
 Date: 13-04-2023
 """
 
-script = """\
+# The script is its data section followed by its text section. When streaming (see
+# nimble2MIPS.StreamingMIPSGenerator), the text section is written first, in pieces.
+
+data_section = """\
 .data
 
 true_string: .asciiz "true"
@@ -14,6 +17,9 @@ false_string: .asciiz "false"
 
 {string_literals}
 
+"""
+
+text_section = """\
 .text
 
 true_false_string:
@@ -31,6 +37,10 @@ jr     $ra
 
 {substring_template}
 
+{stringconcat}
+
+{memcpy}
+
 # ------------------------------------------------------
 
 {func_defs}
@@ -47,6 +57,16 @@ li $v0 10
 syscall
 """
 
+script = data_section + text_section
+
+# String concatenation is normally done by calling the stringconcat built-in routine,
+# which is enter_func_def filled with string_cat (see nimble2MIPS.built_in_functions);
+# unlike for other calls, its operands are pushed in order, the left one first, so
+# are evaluated in order. string_cat itself may instead be inlined at each `+`.
+
+# Only used when an operand has side effects, e.g. calls a function; otherwise
+# operands are kept in registers (see register_allocator.py)
+
 add_sub_mul_div_compare = """\
 {expr0}
 addiu  $sp $sp -4 
@@ -66,6 +86,14 @@ b {startwhile_label}
 {endwhile_label}:
 """
 
+# a loop whose condition is constant true, so it can only be left by returning
+
+while_true = """\
+{startwhile_label}:
+{true_block}
+b {startwhile_label}
+"""
+
 if_else_ = """\
 {condition}
 beqz   $t0 {endif_label}
@@ -129,64 +157,104 @@ sw $t0 0($sp)
 addiu $sp $sp -4
 {expr1}
 
-# load expr1 into registers
+# expr1 in $s2, expr0 in $s5
 move $s2 $t0
-move $s6 $t0
-
-# load expr0 into registers
-lw $s0 4($sp)
 lw $s5 4($sp)
 addiu $sp $sp 4
 
-# Count string chars
-li $s1 0
+# Count string chars: expr0's into $s0, expr1's into $s1
+move $s0 $s5
 {iter_char1}:
     lb $s4 0($s0)
     beqz $s4 {next_1}
-    
-    addiu $s1 1
     addiu $s0 1
     j {iter_char1}
 {next_1}:
+subu $s0 $s0 $s5
 
+move $s1 $s2
 {iter_char2}:
-    lb $s4 0($s2)
+    lb $s4 0($s1)
     beqz $s4 {fin_count}
     addiu $s1 1
-    addiu $s2 1
     j {iter_char2}
 {fin_count}:
-    addiu $s1 1
-    
-# Allocate memory, store return address in $s0 and $s1
+subu $s1 $s1 $s2
+
+# Allocate memory for the chars and null terminator
+addu $a0 $s0 $s1
+addiu $a0 $a0 1
 li $v0 9
-move $a0 $s1
 syscall
-move $s0 $v0
 
 # Copy the chars
-{cp_chars_1}:
-    lb $s4 0($s5)
-    beqz $s4 {next_2}
-    sb $s4 0($s0)
-    addiu $s0 1
-    addiu $s5 1
-    j {cp_chars_1}
-{next_2}:
-
-{cp_chars_2}:
-    lb $s4 0($s6)
-    beqz $s4 {fin_cp}
-    sb $s4 0($s0)
-    addiu $s0 1
-    addiu $s6 1
-    j {cp_chars_2}
-{fin_cp}:
+addiu $sp $sp -4
+sw $ra 4($sp)
+move $a0 $v0
+move $a1 $s5
+move $a2 $s0
+jal .memcpy
+move $a1 $s2
+move $a2 $s1
+jal .memcpy
+lw $ra 4($sp)
+addiu $sp $sp 4
 
     # Adding null term at end
-    li $s4 0
-    sb $s4 0($s0)
-    
+    sb $zero 0($a0)
+
+    # store result of expression in t0
+    move $t0 $v0
+"""
+
+# With length-prefixed strings (see nimble2MIPS.MIPSGenerator), every string is
+# preceded by a word holding its length, and the address of a string is still that
+# of its first character. So lengths are loaded rather than counted: the length of
+# the string whose address is in $t0 is loaded by `lw $t0 -4($t0)`. Heap strings are
+# allocated whole words at a time, so that the length words stay aligned.
+
+string_cat_length_prefixed = """\
+# Load registers with string addresses
+{expr0}
+sw $t0 0($sp)
+addiu $sp $sp -4
+{expr1}
+
+# expr1 in $s2, expr0 in $s5
+move $s2 $t0
+lw $s5 4($sp)
+addiu $sp $sp 4
+
+# Load the lengths, and their sum
+lw $s0 -4($s5)
+lw $s1 -4($s2)
+addu $s3 $s0 $s1
+
+# Allocate the length word, chars and null terminator, rounded up to whole words
+addiu $a0 $s3 8
+li $s4 -4
+and $a0 $a0 $s4
+li $v0 9
+syscall
+sw $s3 0($v0)
+addiu $v0 $v0 4
+
+# Copy the chars
+addiu $sp $sp -4
+sw $ra 4($sp)
+move $a0 $v0
+move $a1 $s5
+move $a2 $s0
+jal .memcpy
+move $a1 $s2
+move $a2 $s1
+jal .memcpy
+lw $ra 4($sp)
+addiu $sp $sp 4
+
+    # Adding null term at end
+    sb $zero 0($a0)
+
     # store result of expression in t0
     move $t0 $v0
 """
@@ -223,6 +291,59 @@ enter_func_def = """\
     jr     $ra
 """
 
+# With line annotations (see nimble2MIPS.MIPSGenerator), the code of each function
+# definition, declaration and statement starts with this comment, giving its line in
+# the Nimble source, so that profiles of the code can be related to the source
+
+line_annotation = """\
+# @line {line}
+"""
+
+# A leaf function, calling no Nimble functions, with no local variables needs no stack
+# frame: the caller's $fp is kept in $s7, which nothing else uses, rather than on the
+# stack. $fp is pointed just below the arguments as usual, so the parameters are still
+# at 8($fp), 12($fp), ...
+
+enter_frameless_func_def = """\
+{func_name}:
+
+    # Keep old $fp in $s7. Make $fp point to just above where the old $fp slot would be
+    move    $s7  $fp
+    addiu   $fp  $sp  -4
+
+    # --- Body of function (no local vars). Finish with return value in $t0 ---
+    
+    {func_body}
+    
+    # Restore old frame pointer and jump to old return address
+    move    $fp  $s7
+    jr     $ra
+"""
+
+frameless_return = """\
+{expr}
+
+# return    
+move    $fp  $s7
+jr      $ra
+"""
+
+# A call of a function from itself, as the last thing it does, reuses the current call
+# rather than making a new one: the arguments are pushed as for a call, then moved into
+# the parameters, and the stack is popped back to where it was at the start of the body.
+
+self_tail_call = """\
+# --- Starting self tail call: pushing args onto the stack ---
+{args_body}
+
+# --- Moving args into the parameters, then popping them and the local vars ---
+{move_args}
+addiu $sp $sp {pop_offset}
+
+# Jump back to the start of the function body
+b {body_label}
+"""
+
 exit_func_call = """\
 # --- Starting Function call: pushing return address onto the stack ---
 addiu $sp $sp -4
@@ -289,49 +410,27 @@ substring:
     lw   $s2  12($fp)
     lw   $s3  16($fp)
     
-    # Move $s1 right <start> amount of times
-    move_s1:
-    
-        beqz   $s2  finished_moving
-        addiu  $s1  1
-        addiu  $s2  -1
-        j      move_s1
-        
-    finished_moving:
+    # Move $s1 right <start> chars
+    addu   $s1  $s1  $s2
     
     # Allocate <length + 1> amount of memory for new string, store returned pointer into $t0 
-    addiu  $s3   1
+    addiu  $a0   $s3  1
     li     $v0   9
-    move   $a0   $s3
     syscall
-    move   $s0   $v0
-    addiu  $s3   -1
-
-    # Make $s0 point to head of new string as well
-    move   $t0   $s0
-    
-    # Copy <length> amount of characters into new $s0 string
-    copy_characters:
+    move   $t0   $v0
     
-        # Check if remaining length to copy is 0
-        beqz   $s3  finish_copy_chars
-        
-        # Copy the current char
-        lb      $s4  0($s1)
-        sb      $s4  0($s0)
-        
-        # Move pointers and decrement length
-        addiu   $s0  1
-        addiu   $s1  1
-        addiu   $s3  -1
-        
-        j copy_characters
-    
-    finish_copy_chars:
+    # Copy <length> amount of characters into the new string
+    addiu   $sp  $sp  -4
+    sw      $ra  4($sp)
+    move    $a0  $v0
+    move    $a1  $s1
+    move    $a2  $s3
+    jal     .memcpy
+    lw      $ra  4($sp)
+    addiu   $sp  $sp  4
     
-        # Put null pointer at end
-        li     $s4  0
-        sb     $s4  0($s0)
+    # Put null terminator at end
+    sb     $zero  0($a0)
 
     # --- Move $sp to bottom of old $fp slot to pop local variables ---
     move    $sp  $fp
@@ -341,4 +440,106 @@ substring:
     lw      $fp 4($fp)
     jr      $ra
     
-"""
\ No newline at end of file
+"""
+
+stringlen_length_prefixed = """\
+stringlength:
+    # No frame needed: load the string's address from the argument, then its length
+    lw     $s0 4($sp)
+    lw     $t0 -4($s0)
+    jr     $ra
+"""
+
+substring_length_prefixed = """\
+substring:
+    # Push old $fp address to stack. Make $fp point to just above old $fp slot 
+    addiu   $sp  $sp  -4
+    sw      $fp  4($sp)
+    move    $fp  $sp
+
+    # --- Body: end with $t0 containing pointer to substring ---
+
+    # $s1 points to the first char to copy, <length> is in $s3
+    lw     $s1  8($fp)
+    lw     $s2  12($fp)
+    lw     $s3  16($fp)
+    addu   $s1  $s1  $s2
+
+    # Allocate the length word, chars and null terminator, rounded up to whole words
+    addiu  $a0  $s3  8
+    li     $s4  -4
+    and    $a0  $a0  $s4
+    li     $v0  9
+    syscall
+    sw     $s3  0($v0)
+    addiu  $t0  $v0  4
+
+    # Copy <length> chars
+    addiu   $sp  $sp  -4
+    sw      $ra  4($sp)
+    move    $a0  $t0
+    move    $a1  $s1
+    move    $a2  $s3
+    jal     .memcpy
+    lw      $ra  4($sp)
+    addiu   $sp  $sp  4
+
+    # Put null terminator at end
+    sb     $zero  0($a0)
+
+    # --- Move $sp to bottom of old $fp slot to pop local variables ---
+    move    $sp  $fp
+    addiu   $sp  $sp  4
+
+    # Restore old frame pointer and jump to old return address
+    lw      $fp 4($fp)
+    jr      $ra
+"""
+
+# Shared by concatenation and substring. Copies whole words at a time where both
+# addresses can be word aligned, and single bytes otherwise. Uses only $a0-$a3 and
+# $v1, so callers' other registers, including $v0, are left alone. Its labels contain
+# '.', which no Nimble identifier can, so they never clash with a user's function.
+
+memcpy = """\
+.memcpy:
+    # Copies $a2 bytes from $a1 to $a0, leaving $a0 and $a1 just past the bytes copied
+    xor    $a3 $a0 $a1
+    andi   $a3 $a3 3
+    bnez   $a3 .memcpy.bytes
+
+    # Both are equally misaligned: copy bytes until they are aligned
+    .memcpy.head:
+        andi   $a3 $a0 3
+        beqz   $a3 .memcpy.words
+        beqz   $a2 .memcpy.done
+        lb     $v1 0($a1)
+        sb     $v1 0($a0)
+        addiu  $a0 $a0 1
+        addiu  $a1 $a1 1
+        addiu  $a2 $a2 -1
+        j      .memcpy.head
+
+    .memcpy.words:
+        slti   $a3 $a2 4
+        bnez   $a3 .memcpy.bytes
+        lw     $v1 0($a1)
+        sw     $v1 0($a0)
+        addiu  $a0 $a0 4
+        addiu  $a1 $a1 4
+        addiu  $a2 $a2 -4
+        j      .memcpy.words
+
+    # The remaining bytes
+    .memcpy.bytes:
+        beqz   $a2 .memcpy.done
+        lb     $v1 0($a1)
+        sb     $v1 0($a0)
+        addiu  $a0 $a0 1
+        addiu  $a1 $a1 1
+        addiu  $a2 $a2 -1
+        j      .memcpy.bytes
+
+    .memcpy.done:
+        jr     $ra
+"""
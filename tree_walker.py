@@ -0,0 +1,216 @@
+"""
+A faster drop-in replacement for antlr4's `ParseTreeWalker`.
+
+`ParseTreeWalker.walk` recurses once per node, checks each node's type with two
+`isinstance` calls, and reaches the listener through `enterEveryRule` plus the
+context's own `enterRule`/`exitRule` double dispatch. `DispatchTableWalker` instead
+walks with an explicit stack, so the depth of the tree is not limited by Python's
+recursion limit, and looks up each node's handlers in a table computed once per
+(listener class, node class) pair. Handlers the listener doesn't override, i.e. the
+no-op stubs of the generated listener base class, are left out of the table entirely.
+
+Events are delivered in exactly the same order as `ParseTreeWalker`.
+
+`walk_all` drives several listeners through a single traversal, each receiving its
+events for a node before the walk moves on, which saves whole traversals when later
+listeners only depend on what earlier ones computed for the same or preceding nodes.
+"""
+
+from antlr4 import ParseTreeListener, ParserRuleContext, TerminalNode, ErrorNode
+
+# marks, on the walk stack, that the node below it is to be exited
+_EXIT = object()
+
+
+def listener_stubs(listener_class):
+    """
+    Returns the names and functions of the no-op methods `listener_class` inherits from
+    `ParseTreeListener` and from generated listener bases (direct subclasses of it).
+    """
+    stub_classes = [c for c in listener_class.__mro__
+                    if c is ParseTreeListener or ParseTreeListener in c.__bases__]
+    return {(name, fn) for c in stub_classes for name, fn in vars(c).items() if callable(fn)}
+
+
+class ListenerDispatch:
+    """
+    The handlers of one listener class: its every-rule and terminal hooks, and per
+    node class, the rule-specific enter and exit methods. Handlers are stored as plain
+    functions, called with the listener as first argument, or None if not overridden.
+    """
+
+    def __init__(self, listener_class):
+        self.listener_class = listener_class
+        self.stubs = listener_stubs(listener_class)
+        self.enter_every_rule = self.handler('enterEveryRule')
+        self.exit_every_rule = self.handler('exitEveryRule')
+        self.visit_terminal = self.handler('visitTerminal')
+        self.visit_error_node = self.handler('visitErrorNode')
+        self.rules = {}  # rule node class -> (enter, exit)
+        self.terminals = {}  # terminal node class -> visit handler
+
+    def handler(self, name):
+        fn = getattr(self.listener_class, name, None)
+        return None if fn is None or (name, fn) in self.stubs else fn
+
+    def for_rule(self, node_class):
+        """
+        The (enter, exit) handlers for nodes of the given rule context class. Generated
+        contexts call `listener.enter<Rule>`/`exit<Rule>` from their `enterRule` and
+        `exitRule`; if a context class doesn't follow that pattern, its own `enterRule`
+        and `exitRule` are used instead.
+        """
+        handlers = self.rules.get(node_class)
+        if handlers is None:
+            handlers = (self._rule_handler(node_class, 'enter'), self._rule_handler(node_class, 'exit'))
+            self.rules[node_class] = handlers
+        return handlers
+
+    def for_terminal(self, node_class):
+        """The handler for terminal (or error) nodes of the given class."""
+        visit = self.visit_error_node if issubclass(node_class, ErrorNode) else self.visit_terminal
+        self.terminals[node_class] = visit
+        return visit
+
+    def _rule_handler(self, node_class, kind):
+        dispatcher = getattr(node_class, f'{kind}Rule')
+        if dispatcher is getattr(ParserRuleContext, f'{kind}Rule'):
+            return None  # the context never notifies listeners
+        name = kind + node_class.__name__[:-len('Context')]
+        if node_class.__name__.endswith('Context') and name in dispatcher.__code__.co_names:
+            return self.handler(name)
+        return lambda listener, ctx: dispatcher(ctx, listener)
+
+
+class DispatchTableWalker:
+    """
+    Walks parse trees depth first without recursion, calling listener methods through
+    per-class dispatch tables. Tables are shared by all walkers.
+    """
+
+    dispatch_tables = {}  # listener class -> ListenerDispatch
+    fused_tables = {}  # tuple of listener classes -> (enter table, exit table), see walk_all
+
+    @classmethod
+    def dispatch_for(cls, listener_class):
+        dispatch = cls.dispatch_tables.get(listener_class)
+        if dispatch is None:
+            dispatch = cls.dispatch_tables[listener_class] = ListenerDispatch(listener_class)
+        return dispatch
+
+    def walk(self, listener, tree, max_depth=None):
+        """
+        Walks `listener` over `tree`. With `max_depth`, nodes deeper than that (the
+        root being at depth 0) are skipped.
+        """
+        dispatch = self.dispatch_for(type(listener))
+        enter_every_rule = dispatch.enter_every_rule
+        exit_every_rule = dispatch.exit_every_rule
+        rule_handlers = dispatch.rules
+        terminal_handlers = dispatch.terminals
+        open_rules = 0  # when a node is popped for entry, this is its depth
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            if node is _EXIT:
+                open_rules -= 1
+                ctx = stack.pop()
+                exit_rule = rule_handlers[ctx.__class__][1]
+                if exit_rule is not None:
+                    exit_rule(listener, ctx)
+                if exit_every_rule is not None:
+                    exit_every_rule(listener, ctx)
+                continue
+
+            handlers = rule_handlers.get(node.__class__)
+            if handlers is None:
+                if node.__class__ in terminal_handlers:
+                    visit = terminal_handlers[node.__class__]
+                elif isinstance(node, TerminalNode):
+                    visit = dispatch.for_terminal(node.__class__)
+                else:
+                    handlers = dispatch.for_rule(node.__class__)
+                if handlers is None:
+                    if visit is not None:
+                        visit(listener, node)
+                    continue
+            if enter_every_rule is not None:
+                enter_every_rule(listener, node)
+            if handlers[0] is not None:
+                handlers[0](listener, node)
+            stack.append(node)
+            stack.append(_EXIT)
+            if node.children and (max_depth is None or open_rules < max_depth):
+                stack.extend(reversed(node.children))
+            open_rules += 1
+
+    def walk_all(self, listeners, tree, guard=None):
+        """
+        Walks all of `listeners` over `tree` in a single traversal. On entering, exiting
+        or visiting each node, the listeners receive their events in list order, so each
+        listener sees exactly the events a separate walk would have given it.
+
+        If `guard` is given, it is called after each event has been delivered to the
+        first listener, if the others handle that event; as soon as it returns False,
+        the other listeners are dropped for the rest of the walk. E.g., a code
+        generator can be dropped as soon as the checker walked ahead of it has found
+        an error.
+        """
+        primary, others = listeners[0], listeners[1:]
+        enter_table, exit_table = self.fused_tables_for(tuple(type(l) for l in listeners))
+        fused = bool(others)
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            if node is _EXIT:
+                node = stack.pop()
+                handlers = exit_table[node.__class__]
+            else:
+                handlers = enter_table.get(node.__class__)
+                if handlers is None:
+                    self.add_fused_handlers(listeners, node.__class__, enter_table, exit_table)
+                    handlers = enter_table[node.__class__]
+                if not isinstance(node, TerminalNode):
+                    stack.append(node)
+                    stack.append(_EXIT)
+                    if node.children:
+                        stack.extend(reversed(node.children))
+            for handler in handlers[0]:
+                handler(primary, node)
+            if fused and handlers[1]:
+                if guard is not None and not guard():
+                    fused = False
+                    continue
+                for handler, i in handlers[1]:
+                    handler(others[i], node)
+
+    @classmethod
+    def fused_tables_for(cls, listener_classes):
+        """
+        Per node class, the handlers to call on entering (or visiting) and exiting nodes
+        when walking listeners of the given classes together, as a pair: the first
+        listener's handler functions, and (function, index) pairs for the others.
+        """
+        tables = cls.fused_tables.get(listener_classes)
+        if tables is None:
+            tables = cls.fused_tables[listener_classes] = ({}, {})
+        return tables
+
+    def add_fused_handlers(self, listeners, node_class, enter_table, exit_table):
+        enters, exits = ([], []), ([], [])
+        for i, listener in enumerate(listeners):
+            dispatch = self.dispatch_for(type(listener))
+            if issubclass(node_class, TerminalNode):
+                node_enters, node_exits = [dispatch.for_terminal(node_class)], []
+            else:
+                enter, exit_ = dispatch.for_rule(node_class)
+                node_enters = [dispatch.enter_every_rule, enter]
+                node_exits = [exit_, dispatch.exit_every_rule]
+            if i == 0:
+                enters[0].extend(fn for fn in node_enters if fn is not None)
+                exits[0].extend(fn for fn in node_exits if fn is not None)
+            else:
+                enters[1].extend((fn, i - 1) for fn in node_enters if fn is not None)
+                exits[1].extend((fn, i - 1) for fn in node_exits if fn is not None)
+        enter_table[node_class] = enters
+        exit_table[node_class] = exits